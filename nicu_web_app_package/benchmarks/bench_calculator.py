@@ -0,0 +1,104 @@
+"""
+NICU Fluid Management App - Calculator Benchmark
+
+Compares the scalar NutritionCalculator.calculate_nutrition_values path with
+the batch path for a ward-round sized recomputation.
+
+Usage:
+    python benchmarks/bench_calculator.py [--sizes 10000 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from models import Patient, NutritionPlan
+from calculator import NutritionCalculator, NUTRIENT_FIELDS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def make_plans(count, seed=42):
+    """
+    Create random nutrition plans spanning all reference solutions.
+    """
+    rng = random.Random(seed)
+    tpn_types = ["NICU-mix", "Samenstelling_B"]
+    lipid_types = ["Intralipid_20%", "SMOF_20%"]
+    glucose_concentrations = ["5%", "10%", "12.5%", "15%", "17.5%", "20%", "25%"]
+    return [
+        NutritionPlan(
+            plan_id=f"NP{i}",
+            patient_id="P001",
+            date=date.today(),
+            tpn_type=rng.choice(tpn_types),
+            tpn_volume=rng.uniform(0, 120),
+            lipid_type=rng.choice(lipid_types),
+            lipid_volume=rng.uniform(0, 40),
+            glucose_concentration=rng.choice(glucose_concentrations),
+            glucose_volume=rng.uniform(0, 100)
+        )
+        for i in range(count)
+    ]
+
+
+def run(size, calculator, patient):
+    plans = make_plans(size)
+
+    start = time.perf_counter()
+    results = calculator.calculate_nutrition_values_batch(plans)
+    batch_time = time.perf_counter() - start
+
+    columns = {
+        "tpn_type": [plan.tpn_type for plan in plans],
+        "tpn_volume": [plan.tpn_volume for plan in plans],
+        "lipid_type": [plan.lipid_type for plan in plans],
+        "lipid_volume": [plan.lipid_volume for plan in plans],
+        "glucose_concentration": [plan.glucose_concentration for plan in plans],
+        "glucose_volume": [plan.glucose_volume for plan in plans],
+    }
+    start = time.perf_counter()
+    calculator.calculate_nutrition_columns(**columns)
+    columns_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for plan in plans:
+        calculator.calculate_nutrition_values(plan, patient)
+    scalar_time = time.perf_counter() - start
+
+    mismatches = sum(
+        1
+        for i, plan in enumerate(plans)
+        for field in NUTRIENT_FIELDS + ("glucose_infusion_rate",)
+        if results[field][i] != getattr(plan, field)
+    )
+
+    print(f"{size:>10} plans | scalar {scalar_time:8.3f}s | batch {batch_time:8.3f}s | "
+          f"columns {columns_time:8.3f}s | speedup {scalar_time / batch_time:6.1f}x | mismatches {mismatches}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000])
+    args = parser.parse_args()
+
+    calculator = NutritionCalculator(
+        os.path.join(DATA_DIR, 'tpn_compositions.json'),
+        os.path.join(DATA_DIR, 'solution_compositions.json'),
+        os.path.join(DATA_DIR, 'fluid_requirements.json')
+    )
+    patient = Patient("P001", 28, 950)
+
+    mismatches = sum(run(size, calculator, patient) for size in args.sizes)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
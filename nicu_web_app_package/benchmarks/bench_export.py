@@ -0,0 +1,99 @@
+"""
+NICU Fluid Management App - Bulk Export Benchmark
+
+Streams GET /api/export/plans in both formats from a SQLite database seeded
+with increasing numbers of nutrition plans, and reports throughput and the
+peak Python memory allocated while streaming. The peak should stay flat as
+the number of rows grows.
+
+Usage:
+    python benchmarks/bench_export.py [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Use a throwaway database, metrics and log directory for the web server
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_export.db')
+os.environ['METRICS_DIR'] = tempfile.mkdtemp()
+os.environ['LOG_DIR'] = tempfile.mkdtemp()
+
+import web_server
+from migrations import CALCULATED_VALUE_COLUMNS
+
+
+def seed(size):
+    """
+    Replace all nutrition plans with size plans of the admin user.
+    """
+    columns = ", ".join(CALCULATED_VALUE_COLUMNS)
+    placeholders = ", ".join("?" for _ in CALCULATED_VALUE_COLUMNS)
+    with web_server.app.app_context():
+        with web_server.db.engine.begin() as connection:
+            connection.exec_driver_sql("DELETE FROM nutrition_plan_db")
+            for chunk_start in range(0, size, 100000):
+                connection.exec_driver_sql(
+                    "INSERT INTO nutrition_plan_db (plan_id, patient_id, user_id, date, total_fluid_target, "
+                    f"tpn_type, tpn_volume, weight_category, reference_version, {columns}) "
+                    f"VALUES (?, 'BP001', 1, ?, 150, 'NICU-mix', 80, 'premature_less_1000g', 'bench', {placeholders})",
+                    [
+                        (f"BNP{i}", date(2020, 1, 1) + timedelta(days=i % 1000))
+                        + tuple(float(i % 97 + column) for column in range(len(CALCULATED_VALUE_COLUMNS)))
+                        for i in range(chunk_start, min(chunk_start + 100000, size))
+                    ]
+                )
+
+
+def stream(client, export_format):
+    """
+    Consume one export response chunk by chunk.
+
+    Returns:
+        Number of bytes received
+    """
+    response = client.get(f'/api/export/plans?format={export_format}')
+    received = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return received
+
+
+def run(size, client):
+    seed(size)
+    for export_format in ('ndjson', 'csv'):
+        start = time.perf_counter()
+        received = stream(client, export_format)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        stream(client, export_format)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{size:>10} plans | {export_format:>6} | {elapsed:8.3f}s | {size / elapsed:>10.0f} rows/s | "
+              f"{received / elapsed / 1e6:7.1f} MB/s | peak memory {peak / 1024:8.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    client = web_server.app.test_client()
+    client.get('/')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+
+    for size in args.sizes:
+        run(size, client)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
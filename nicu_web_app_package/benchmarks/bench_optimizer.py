@@ -0,0 +1,92 @@
+"""
+NICU Fluid Management App - Parenteral Optimizer Benchmark
+
+Times ParenteralOptimizer.solve_batch for a whole ward and larger patient
+sets, against solving the same patients one by one, and
+ParenteralOptimizer.evaluate_grid for what-if grids of increasing size.
+
+Usage:
+    python benchmarks/bench_optimizer.py [--sizes 40 1000 10000] [--grid-steps 1 0.5 0.25]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from models import Patient
+from app import NICUFluidApp
+from optimizer import volume_axis
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def make_patients(count, seed=42):
+    """
+    Create random patients spanning all weight and age categories.
+    """
+    rng = random.Random(seed)
+    patients = [
+        Patient(
+            f"P{i}",
+            rng.uniform(24, 41),
+            rng.randint(500, 4000),
+            postnatal_age=rng.randint(1, 30),
+            phototherapy=rng.choice([None, "Single", "Double"])
+        )
+        for i in range(count)
+    ]
+    enteral_volumes = [rng.uniform(0, 120) for _ in range(count)]
+    return patients, enteral_volumes
+
+
+def run(size, optimizer):
+    patients, enteral_volumes = make_patients(size)
+
+    start = time.perf_counter()
+    solution = optimizer.solve_batch(patients, enteral_volumes)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for patient, enteral_volume in zip(patients, enteral_volumes):
+        optimizer.solve(patient, enteral_volume)
+    single_time = time.perf_counter() - start
+
+    print(f"{size:>10} patients | one by one {single_time:8.3f}s | batch {batch_time:8.3f}s | "
+          f"speedup {single_time / batch_time:6.1f}x | feasible {solution['feasible'].mean():6.1%}")
+
+
+def run_grid(step, optimizer, repeat=5):
+    patient = Patient("P0", 28, 950, postnatal_age=3)
+    axes = (volume_axis(0, 100, 4 * step), volume_axis(0, 40, step), volume_axis(0, 100, 4 * step))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = optimizer.evaluate_grid(patient, *axes, enteral_volume=20, enteral_feeding_type="Breast milk")
+        times.append(time.perf_counter() - start)
+
+    print(f"{result['combinations']:>10} combinations | what-if grid {min(times) * 1000:8.1f}ms | "
+          f"feasible {result['feasible_count']:>8} | pareto {len(result['pareto'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[40, 1000, 10000])
+    parser.add_argument('--grid-steps', type=float, nargs='+', default=[1, 0.5, 0.25])
+    args = parser.parse_args()
+
+    optimizer = NICUFluidApp(DATA_DIR).optimizer
+    for size in args.sizes:
+        run(size, optimizer)
+    for step in args.grid_steps:
+        run_grid(step, optimizer)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
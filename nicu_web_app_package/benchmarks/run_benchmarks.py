@@ -0,0 +1,414 @@
+"""
+NICU Fluid Management App - Benchmark Suite
+
+Times NutritionCalculator, RecommendationEngine,
+NICUFluidApp.get_feeding_schedule/export_nutrition_plan and the main Flask
+routes (through the test client against a throwaway SQLite database) for
+1, 1,000 and 100,000 patients, and writes the results as JSON.
+
+Per-patient operations run once for every patient; operations that write
+files or go through HTTP run --sample times against the full data set.
+With --compare the results are checked against a stored baseline, and the
+run fails when the median time of a benchmark grew by more than
+--threshold.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1 1000 100000] [--output results.json]
+    python benchmarks/run_benchmarks.py --compare baseline.json [--threshold 0.25]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Use a throwaway database, job queue, metrics and log directory for the web server, without worker processes
+BENCH_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(BENCH_DIR, 'bench.db')
+os.environ['JOB_DATABASE'] = os.path.join(BENCH_DIR, 'bench_jobs.db')
+os.environ['JOB_WORKERS'] = '0'
+os.environ['METRICS_DIR'] = os.path.join(BENCH_DIR, 'metrics')
+os.environ['LOG_DIR'] = os.path.join(BENCH_DIR, 'logs')
+
+import web_server
+from app import NICUFluidApp
+from store import BoundedStore
+from calculator import NUTRIENT_FIELDS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+TPN_TYPES = ["NICU-mix", "Samenstelling_B"]
+LIPID_TYPES = ["Intralipid_20%", "SMOF_20%"]
+GLUCOSE_CONCENTRATIONS = ["5%", "10%", "12.5%", "15%", "17.5%", "20%", "25%"]
+FEEDING_TYPES = ["Breast milk", "Donor milk", "Formula"]
+PHOTOTHERAPY = [None, "Single", "Double"]
+CLINICAL_CONDITIONS = ["Normal", "Normal", "Sepsis", "Hyperglycemia"]
+
+
+def make_inputs(count, seed=42):
+    """
+    Create random patient and nutrition plan inputs spanning all reference data.
+
+    Returns:
+        List of (patient_kwargs, plan_kwargs) tuples, one plan per patient
+    """
+    rng = random.Random(seed)
+    inputs = []
+    for i in range(count):
+        birth_weight = rng.randint(500, 4000)
+        patient = {
+            "patient_id": f"BP{i}",
+            "gestational_age_at_birth": round(rng.uniform(24, 41), 1),
+            "birth_weight": birth_weight,
+            "current_weight": birth_weight + rng.randint(-100, 400),
+            "postnatal_age": rng.randint(1, 30),
+            "phototherapy": rng.choice(PHOTOTHERAPY),
+            "clinical_condition": rng.choice(CLINICAL_CONDITIONS),
+        }
+        plan = {
+            "total_fluid_target": rng.choice([None, rng.uniform(80, 180)]),
+            "enteral_volume": rng.uniform(0, 120),
+            "tpn_type": rng.choice(TPN_TYPES),
+            "tpn_volume": rng.uniform(0, 80),
+            "lipid_type": rng.choice(LIPID_TYPES),
+            "lipid_volume": rng.uniform(0, 20),
+            "glucose_concentration": rng.choice(GLUCOSE_CONCENTRATIONS),
+            "glucose_volume": rng.uniform(0, 80),
+            "enteral_feeding_type": rng.choice(FEEDING_TYPES),
+            "enteral_feeding_frequency": rng.choice([0, 8, 12]),
+            "bmf_concentration": rng.choice([0, 0, 2, 4]),
+        }
+        inputs.append((patient, plan))
+    return inputs
+
+
+def summarize(name, size, timings, items=1):
+    """
+    Summarize the timings of one benchmark.
+
+    Args:
+        name: Benchmark name
+        size: Number of patients in the data set
+        timings: Duration of each call in seconds
+        items: Number of patients or plans handled per call
+
+    Returns:
+        Result dictionary with times in milliseconds
+    """
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    result = {
+        "name": name,
+        "size": size,
+        "calls": len(timings),
+        "items_per_call": items,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": p95 * 1000,
+        "max_ms": timings[-1] * 1000,
+        "items_per_s": items * len(timings) / sum(timings) if sum(timings) else None,
+    }
+    print(f"{size:>8} patients | {name:<46} | {result['calls']:>7} calls | p50 {result['p50_ms']:9.3f} ms | "
+          f"p95 {result['p95_ms']:9.3f} ms | {result['items_per_s'] or 0:>12.0f} items/s")
+    return result
+
+
+def measure(name, size, operation, arguments, items=1):
+    """
+    Call operation once per argument and summarize the durations, after one untimed warm-up call.
+    """
+    arguments = list(arguments)
+    if arguments:
+        operation(arguments[0])
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        operation(argument)
+        timings.append(time.perf_counter() - start)
+    return summarize(name, size, timings, items)
+
+
+def bench_app(size, inputs, sample, repeat):
+    """
+    Benchmark the calculator, the recommendation engine, the feeding schedule and plan export in memory.
+
+    Returns:
+        Tuple of (results, number of batch/scalar mismatches)
+    """
+    nicu_app = NICUFluidApp(
+        DATA_DIR,
+        patient_store=BoundedStore(maxsize=size),
+        nutrition_plan_store=BoundedStore(maxsize=size)
+    )
+    for i, (patient, plan) in enumerate(inputs):
+        nicu_app.create_patient(**patient)
+        nicu_app.create_nutrition_plan(f"BNP{i}", patient["patient_id"], date.today(), **plan)
+    patients = [nicu_app.patients[patient["patient_id"]] for patient, _ in inputs]
+    plans = [nicu_app.nutrition_plans[f"BNP{i}"] for i in range(size)]
+    calculator = nicu_app.calculator
+    engine = nicu_app.recommendation_engine
+    results = []
+
+    results.append(measure("calculator.fluid_requirements", size,
+                           calculator.calculate_fluid_requirements, patients))
+
+    batch_results = calculator.calculate_nutrition_values_batch(plans)
+    results.append(measure("calculator.batch", size,
+                           lambda _: calculator.calculate_nutrition_values_batch(plans), range(repeat), size))
+
+    columns = {
+        field: [getattr(plan, field) for plan in plans]
+        for field in ("tpn_type", "tpn_volume", "lipid_type", "lipid_volume", "glucose_concentration",
+                      "glucose_volume", "enteral_volume", "enteral_feeding_type", "bmf_concentration")
+    }
+    results.append(measure("calculator.columns", size,
+                           lambda _: calculator.calculate_nutrition_columns(**columns), range(repeat), size))
+
+    # Each scalar call recomputes every source, as for a newly loaded plan
+    def calculate(i):
+        plans[i].source_contributions.clear()
+        calculator.calculate_nutrition_values(plans[i], patients[i])
+    results.append(measure("calculator.scalar", size, calculate, range(size)))
+
+    mismatches = sum(
+        1
+        for i, plan in enumerate(plans)
+        for field in NUTRIENT_FIELDS + ("glucose_infusion_rate",)
+        if batch_results[field][i] != getattr(plan, field)
+    )
+
+    # Run every check, as for a newly loaded plan
+    def recommend(i):
+        plans[i].recommendation_groups.clear()
+        engine.generate_recommendations(patients[i], plans[i])
+    results.append(measure("recommendations.generate", size, recommend, range(size)))
+
+    results.append(measure("app.get_feeding_schedule", size,
+                           nicu_app.get_feeding_schedule, [plan.plan_id for plan in plans]))
+
+    export_dir = tempfile.mkdtemp(dir=BENCH_DIR)
+    results.append(measure(
+        "app.export_nutrition_plan", size,
+        lambda plan_id: nicu_app.export_nutrition_plan(plan_id, os.path.join(export_dir, f"{plan_id}.json")),
+        [plans[i % size].plan_id for i in range(sample)]
+    ))
+    return results, mismatches
+
+
+def seed_database(inputs):
+    """
+    Replace all patients and nutrition plans with the given ones, owned by the admin user.
+    """
+    patient_columns = ("patient_id", "gestational_age_at_birth", "birth_weight", "current_weight",
+                       "postnatal_age", "phototherapy", "clinical_condition")
+    plan_columns = ("total_fluid_target", "enteral_volume", "tpn_type", "tpn_volume", "lipid_type",
+                    "lipid_volume", "glucose_concentration", "glucose_volume", "enteral_feeding_type",
+                    "enteral_feeding_frequency", "bmf_concentration")
+    created_at = datetime(2020, 1, 1)
+    with web_server.app.app_context():
+        with web_server.db.engine.begin() as connection:
+            connection.exec_driver_sql("DELETE FROM nutrition_plan_db")
+            connection.exec_driver_sql("DELETE FROM patient_db")
+            for chunk_start in range(0, len(inputs), 100000):
+                chunk = range(chunk_start, min(chunk_start + 100000, len(inputs)))
+                connection.exec_driver_sql(
+                    f"INSERT INTO patient_db (user_id, created_at, {', '.join(patient_columns)}) "
+                    f"VALUES (1, ?, {', '.join('?' for _ in patient_columns)})",
+                    [
+                        (created_at + timedelta(seconds=i),) + tuple(inputs[i][0][column] for column in patient_columns)
+                        for i in chunk
+                    ]
+                )
+                connection.exec_driver_sql(
+                    f"INSERT INTO nutrition_plan_db (plan_id, patient_id, user_id, date, weight_category, "
+                    f"total_energy, total_protein, glucose_infusion_rate, total_fluid, reference_version, "
+                    f"{', '.join(plan_columns)}) "
+                    f"VALUES (?, ?, 1, ?, 'premature_less_1000g', ?, ?, ?, ?, 'bench', "
+                    f"{', '.join('?' for _ in plan_columns)})",
+                    [
+                        (f"BNP{i}", f"BP{i}", date(2020, 1, 1) + timedelta(days=i % 1000),
+                         float(i % 120), float(i % 4), float(i % 12), float(i % 180))
+                        + tuple(inputs[i][1][column] for column in plan_columns)
+                        for i in chunk
+                    ]
+                )
+    web_server.nicu_app.patients.clear()
+    web_server.nicu_app.nutrition_plans.clear()
+
+
+def bench_routes(size, inputs, sample, client):
+    """
+    Benchmark the Flask routes through the test client.
+
+    Returns:
+        Tuple of (results, descriptions of failed requests)
+    """
+    seed_database(inputs)
+    rng = random.Random(size)
+    failures = []
+
+    def request(method, url, body=None):
+        response = client.open(url, method=method, json=body)
+        if response.status_code != 200:
+            failures.append(f"{method} {url}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        response.close()
+
+    def plan_body(i):
+        patient, plan = inputs[i]
+        return {
+            "patientId": patient["patient_id"],
+            "totalFluidTarget": plan["total_fluid_target"] or 0,
+            "enteralVolume": plan["enteral_volume"],
+            "tpnType": plan["tpn_type"],
+            "tpnVolume": plan["tpn_volume"],
+            "lipidType": plan["lipid_type"],
+            "lipidVolume": plan["lipid_volume"],
+            "glucoseConcentration": plan["glucose_concentration"],
+            "glucoseVolume": plan["glucose_volume"],
+            "enteralFeedingType": plan["enteral_feeding_type"],
+            "enteralFeedingFrequency": plan["enteral_feeding_frequency"],
+            "bmfConcentration": plan["bmf_concentration"],
+        }
+
+    # Ten drafts edited in turn, each sending one changed input after its first full call
+    calls = itertools.count()
+
+    def recompute_body():
+        call = next(calls)
+        patient, _ = inputs[call % 10 % size]
+        body = {
+            "draftId": f"bench{size}-{call % 10}",
+            "seq": call,
+            "patient": {
+                "patientId": patient["patient_id"],
+                "gestationalAge": patient["gestational_age_at_birth"],
+                "birthWeight": patient["birth_weight"],
+                "currentWeight": patient["current_weight"],
+                "postnatalAge": patient["postnatal_age"],
+                "phototherapy": patient["phototherapy"],
+                "clinicalCondition": patient["clinical_condition"],
+            },
+            "plan": {"tpnVolume": rng.uniform(0, 80)},
+        }
+        if call >= 10:
+            body["baseSeq"] = call - 10
+        else:
+            body["plan"] = {key: value for key, value in plan_body(call % 10 % size).items() if key != "patientId"}
+        return body
+
+    samples = [rng.randrange(size) for _ in range(sample)]
+    routes = [
+        ("GET /api/data/bundle", lambda i: request("GET", "/api/data/bundle"), samples),
+        ("GET /api/patients", lambda i: request("GET", "/api/patients?limit=50"), samples),
+        ("GET /api/patient/<id>", lambda i: request("GET", f"/api/patient/BP{i}"), samples),
+        ("GET /api/nutrition_plans/<id>", lambda i: request("GET", f"/api/nutrition_plans/BP{i}"), samples),
+        ("GET /api/nutrition_plan/<id>", lambda i: request("GET", f"/api/nutrition_plan/BNP{i}"), samples),
+        ("POST /api/nutrition_plan", lambda i: request("POST", "/api/nutrition_plan", plan_body(i)), samples),
+        ("PATCH /api/nutrition_plan/<id>",
+         lambda i: request("PATCH", f"/api/nutrition_plan/BNP{i}", {"tpnVolume": rng.uniform(0, 80)}), samples),
+        ("POST /api/plan/recompute", lambda _: request("POST", "/api/plan/recompute", recompute_body()),
+         range(sample)),
+        # Aggregates over every plan, so it runs fewer times
+        ("GET /api/reports/nutrition_by_weight_category",
+         lambda i: request("GET", "/api/reports/nutrition_by_weight_category"), samples[:max(1, sample // 10)]),
+    ]
+    return [measure(name, size, operation, arguments) for name, operation, arguments in routes], failures
+
+
+def compare(results, baseline, threshold, min_time_ms):
+    """
+    Compare median times with a baseline run.
+
+    Args:
+        results: Result dictionaries of this run
+        baseline: Result dictionaries of the baseline run
+        threshold: Allowed relative slowdown, e.g. 0.25 for 25%
+        min_time_ms: Times below this are compared as this, to ignore timer noise
+
+    Returns:
+        Number of regressions
+    """
+    baseline_times = {(result["name"], result["size"]): result["p50_ms"] for result in baseline}
+    regressions = 0
+    print(f"\n{'benchmark':<46} {'size':>8} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in results:
+        key = (result["name"], result["size"])
+        if key not in baseline_times:
+            print(f"{result['name']:<46} {result['size']:>8} {'-':>12} {result['p50_ms']:>9.3f} ms {'new':>8}")
+            continue
+        change = max(result["p50_ms"], min_time_ms) / max(baseline_times[key], min_time_ms) - 1
+        regressed = change > threshold
+        regressions += regressed
+        print(f"{result['name']:<46} {result['size']:>8} {baseline_times[key]:>9.3f} ms {result['p50_ms']:>9.3f} ms "
+              f"{change:>+7.0%}{' REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 100000])
+    parser.add_argument('--sample', type=int, default=200,
+                        help='Calls per HTTP route and plan export benchmark')
+    parser.add_argument('--repeat', type=int, default=10, help='Calls per whole-batch benchmark')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Fail on regressions against this results file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown of the median time before a benchmark counts as a regression')
+    parser.add_argument('--min-time-ms', type=float, default=0.05,
+                        help='Floor for times when comparing, to ignore timer noise')
+    args = parser.parse_args()
+
+    client = web_server.app.test_client()
+    client.get('/')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+
+    results = []
+    problems = 0
+    for size in args.sizes:
+        inputs = make_inputs(size)
+        app_results, mismatches = bench_app(size, inputs, args.sample, args.repeat)
+        route_results, failures = bench_routes(size, inputs, args.sample, client)
+        results.extend(app_results + route_results)
+        for failure in failures:
+            print(f"{size:>8} patients | failed request {failure}")
+        if mismatches:
+            print(f"{size:>8} patients | {mismatches} batch/scalar mismatches")
+        problems += mismatches + len(failures)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "sample": args.sample,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_time_ms)
+        print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+        problems += regressions
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+NICU Fluid Management App - Memory Soak Test
+
+Creates and evaluates 1,000,000 nutrition plans (--plans) in one
+NICUFluidApp with the web server's default store sizes, as a long-running
+worker would, and checks that memory stays flat: once the stores are full,
+the resident set size may grow by at most --max-growth-mb, and the live
+Patient and NutritionPlan objects may not outnumber what the stores hold.
+
+The RSS and live object counts are printed at each checkpoint. With
+--tracemalloc the allocation sites that grew most after the warm-up are
+printed too (this slows the run down several times).
+
+Usage:
+    python benchmarks/soak_memory.py [--plans 1000000] [--max-growth-mb 16]
+    python benchmarks/soak_memory.py --plans 200000 --tracemalloc 1 --output soak.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+# Add the src directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import NICUFluidApp
+from memory import MemoryMonitor, count_objects, resident_memory
+from models import Patient, NutritionPlan, PlanEvaluation
+from store import BoundedStore
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+TPN_TYPES = ["NICU-mix", "Samenstelling_B"]
+LIPID_TYPES = ["Intralipid_20%", "SMOF_20%"]
+GLUCOSE_CONCENTRATIONS = ["5%", "10%", "12.5%", "15%", "17.5%", "20%", "25%"]
+FEEDING_TYPES = ["Breast milk", "Donor milk", "Formula"]
+
+# Live objects allowed beyond the store sizes, for the ones referenced by the loop itself
+OBJECT_SLACK = 10
+
+
+def make_patient(rng, patient_id):
+    birth_weight = rng.randint(500, 4000)
+    return {
+        "patient_id": patient_id,
+        "gestational_age_at_birth": round(rng.uniform(24, 41), 1),
+        "birth_weight": birth_weight,
+        "current_weight": birth_weight + rng.randint(-100, 400),
+        "postnatal_age": rng.randint(1, 30),
+        "phototherapy": rng.choice([None, "Single", "Double"]),
+    }
+
+
+def make_plan(rng):
+    return {
+        "total_fluid_target": rng.choice([None, rng.uniform(80, 180)]),
+        "enteral_volume": rng.uniform(0, 120),
+        "tpn_type": rng.choice(TPN_TYPES),
+        "tpn_volume": rng.uniform(0, 80),
+        "lipid_type": rng.choice(LIPID_TYPES),
+        "lipid_volume": rng.uniform(0, 20),
+        "glucose_concentration": rng.choice(GLUCOSE_CONCENTRATIONS),
+        "glucose_volume": rng.uniform(0, 80),
+        "enteral_feeding_type": rng.choice(FEEDING_TYPES),
+        "enteral_feeding_frequency": rng.choice([0, 8, 12]),
+    }
+
+
+def checkpoint(plans, nicu_app, started):
+    """Record memory use after `plans` plans."""
+    gc.collect()
+    return {
+        "plans": plans,
+        "seconds": round(time.perf_counter() - started, 1),
+        "rss_bytes": resident_memory(),
+        "objects": count_objects((Patient, NutritionPlan, PlanEvaluation)),
+        "stores": {"patients": len(nicu_app.patients), "nutrition_plans": len(nicu_app.nutrition_plans)},
+    }
+
+
+def run(args):
+    nicu_app = NICUFluidApp(
+        DATA_DIR,
+        patient_store=BoundedStore(maxsize=args.patient_store),
+        nutrition_plan_store=BoundedStore(maxsize=args.plan_store)
+    )
+    monitor = MemoryMonitor(tempfile.mkdtemp(), interval=0, top_n=args.top, tracemalloc_frames=args.tracemalloc)
+    rng = random.Random(42)
+    today = date.today()
+
+    every = max(1, args.plans // args.checkpoints)
+    warmup = max(int(args.plans * args.warmup), args.plan_store, args.patients)
+    started = time.perf_counter()
+    checkpoints = []
+    baseline = None
+    for i in range(args.plans):
+        patient_id = f"SP{i % args.patients}"
+        if patient_id not in nicu_app.patients:
+            nicu_app.create_patient(**make_patient(rng, patient_id))
+        plan_id = f"SN{i}"
+        nicu_app.create_nutrition_plan(plan_id, patient_id, today, **make_plan(rng))
+        # What a request keeps of a plan: the evaluation, serialized
+        nicu_app.evaluate_plan(plan_id).to_dict()
+
+        done = i + 1
+        if done == warmup:
+            # Snapshot first, so the baseline includes the memory the snapshot itself holds
+            monitor.snapshot()
+            baseline = checkpoint(done, nicu_app, started)
+        if done % every == 0 or done == args.plans:
+            checkpoints.append(checkpoint(done, nicu_app, started))
+            point = checkpoints[-1]
+            print(f"{done:>10,} plans  {point['seconds']:>7.1f}s  rss {point['rss_bytes'] / 2 ** 20:8.1f} MB  "
+                  f"Patient {point['objects']['Patient']:>6}  NutritionPlan {point['objects']['NutritionPlan']:>6}")
+
+    monitor.snapshot()
+    final = checkpoints[-1]
+    failures = []
+    if baseline is None:
+        failures.append(f"--plans must be larger than the warm-up of {warmup} plans")
+    else:
+        growth = final["rss_bytes"] - baseline["rss_bytes"]
+        print(f"\nRSS after warm-up ({warmup:,} plans): {baseline['rss_bytes'] / 2 ** 20:.1f} MB, "
+              f"at the end: {final['rss_bytes'] / 2 ** 20:.1f} MB ({growth / 2 ** 20:+.1f} MB)")
+        if growth > args.max_growth_mb * 2 ** 20:
+            failures.append(f"RSS grew by {growth / 2 ** 20:.1f} MB after the warm-up (limit {args.max_growth_mb} MB)")
+    limits = {"Patient": args.patient_store, "NutritionPlan": args.plan_store}
+    for name, limit in limits.items():
+        if final["objects"][name] > limit + OBJECT_SLACK:
+            failures.append(f"{final['objects'][name]} live {name} objects for a store of {limit}")
+
+    allocations = monitor.report()["allocations"]
+    if allocations:
+        print("\nAllocation sites that changed most after the warm-up:")
+        for site in allocations["since_first"]:
+            print(f"  {site['size_diff_bytes'] / 1024:+10.1f} KiB  {site['count_diff']:+8}  {site['site']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "settings": vars(args),
+                "warmup": baseline,
+                "checkpoints": checkpoints,
+                "allocations": allocations,
+                "failures": failures
+            }, f, indent=2)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plans', type=int, default=1000000)
+    parser.add_argument('--patients', type=int, default=2000, help='Distinct patients the plans are spread over')
+    parser.add_argument('--patient-store', type=int, default=1000, help='Size of the patient store')
+    parser.add_argument('--plan-store', type=int, default=5000, help='Size of the nutrition plan store')
+    parser.add_argument('--checkpoints', type=int, default=20, help='Memory measurements during the run')
+    parser.add_argument('--warmup', type=float, default=0.1,
+                        help='Fraction of the plans created before memory must stay flat')
+    parser.add_argument('--max-growth-mb', type=float, default=16,
+                        help='RSS growth allowed after the warm-up, in MB')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='FRAMES',
+                        help='Trace allocations with this many frames and report the sites that grew')
+    parser.add_argument('--top', type=int, default=10, help='Allocation sites reported with --tracemalloc')
+    parser.add_argument('--output', help='Write the checkpoints as JSON to this file')
+    args = parser.parse_args()
+
+    failures = run(args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("Memory stayed flat")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,41 @@
 NICU Fluid Management App - Main Application
 """
 
-from models import Patient, NutritionPlan
-from calculator import NutritionCalculator, RecommendationEngine
+from models import Patient, NutritionPlan, PlanEvaluation, PLAN_INPUT_FIELDS, SOURCES
+from calculator import NutritionCalculator, RecommendationEngine, NUTRIENT_FIELDS, RECOMMENDATION_CHECKS
+from store import BoundedStore
+from optimizer import ParenteralOptimizer, solution_rows
+from tracing import traced
+from functools import lru_cache
+from itertools import repeat
+from datetime import date
+from types import MappingProxyType
 import json
 import os
+import threading
+
+
+@lru_cache(maxsize=64)
+def feeding_times(frequency):
+    """
+    Get the feeding times for a number of feedings per 24 hours.
+    
+    Args:
+        frequency: Number of feedings per 24 hours
+        
+    Returns:
+        Tuple of times as "HH:MM" strings
+    """
+    # Create a schedule based on frequency
+    times = []
+    hours_between_feeds = 24 / frequency
+    
+    for i in range(frequency):
+        hour = int(i * hours_between_feeds)
+        minute = int((i * hours_between_feeds - hour) * 60)
+        times.append(f"{hour:02d}:{minute:02d}")
+    
+    return tuple(times)
 
 
 class NICUFluidApp:
@@ -13,12 +44,15 @@ class NICUFluidApp:
     Main application class for NICU Fluid Management App.
     Coordinates between models, calculators, and user interface.
     """
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, patient_store=None, nutrition_plan_store=None, draft_store=None):
         """
         Initialize the NICU Fluid Management App.
         
         Args:
             data_dir: Directory containing reference data files
+            patient_store: BoundedStore for patients (default: in-memory only)
+            nutrition_plan_store: BoundedStore for nutrition plans (default: in-memory only)
+            draft_store: BoundedStore for plans being edited live (default: 1000 drafts, one hour)
         """
         self.data_dir = data_dir
         
@@ -26,18 +60,23 @@ class NICUFluidApp:
         tpn_compositions_file = os.path.join(data_dir, 'tpn_compositions.json')
         solution_compositions_file = os.path.join(data_dir, 'solution_compositions.json')
         fluid_requirements_file = os.path.join(data_dir, 'fluid_requirements.json')
+        enteral_compositions_file = os.path.join(data_dir, 'enteral_compositions.json')
         
         self.calculator = NutritionCalculator(
             tpn_compositions_file,
             solution_compositions_file,
-            fluid_requirements_file
+            fluid_requirements_file,
+            enteral_compositions_file=enteral_compositions_file
         )
         
         self.recommendation_engine = RecommendationEngine(self.calculator)
+        self.optimizer = ParenteralOptimizer(self.calculator)
         
-        # Storage for patients and nutrition plans
-        self.patients = {}
-        self.nutrition_plans = {}
+        # Storage for patients and nutrition plans, bounded so memory stays flat under load
+        self.patients = patient_store if patient_store is not None else BoundedStore()
+        self.nutrition_plans = nutrition_plan_store if nutrition_plan_store is not None else BoundedStore()
+        self.drafts = draft_store if draft_store is not None else BoundedStore(maxsize=1000, ttl=3600)
+        self._draft_lock = threading.Lock()
     
     def create_patient(self, patient_id, gestational_age_at_birth, birth_weight, current_weight=None, 
                       postnatal_age=1, phototherapy=None, clinical_condition="Normal"):
@@ -69,6 +108,7 @@ class NICUFluidApp:
         self.patients[patient_id] = patient
         return patient
     
+    @traced()
     def create_nutrition_plan(self, plan_id, patient_id, date, **kwargs):
         """
         Create a new nutrition plan for a patient.
@@ -82,13 +122,42 @@ class NICUFluidApp:
         Returns:
             Newly created NutritionPlan object
         """
-        if patient_id not in self.patients:
-            raise ValueError(f"Patient with ID {patient_id} not found")
+        self._get_patient(patient_id)
         
         nutrition_plan = NutritionPlan(plan_id, patient_id, date, **kwargs)
         self.nutrition_plans[plan_id] = nutrition_plan
         return nutrition_plan
     
+    def _get_patient(self, patient_id):
+        """
+        Look up a patient, loading it from the patient store's backing storage if needed.
+        
+        Args:
+            patient_id: ID of the patient
+            
+        Returns:
+            Patient object
+        """
+        patient = self.patients.get(patient_id)
+        if patient is None:
+            raise ValueError(f"Patient with ID {patient_id} not found")
+        return patient
+    
+    def _get_nutrition_plan(self, plan_id):
+        """
+        Look up a nutrition plan, loading it from the plan store's backing storage if needed.
+        
+        Args:
+            plan_id: ID of the nutrition plan
+            
+        Returns:
+            NutritionPlan object
+        """
+        nutrition_plan = self.nutrition_plans.get(plan_id)
+        if nutrition_plan is None:
+            raise ValueError(f"Nutrition plan with ID {plan_id} not found")
+        return nutrition_plan
+    
     def calculate_fluid_requirements(self, patient_id):
         """
         Calculate fluid requirements for a patient.
@@ -99,10 +168,7 @@ class NICUFluidApp:
         Returns:
             Dictionary with min and max fluid requirements
         """
-        if patient_id not in self.patients:
-            raise ValueError(f"Patient with ID {patient_id} not found")
-        
-        patient = self.patients[patient_id]
+        patient = self._get_patient(patient_id)
         return self.calculator.calculate_fluid_requirements(patient)
     
     def calculate_nutrition_values(self, plan_id):
@@ -115,11 +181,8 @@ class NICUFluidApp:
         Returns:
             Updated NutritionPlan object with calculated values
         """
-        if plan_id not in self.nutrition_plans:
-            raise ValueError(f"Nutrition plan with ID {plan_id} not found")
-        
-        nutrition_plan = self.nutrition_plans[plan_id]
-        patient = self.patients[nutrition_plan.patient_id]
+        nutrition_plan = self._get_nutrition_plan(plan_id)
+        patient = self._get_patient(nutrition_plan.patient_id)
         
         return self.calculator.calculate_nutrition_values(nutrition_plan, patient)
     
@@ -133,17 +196,289 @@ class NICUFluidApp:
         Returns:
             List of recommendation strings
         """
-        if plan_id not in self.nutrition_plans:
-            raise ValueError(f"Nutrition plan with ID {plan_id} not found")
-        
-        nutrition_plan = self.nutrition_plans[plan_id]
-        patient = self.patients[nutrition_plan.patient_id]
+        nutrition_plan = self._get_nutrition_plan(plan_id)
+        patient = self._get_patient(nutrition_plan.patient_id)
         
         # Ensure nutrition values are calculated
         self.calculate_nutrition_values(plan_id)
         
         return self.recommendation_engine.generate_recommendations(patient, nutrition_plan)
     
+    @traced()
+    def evaluate_plan(self, plan_id):
+        """
+        Evaluate a nutrition plan in a single pass.
+        
+        Calculates nutrition values, derived volumes, fluid requirements,
+        recommendations and the feeding schedule, running each step once.
+        
+        Args:
+            plan_id: ID of the nutrition plan
+            
+        Returns:
+            PlanEvaluation with all results for the plan
+        """
+        nutrition_plan = self._get_nutrition_plan(plan_id)
+        patient = self._get_patient(nutrition_plan.patient_id)
+        
+        self.calculator.calculate_nutrition_values(nutrition_plan, patient)
+        return self._complete_evaluation(nutrition_plan, patient)
+    
+    @traced()
+    def evaluate_plans(self, plan_ids):
+        """
+        Evaluate several nutrition plans, calculating their nutrition values in one batch.
+        
+        Args:
+            plan_ids: IDs of the nutrition plans
+            
+        Returns:
+            List of PlanEvaluation objects in the order of plan_ids
+        """
+        nutrition_plans = [self._get_nutrition_plan(plan_id) for plan_id in plan_ids]
+        patients = [self._get_patient(nutrition_plan.patient_id) for nutrition_plan in nutrition_plans]
+        return self.evaluate_detached_plans(nutrition_plans, patients)
+    
+    def evaluate_detached_plans(self, nutrition_plans, patients):
+        """
+        Evaluate nutrition plans that were not taken from the stores, e.g. ones
+        rebuilt from database rows, in one batch. The stores are not changed.
+        
+        Args:
+            nutrition_plans: NutritionPlan objects, updated with their calculated values
+            patients: Patient of each plan, in the same order
+            
+        Returns:
+            List of PlanEvaluation objects in the order of nutrition_plans
+        """
+        self.calculator.update_nutrition_values_batch(nutrition_plans)
+        
+        return [
+            self._complete_evaluation(nutrition_plan, patient)
+            for nutrition_plan, patient in zip(nutrition_plans, patients)
+        ]
+    
+    def suggest_parenteral_volumes(self, patient_ids, enteral_volumes=None, enteral_feeding_types=None,
+                                   bmf_concentrations=None):
+        """
+        Suggest TPN, lipid and glucose volumes for several patients in one batch.
+        
+        Args:
+            patient_ids: IDs of the patients
+            enteral_volumes: Enteral volume per patient in ml/kg/day (default: 0)
+            enteral_feeding_types: Enteral feed type per patient (default: none)
+            bmf_concentrations: Breast milk fortifier concentration per patient in g/100ml (default: 0)
+            
+        Returns:
+            List of dictionaries in the order of patient_ids with the suggested
+            volumes, the resulting nutrition values, the requirement bounds and
+            whether all requirements are met
+        """
+        patients = [self._get_patient(patient_id) for patient_id in patient_ids]
+        suggestions = solution_rows(self.optimizer.solve_batch(
+            patients, enteral_volumes, enteral_feeding_types, bmf_concentrations
+        ))
+        for patient_id, suggestion in zip(patient_ids, suggestions):
+            suggestion["patient_id"] = patient_id
+        return suggestions
+    
+    def evaluate_volume_grid(self, patient_id, tpn_volumes, lipid_volumes, glucose_volumes, tpn_type="NICU-mix",
+                             lipid_type="SMOF_20%", glucose_concentration="10%", target="max", **kwargs):
+        """
+        Evaluate every combination of TPN, lipid and glucose volumes for a patient
+        without creating a plan.
+        
+        Args:
+            patient_id: ID of the patient
+            tpn_volumes: TPN volumes in ml/kg/day to try
+            lipid_volumes: Lipid volumes in ml/kg/day to try
+            glucose_volumes: Glucose volumes in ml/kg/day to try
+            tpn_type: TPN solution to use
+            lipid_type: Lipid solution to use
+            glucose_concentration: Glucose concentration to use (e.g., "10%")
+            target: Point of the requirement ranges to aim for: "min", "mid" or "max"
+            **kwargs: Enteral feeding and result limits, see ParenteralOptimizer.evaluate_grid
+            
+        Returns:
+            Dictionary with the feasible and Pareto-best combinations
+        """
+        patient = self._get_patient(patient_id)
+        optimizer = ParenteralOptimizer(self.calculator, tpn_type, lipid_type, glucose_concentration, target)
+        result = optimizer.evaluate_grid(patient, tpn_volumes, lipid_volumes, glucose_volumes, **kwargs)
+        result["patient_id"] = patient_id
+        return result
+    
+    @traced()
+    def update_nutrition_plan(self, plan_id, **changes):
+        """
+        Change inputs of a nutrition plan and re-evaluate it incrementally.
+        
+        Only the nutrition sources whose inputs changed are recalculated, and
+        only the recommendation checks whose values changed are run again.
+        
+        Args:
+            plan_id: ID of the nutrition plan
+            **changes: New values of fields in PLAN_INPUT_FIELDS
+            
+        Returns:
+            Tuple of (PlanEvaluation, dictionary describing what changed: the
+            input "fields", the recalculated "sources", the changed
+            "calculated_values" and the re-run "recommendation_checks")
+        """
+        nutrition_plan = self._get_nutrition_plan(plan_id)
+        patient = self._get_patient(nutrition_plan.patient_id)
+        return self._update_plan(nutrition_plan, patient, changes)
+    
+    @traced()
+    def recompute_draft(self, draft_id, patient, sequence, base_sequence=None, **inputs):
+        """
+        Evaluate an unsaved nutrition plan that is being edited, reporting what changed.
+        
+        Each draft keeps its plan between calls, so a call only recalculates
+        what its inputs changed. Calls carry increasing sequence numbers; a call
+        that is not newer than the last one applied is stale and ignored.
+        
+        Args:
+            draft_id: Identifier of the draft, unique per user and editor
+            patient: Patient object the plan is for (need not be stored)
+            sequence: Sequence number of this call
+            base_sequence: Sequence number of the last result the caller applied, if any
+            **inputs: Values of fields in PLAN_INPUT_FIELDS
+            
+        Returns:
+            None for a stale call, otherwise a tuple of (PlanEvaluation, dictionary
+            describing what changed as returned by update_nutrition_plan, plus
+            "full", which is True when the caller has to replace all its values)
+        """
+        with self._draft_lock:
+            draft = self.drafts.get(draft_id)
+            if draft is not None and sequence <= draft["sequence"]:
+                return None
+            
+            # Start over when the caller's values are not those of the last call
+            full = draft is None or draft["sequence"] != base_sequence or vars(draft["patient"]) != vars(patient)
+            if full:
+                nutrition_plan = NutritionPlan(draft_id, patient.patient_id, date.today())
+                nutrition_plan.update(**inputs)
+                nutrition_plan.pop_changed_fields()
+                self.calculator.calculate_nutrition_values(nutrition_plan, patient)
+                evaluation = self._complete_evaluation(nutrition_plan, patient)
+                changes = {
+                    "fields": [field for field in PLAN_INPUT_FIELDS if field in inputs],
+                    "sources": list(SOURCES),
+                    "calculated_values": list(self._calculated_values(nutrition_plan)),
+                    "recommendation_checks": [check for check, _ in RECOMMENDATION_CHECKS]
+                }
+            else:
+                nutrition_plan = draft["plan"]
+                evaluation, changes = self._update_plan(nutrition_plan, patient, inputs)
+            
+            self.drafts[draft_id] = {"plan": nutrition_plan, "patient": patient, "sequence": sequence}
+        
+        changes["full"] = full
+        return evaluation, changes
+    
+    def _update_plan(self, nutrition_plan, patient, changes):
+        """
+        Apply input changes to a plan and re-evaluate it incrementally.
+        
+        Args:
+            nutrition_plan: NutritionPlan object to change
+            patient: Patient the plan belongs to
+            changes: Dictionary with new values of fields in PLAN_INPUT_FIELDS
+            
+        Returns:
+            Tuple of (PlanEvaluation, dictionary describing what changed), see update_nutrition_plan
+        """
+        # Bring the plan up to date first so its values can be compared afterwards
+        if self.calculator.stale_sources(nutrition_plan):
+            self.calculator.calculate_nutrition_values(nutrition_plan, patient)
+            nutrition_plan.recommendation_groups = {}
+        previous = self._calculated_values(nutrition_plan)
+        nutrition_plan.pop_changed_fields()
+        
+        fields = nutrition_plan.update(**changes)
+        sources = self.calculator.stale_sources(nutrition_plan)
+        self.calculator.calculate_nutrition_values(nutrition_plan, patient)
+        current = self._calculated_values(nutrition_plan)
+        changed_values = [name for name, value in current.items() if previous[name] != value]
+        checks = [
+            check for check, values in RECOMMENDATION_CHECKS
+            if check not in nutrition_plan.recommendation_groups or any(value in changed_values for value in values)
+        ]
+        nutrition_plan.pop_changed_fields()
+        
+        evaluation = self._complete_evaluation(nutrition_plan, patient, checks=checks)
+        return evaluation, {
+            "fields": fields,
+            "sources": sources,
+            "calculated_values": changed_values,
+            "recommendation_checks": checks
+        }
+    
+    @staticmethod
+    def _calculated_values(nutrition_plan):
+        """
+        Collect the calculated values of a plan, including its volumes.
+        
+        Args:
+            nutrition_plan: NutritionPlan object with calculated values
+            
+        Returns:
+            Dictionary with the nutrition values, glucose infusion rate,
+            total parenteral volume and total fluid
+        """
+        parenteral_volume = nutrition_plan.calculate_parenteral_volume()
+        values = {field: getattr(nutrition_plan, field) for field in NUTRIENT_FIELDS}
+        values["glucose_infusion_rate"] = nutrition_plan.glucose_infusion_rate
+        values["total_parenteral_volume"] = parenteral_volume
+        values["total_fluid"] = nutrition_plan.calculate_total_fluid(parenteral_volume)
+        return values
+    
+    @traced()
+    def _complete_evaluation(self, nutrition_plan, patient, checks=None):
+        """
+        Derive volumes, requirements, recommendations and the feeding schedule
+        for a plan whose nutrition values have been calculated.
+        
+        Args:
+            nutrition_plan: NutritionPlan object with calculated values
+            patient: Patient the plan belongs to
+            checks: Recommendation checks to run again, keeping the plan's
+                earlier results of the others (default: run all checks)
+            
+        Returns:
+            PlanEvaluation with all results for the plan
+        """
+        parenteral_volume = nutrition_plan.calculate_parenteral_volume()
+        total_fluid = nutrition_plan.calculate_total_fluid(parenteral_volume)
+        fluid_requirements = self.calculator.calculate_fluid_requirements(patient)
+        
+        recommendations = self.recommendation_engine.generate_recommendations(
+            patient,
+            nutrition_plan,
+            fluid_requirements=fluid_requirements,
+            total_fluid=total_fluid,
+            checks=checks
+        )
+        
+        calculated_values = {field: getattr(nutrition_plan, field) for field in NUTRIENT_FIELDS}
+        calculated_values["glucose_infusion_rate"] = nutrition_plan.glucose_infusion_rate
+        calculated_values["total_parenteral_volume"] = parenteral_volume
+        calculated_values["total_fluid"] = total_fluid
+        calculated_values["reference_version"] = nutrition_plan.reference_version
+        
+        return PlanEvaluation(
+            plan_id=nutrition_plan.plan_id,
+            patient_id=patient.patient_id,
+            calculated_values=MappingProxyType(calculated_values),
+            fluid_requirements=MappingProxyType(dict(fluid_requirements)),
+            recommendations=tuple(recommendations),
+            feeding_schedule=self._build_feeding_schedule(nutrition_plan),
+            reference_version=nutrition_plan.reference_version,
+            weight_category=patient.get_weight_category()
+        )
+    
     def get_feeding_schedule(self, plan_id):
         """
         Generate a feeding schedule for a nutrition plan.
@@ -154,32 +489,34 @@ class NICUFluidApp:
         Returns:
             List of feeding times and volumes
         """
-        if plan_id not in self.nutrition_plans:
-            raise ValueError(f"Nutrition plan with ID {plan_id} not found")
+        nutrition_plan = self._get_nutrition_plan(plan_id)
         
-        nutrition_plan = self.nutrition_plans[plan_id]
+        return [
+            {"time": time_str, "volume_per_kg": volume_per_kg, "type": feeding_type}
+            for time_str, volume_per_kg, feeding_type in self._build_feeding_schedule(nutrition_plan)
+        ]
+    
+    @traced()
+    def _build_feeding_schedule(self, nutrition_plan):
+        """
+        Build the feeding schedule for a nutrition plan.
         
+        Args:
+            nutrition_plan: NutritionPlan object
+            
+        Returns:
+            Tuple of (time, volume_per_kg, type) per feed
+        """
         if not nutrition_plan.enteral_feeding_frequency or nutrition_plan.enteral_feeding_frequency <= 0:
-            return []
+            return ()
         
         volume_per_feed = nutrition_plan.get_feeding_volume_per_feed()
+        feeding_type = nutrition_plan.enteral_feeding_type
         
-        # Create a schedule based on frequency
-        schedule = []
-        hours_between_feeds = 24 / nutrition_plan.enteral_feeding_frequency
-        
-        for i in range(nutrition_plan.enteral_feeding_frequency):
-            hour = int(i * hours_between_feeds)
-            minute = int((i * hours_between_feeds - hour) * 60)
-            time_str = f"{hour:02d}:{minute:02d}"
-            schedule.append({
-                "time": time_str,
-                "volume_per_kg": volume_per_feed,
-                "type": nutrition_plan.enteral_feeding_type
-            })
-        
-        return schedule
+        times = feeding_times(nutrition_plan.enteral_feeding_frequency)
+        return tuple(zip(times, repeat(volume_per_feed), repeat(feeding_type)))
     
+    @traced()
     def export_nutrition_plan(self, plan_id, filename):
         """
         Export a nutrition plan to a JSON file.
@@ -191,14 +528,10 @@ class NICUFluidApp:
         Returns:
             True if successful, False otherwise
         """
-        if plan_id not in self.nutrition_plans:
-            raise ValueError(f"Nutrition plan with ID {plan_id} not found")
-        
-        nutrition_plan = self.nutrition_plans[plan_id]
-        patient = self.patients[nutrition_plan.patient_id]
-        
-        # Ensure nutrition values are calculated
-        self.calculate_nutrition_values(plan_id)
+        nutrition_plan = self._get_nutrition_plan(plan_id)
+        patient = self._get_patient(nutrition_plan.patient_id)
+        evaluation = self.evaluate_plan(plan_id)
+        results = evaluation.to_dict()
         
         # Create a dictionary with all relevant information
         export_data = {
@@ -217,7 +550,7 @@ class NICUFluidApp:
                 "date": str(nutrition_plan.date),
                 "total_fluid_target": nutrition_plan.total_fluid_target,
                 "enteral_volume": nutrition_plan.enteral_volume,
-                "parenteral_volume": nutrition_plan.calculate_parenteral_volume(),
+                "parenteral_volume": evaluation.calculated_values["total_parenteral_volume"],
                 "tpn_type": nutrition_plan.tpn_type,
                 "tpn_volume": nutrition_plan.tpn_volume,
                 "lipid_type": nutrition_plan.lipid_type,
@@ -228,20 +561,9 @@ class NICUFluidApp:
                 "enteral_feeding_frequency": nutrition_plan.enteral_feeding_frequency,
                 "bmf_concentration": nutrition_plan.bmf_concentration
             },
-            "calculated_values": {
-                "total_energy": nutrition_plan.total_energy,
-                "total_protein": nutrition_plan.total_protein,
-                "total_carbohydrate": nutrition_plan.total_carbohydrate,
-                "total_fat": nutrition_plan.total_fat,
-                "total_sodium": nutrition_plan.total_sodium,
-                "total_potassium": nutrition_plan.total_potassium,
-                "total_calcium": nutrition_plan.total_calcium,
-                "total_phosphate": nutrition_plan.total_phosphate,
-                "total_magnesium": nutrition_plan.total_magnesium,
-                "glucose_infusion_rate": nutrition_plan.glucose_infusion_rate
-            },
-            "recommendations": self.generate_recommendations(plan_id),
-            "feeding_schedule": self.get_feeding_schedule(plan_id)
+            "calculated_values": results["calculated_values"],
+            "recommendations": results["recommendations"],
+            "feeding_schedule": results["feeding_schedule"]
         }
         
         try:
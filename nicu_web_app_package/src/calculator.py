@@ -2,7 +2,141 @@
 NICU Fluid Management App - Calculation Logic
 """
 
-import json
+import threading
+from collections import OrderedDict
+from itertools import repeat
+
+import numpy as np
+
+from reference_data import ReferenceDataSource, NUTRIENT_FIELDS, BMF_FORTIFIER
+from models import SOURCES, SOURCE_FIELDS
+from tracing import traced
+
+
+# Macronutrient requirements per weight category.
+# This would be expanded with actual macronutrient requirements from protocols;
+# for now these are placeholder values.
+MACRONUTRIENT_REQUIREMENTS = {
+    "premature_less_1000g": {
+        "glucose_mg_kg_min": {"min": 4, "max": 12},
+        "protein_g_kg_day": {"min": 2.5, "max": 3.5},
+        "fat_g_kg_day": {"min": 2.5, "max": 3.5}
+    },
+    "premature_1000_1500g": {
+        "glucose_mg_kg_min": {"min": 4, "max": 12},
+        "protein_g_kg_day": {"min": 2.5, "max": 3.5},
+        "fat_g_kg_day": {"min": 2.5, "max": 3.5}
+    },
+    "premature_greater_1500g": {
+        "glucose_mg_kg_min": {"min": 4, "max": 12},
+        "protein_g_kg_day": {"min": 2.0, "max": 3.0},
+        "fat_g_kg_day": {"min": 2.0, "max": 3.0}
+    },
+    "term": {
+        "glucose_mg_kg_min": {"min": 2.5, "max": 5.0},
+        "protein_g_kg_day": {"min": 1.5, "max": 2.5},
+        "fat_g_kg_day": {"min": 1.0, "max": 3.0}
+    }
+}
+
+# (type field, volume field) of the parenteral sources
+SOURCE_FIELDS_BY_NAME = dict(SOURCE_FIELDS)
+
+# Recommendation checks in output order, with the calculated values each one depends on
+RECOMMENDATION_CHECKS = (
+    ("fluid", ("total_fluid",)),
+    ("glucose_infusion_rate", ("glucose_infusion_rate",)),
+    ("protein", ("total_protein",)),
+    ("fat", ("total_fat",)),
+    ("clinical_condition", ()),
+)
+
+
+class RequirementCache:
+    """
+    Bounded LRU cache for requirement lookups.
+    Entries belong to one reference data version and are all dropped
+    as soon as a lookup is made against a different version.
+    """
+    def __init__(self, maxsize=256):
+        """
+        Initialize an empty cache.
+        
+        Args:
+            maxsize: Maximum number of cached entries
+        """
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, version, key):
+        """
+        Look up a cached value.
+        
+        Args:
+            version: Reference data version the caller is using
+            key: Cache key
+            
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, version, key, value):
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+        
+        Args:
+            version: Reference data version the value was computed from
+            key: Cache key
+            value: Value to cache
+        """
+        with self._lock:
+            if version != self.version:
+                return
+            
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with hits, misses, size, maxsize and version
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "version": self.version
+            }
 
 
 class NutritionCalculator:
@@ -10,7 +144,8 @@ class NutritionCalculator:
     Nutrition Calculator for NICU fluid management app.
     Performs calculations for fluid requirements and nutrition values.
     """
-    def __init__(self, tpn_compositions_file, solution_compositions_file, fluid_requirements_file):
+    def __init__(self, tpn_compositions_file, solution_compositions_file, fluid_requirements_file,
+                 reload_interval=1.0, requirement_cache_size=256, enteral_compositions_file=None):
         """
         Initialize the NutritionCalculator with reference data.
         
@@ -18,17 +153,47 @@ class NutritionCalculator:
             tpn_compositions_file: Path to JSON file with TPN composition data
             solution_compositions_file: Path to JSON file with solution composition data
             fluid_requirements_file: Path to JSON file with fluid requirement data
+            reload_interval: Seconds between checks for changed reference data files
+            requirement_cache_size: Maximum number of memoized requirement lookups
+            enteral_compositions_file: Path to JSON file with enteral feed and fortifier
+                compositions (optional; without it enteral feeds contribute no nutrients)
         """
-        # Load reference data from JSON files
-        with open(tpn_compositions_file, 'r') as f:
-            self.tpn_compositions = json.load(f)
+        # Load and compile reference data from JSON files
+        self.reference_source = ReferenceDataSource(
+            tpn_compositions_file,
+            solution_compositions_file,
+            fluid_requirements_file,
+            check_interval=reload_interval,
+            enteral_compositions_file=enteral_compositions_file
+        )
         
-        with open(solution_compositions_file, 'r') as f:
-            self.solution_compositions = json.load(f)
-        
-        with open(fluid_requirements_file, 'r') as f:
-            self.fluid_requirements = json.load(f)
+        # Requirements only depend on the patient's categories, so they are
+        # memoized per (weight category, age category, phototherapy)
+        self.requirement_cache = RequirementCache(requirement_cache_size)
+    
+    @property
+    def reference_data(self):
+        """Current compiled ReferenceData snapshot."""
+        return self.reference_source.current()
     
+    @property
+    def reference_version(self):
+        """Content hash of the reference data currently in use."""
+        return self.reference_data.version
+    
+    @property
+    def tpn_compositions(self):
+        return self.reference_data.tpn_compositions
+    
+    @property
+    def solution_compositions(self):
+        return self.reference_data.solution_compositions
+    
+    @property
+    def fluid_requirements(self):
+        return self.reference_data.fluid_requirements
+    
+    @traced()
     def calculate_fluid_requirements(self, patient):
         """
         Calculate fluid requirements based on patient data.
@@ -37,31 +202,59 @@ class NutritionCalculator:
             patient: Patient object with weight and age information
             
         Returns:
-            Dictionary with min and max fluid requirements in ml/kg/day
+            Dictionary with min and max fluid requirements in ml/kg/day.
+            The dictionary is shared with other callers and must not be modified.
         """
+        reference = self.reference_data
         weight_category = patient.get_weight_category()
         age_category = patient.get_postnatal_age_category()
+        phototherapy = patient.phototherapy.lower() if patient.phototherapy else "none"
         
+        key = ("fluid", weight_category, age_category, phototherapy)
+        fluid_req = self.requirement_cache.get(reference.version, key)
+        if fluid_req is None:
+            fluid_req = self._compute_fluid_requirements(reference, weight_category, age_category, phototherapy)
+            self.requirement_cache.put(reference.version, key, fluid_req)
+        return fluid_req
+    
+    def _compute_fluid_requirements(self, reference, weight_category, age_category, phototherapy):
+        """
+        Compute fluid requirements for a patient category.
+        
+        Args:
+            reference: ReferenceData snapshot
+            weight_category: Weight category name
+            age_category: Postnatal age category name
+            phototherapy: Lowercase phototherapy type, or "none"
+            
+        Returns:
+            Dictionary with min and max fluid requirements in ml/kg/day
+        """
         # Get base fluid requirements
-        if weight_category in self.fluid_requirements["fluid_requirements"] and age_category in self.fluid_requirements["fluid_requirements"][weight_category]:
-            base_req = self.fluid_requirements["fluid_requirements"][weight_category][age_category]
-            min_fluid = base_req["min"]
-            max_fluid = base_req["max"]
-            
-            # Adjust for phototherapy if needed
-            if patient.phototherapy and patient.phototherapy.lower() != "none":
-                photo_adj = self.fluid_requirements["fluid_requirements"]["phototherapy_adjustment"][patient.phototherapy.lower()]
-                min_fluid += photo_adj["min"]
-                max_fluid += photo_adj["max"]
-            
-            return {"min": min_fluid, "max": max_fluid}
-        else:
+        base_req = reference.get_fluid_range(weight_category, age_category)
+        if base_req is None:
             return {"min": 0, "max": 0}
+        
+        min_fluid, max_fluid = base_req
+        
+        # Adjust for phototherapy if needed
+        if phototherapy != "none":
+            photo_min, photo_max = reference.phototherapy_adjustments[phototherapy]
+            min_fluid += photo_min
+            max_fluid += photo_max
+        
+        return {"min": min_fluid, "max": max_fluid}
     
+    @traced()
     def calculate_nutrition_values(self, nutrition_plan, patient):
         """
         Calculate all nutrition values based on the nutrition plan.
         
+        The contribution of each source (TPN, lipid, glucose, enteral) is cached
+        on the plan; only sources whose inputs changed since the last
+        calculation, or that were calculated with other reference data, are
+        recomputed before the totals are summed.
+        
         Args:
             nutrition_plan: NutritionPlan object with volumes and types
             patient: Patient object for reference
@@ -69,53 +262,248 @@ class NutritionCalculator:
         Returns:
             Updated NutritionPlan object with calculated values
         """
-        # Reset calculated values
-        nutrition_plan.total_energy = 0
-        nutrition_plan.total_protein = 0
-        nutrition_plan.total_carbohydrate = 0
-        nutrition_plan.total_fat = 0
-        nutrition_plan.total_sodium = 0
-        nutrition_plan.total_potassium = 0
-        nutrition_plan.total_calcium = 0
-        nutrition_plan.total_phosphate = 0
-        nutrition_plan.total_magnesium = 0
-        
-        # Calculate from TPN
-        if nutrition_plan.tpn_volume > 0 and nutrition_plan.tpn_type in self.tpn_compositions:
-            tpn = self.tpn_compositions[nutrition_plan.tpn_type]
-            nutrition_plan.total_energy += tpn["energy_kcal_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_protein += tpn["protein_g_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_carbohydrate += tpn["carbohydrate_g_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_fat += tpn["fat_g_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_sodium += tpn["sodium_mmol_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_potassium += tpn["potassium_mmol_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_calcium += tpn["calcium_mmol_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_phosphate += tpn["phosphate_mmol_per_ml"] * nutrition_plan.tpn_volume
-            nutrition_plan.total_magnesium += tpn["magnesium_mmol_per_ml"] * nutrition_plan.tpn_volume
-        
-        # Calculate from lipids
-        if nutrition_plan.lipid_volume > 0 and nutrition_plan.lipid_type in self.solution_compositions["lipid_solutions"]:
-            lipid = self.solution_compositions["lipid_solutions"][nutrition_plan.lipid_type]
-            nutrition_plan.total_energy += lipid["energy_kcal_per_ml"] * nutrition_plan.lipid_volume
-            nutrition_plan.total_fat += lipid["fat_g_per_ml"] * nutrition_plan.lipid_volume
-        
-        # Calculate from glucose
-        if nutrition_plan.glucose_volume > 0 and nutrition_plan.glucose_concentration in self.solution_compositions["glucose_solutions"]:
-            glucose = self.solution_compositions["glucose_solutions"][nutrition_plan.glucose_concentration]
-            nutrition_plan.total_energy += glucose["energy_kcal_per_ml"] * nutrition_plan.glucose_volume
-            nutrition_plan.total_carbohydrate += glucose["carbohydrate_g_per_ml"] * nutrition_plan.glucose_volume
-            
-            # Calculate glucose infusion rate (mg/kg/min)
-            glucose_concentration_percent = float(nutrition_plan.glucose_concentration.strip('%'))
-            glucose_mg_per_ml = glucose_concentration_percent * 10  # Convert % to mg/ml
-            total_glucose_mg = glucose_mg_per_ml * nutrition_plan.glucose_volume
-            nutrition_plan.glucose_infusion_rate = total_glucose_mg / (24 * 60)  # Convert to mg/kg/min
-        
-        # Calculate enteral nutrition contribution
-        # This would be expanded based on enteral feeding types and fortifiers
+        reference = self.reference_data
+        contributions = nutrition_plan.source_contributions
+        
+        # Running totals in NUTRIENT_FIELDS order
+        totals = [0] * len(NUTRIENT_FIELDS)
+        
+        for source in SOURCES:
+            contribution = contributions.get(source)
+            if contribution is None or contribution[0] != reference.version:
+                contribution = (reference.version,) + self._source_contribution(reference, nutrition_plan, source)
+                contributions[source] = contribution
+            for column, amount in contribution[1]:
+                totals[column] += amount
+        
+        (nutrition_plan.total_energy,
+         nutrition_plan.total_protein,
+         nutrition_plan.total_carbohydrate,
+         nutrition_plan.total_fat,
+         nutrition_plan.total_sodium,
+         nutrition_plan.total_potassium,
+         nutrition_plan.total_calcium,
+         nutrition_plan.total_phosphate,
+         nutrition_plan.total_magnesium) = totals
+        nutrition_plan.glucose_infusion_rate = contributions["glucose"][2]
+        nutrition_plan.reference_version = reference.version
         
         return nutrition_plan
     
+    def stale_sources(self, nutrition_plan):
+        """
+        Get the sources calculate_nutrition_values would recompute for a plan.
+        
+        Args:
+            nutrition_plan: NutritionPlan object
+            
+        Returns:
+            List of sources in SOURCES order
+        """
+        version = self.reference_data.version
+        contributions = nutrition_plan.source_contributions
+        return [
+            source for source in SOURCES
+            if source not in contributions or contributions[source][0] != version
+        ]
+    
+    @staticmethod
+    def _source_contribution(reference, nutrition_plan, source):
+        """
+        Calculate what one source adds to the nutrition values of a plan.
+        
+        Args:
+            reference: ReferenceData snapshot to calculate with
+            nutrition_plan: NutritionPlan object with volumes and types
+            source: "tpn", "lipid", "glucose" or "enteral"
+            
+        Returns:
+            Tuple of ((column, amount) pairs in NUTRIENT_FIELDS columns, glucose
+            infusion rate in mg/kg/min, which is 0 for sources other than glucose)
+        """
+        if source == "enteral":
+            # Enteral nutrition contribution from the fortified feed table
+            if nutrition_plan.enteral_volume > 0:
+                per_ml = reference.enteral_composition(
+                    nutrition_plan.enteral_feeding_type,
+                    BMF_FORTIFIER,
+                    nutrition_plan.bmf_concentration or 0
+                )
+                return tuple((column, amount * nutrition_plan.enteral_volume) for column, amount in enumerate(per_ml)), 0
+            return (), 0
+        
+        solution_type = getattr(nutrition_plan, SOURCE_FIELDS_BY_NAME[source][0])
+        volume = getattr(nutrition_plan, SOURCE_FIELDS_BY_NAME[source][1])
+        terms = reference.source_terms[source]
+        if volume <= 0 or solution_type not in terms:
+            return (), 0
+        
+        amounts = tuple((column, per_ml * volume) for column, per_ml in terms[solution_type])
+        if source == "glucose":
+            # Glucose infusion rate (mg/kg/min)
+            return amounts, reference.glucose_mg_per_ml[solution_type] * volume / (24 * 60)
+        return amounts, 0
+    
+    @traced()
+    def calculate_nutrition_values_batch(self, nutrition_plans):
+        """
+        Calculate nutrition values for many nutrition plans in one call.
+        
+        Args:
+            nutrition_plans: Sequence of NutritionPlan objects
+            
+        Returns:
+            Dictionary mapping each field in NUTRIENT_FIELDS plus
+            "glucose_infusion_rate" to a NumPy array with one value per plan,
+            and "reference_version" to the reference data version used
+        """
+        return self.calculate_nutrition_columns(
+            tpn_type=[plan.tpn_type for plan in nutrition_plans],
+            tpn_volume=[plan.tpn_volume for plan in nutrition_plans],
+            lipid_type=[plan.lipid_type for plan in nutrition_plans],
+            lipid_volume=[plan.lipid_volume for plan in nutrition_plans],
+            glucose_concentration=[plan.glucose_concentration for plan in nutrition_plans],
+            glucose_volume=[plan.glucose_volume for plan in nutrition_plans],
+            enteral_feeding_type=[plan.enteral_feeding_type for plan in nutrition_plans],
+            enteral_volume=[plan.enteral_volume for plan in nutrition_plans],
+            bmf_concentration=[plan.bmf_concentration for plan in nutrition_plans]
+        )
+    
+    def update_nutrition_values_batch(self, nutrition_plans):
+        """
+        Calculate nutrition values for many plans in one batch and store them on the plans.
+        
+        Args:
+            nutrition_plans: Sequence of NutritionPlan objects
+            
+        Returns:
+            The updated NutritionPlan objects
+        """
+        results = self.calculate_nutrition_values_batch(nutrition_plans)
+        columns = [results[field].tolist() for field in NUTRIENT_FIELDS]
+        glucose_infusion_rates = results["glucose_infusion_rate"].tolist()
+        
+        for i, nutrition_plan in enumerate(nutrition_plans):
+            for field, values in zip(NUTRIENT_FIELDS, columns):
+                setattr(nutrition_plan, field, values[i])
+            nutrition_plan.glucose_infusion_rate = glucose_infusion_rates[i]
+            nutrition_plan.reference_version = results["reference_version"]
+        
+        return nutrition_plans
+    
+    def calculate_nutrition_columns(self, tpn_type, tpn_volume, lipid_type, lipid_volume,
+                                    glucose_concentration, glucose_volume,
+                                    enteral_feeding_type=None, enteral_volume=None, bmf_concentration=None):
+        """
+        Calculate nutrition values from column-oriented plan data.
+        
+        Each argument is a sequence with one entry per plan. The results are
+        identical to calling calculate_nutrition_values on each plan: sources are
+        accumulated in the same order (TPN, lipid, glucose, enteral) so every
+        total is rounded exactly as in the scalar path.
+        
+        Args:
+            tpn_type: TPN type per plan
+            tpn_volume: TPN volume per plan in ml/kg/day
+            lipid_type: Lipid type per plan
+            lipid_volume: Lipid volume per plan in ml/kg/day
+            glucose_concentration: Glucose concentration per plan (e.g., "10%")
+            glucose_volume: Glucose volume per plan in ml/kg/day
+            enteral_feeding_type: Enteral feed type per plan (optional)
+            enteral_volume: Enteral volume per plan in ml/kg/day (optional)
+            bmf_concentration: Breast milk fortifier concentration per plan in g/100ml (optional)
+            
+        Returns:
+            Dictionary mapping each field in NUTRIENT_FIELDS plus
+            "glucose_infusion_rate" to a NumPy array with one value per plan,
+            and "reference_version" to the reference data version used
+        """
+        reference = self.reference_data
+        tpn_rows, tpn_volume = self._encode_source(reference, "tpn", tpn_type, tpn_volume)
+        lipid_rows, lipid_volume = self._encode_source(reference, "lipid", lipid_type, lipid_volume)
+        glucose_rows, glucose_volume = self._encode_source(reference, "glucose", glucose_concentration, glucose_volume)
+        
+        matrix = reference.composition_matrix
+        totals = matrix[tpn_rows] * tpn_volume[:, np.newaxis]
+        totals += matrix[lipid_rows] * lipid_volume[:, np.newaxis]
+        totals += matrix[glucose_rows] * glucose_volume[:, np.newaxis]
+        if enteral_volume is not None:
+            enteral_table, enteral_rows, enteral_volume = self._encode_enteral(
+                reference, enteral_feeding_type, enteral_volume, bmf_concentration
+            )
+            totals += enteral_table[enteral_rows] * enteral_volume[:, np.newaxis]
+        
+        results = {field: totals[:, column] for column, field in enumerate(NUTRIENT_FIELDS)}
+        results["glucose_infusion_rate"] = reference.glucose_mg_per_ml_by_row[glucose_rows] * glucose_volume / (24 * 60)
+        results["reference_version"] = reference.version
+        return results
+    
+    @staticmethod
+    def _encode_source(reference, source, types, volumes):
+        """
+        Map solution types to composition matrix rows.
+        
+        Args:
+            reference: ReferenceData snapshot to encode against
+            source: "tpn", "lipid" or "glucose"
+            types: Solution type per plan
+            volumes: Volume per plan in ml/kg/day
+            
+        Returns:
+            Tuple of (row indices, volumes) where non-contributing entries point
+            at the zero row with a volume of 0
+        """
+        index = reference.source_index[source]
+        zero_row = reference.zero_row
+        rows = np.fromiter(map(index.get, types, repeat(zero_row)), dtype=np.intp, count=len(types))
+        volumes = np.asarray(volumes, dtype=np.float64)
+        
+        contributes = (volumes > 0) & (rows != zero_row)
+        rows = np.where(contributes, rows, zero_row)
+        volumes = np.where(contributes, volumes, 0.0)
+        return rows, volumes
+    
+    @staticmethod
+    def _encode_enteral(reference, feed_types, volumes, bmf_concentrations):
+        """
+        Map enteral feeds to rows of the fortified feed table.
+        
+        Args:
+            reference: ReferenceData snapshot to encode against
+            feed_types: Enteral feed type per plan
+            volumes: Enteral volume per plan in ml/kg/day
+            bmf_concentrations: Breast milk fortifier concentration per plan in g/100ml, or None
+            
+        Returns:
+            Tuple of (table, row indices, volumes). The table is the precomputed
+            enteral table, extended with a row for each concentration that is not
+            on its grid; non-contributing entries point at the zero row with a volume of 0
+        """
+        count = len(volumes)
+        if feed_types is None:
+            feed_types = repeat(None, count)
+        if bmf_concentrations is None:
+            bmf_concentrations = repeat(0, count)
+        
+        table = reference.enteral_table
+        rows = []
+        extra_rows = []
+        for feed_type, concentration in zip(feed_types, bmf_concentrations):
+            row = reference.enteral_row(feed_type, BMF_FORTIFIER, concentration or 0)
+            if row is None:
+                extra_rows.append(reference.enteral_composition(feed_type, BMF_FORTIFIER, concentration))
+                row = len(table) + len(extra_rows) - 1
+            rows.append(row)
+        if extra_rows:
+            table = np.vstack([table, extra_rows])
+        
+        rows = np.array(rows, dtype=np.intp).reshape(count)
+        volumes = np.asarray(volumes, dtype=np.float64)
+        contributes = volumes > 0
+        rows = np.where(contributes, rows, reference.enteral_zero_row)
+        volumes = np.where(contributes, volumes, 0.0)
+        return table, rows, volumes
+    
     def calculate_glucose_infusion_rate(self, glucose_concentration, glucose_volume):
         """
         Calculate glucose infusion rate in mg/kg/min.
@@ -140,38 +528,39 @@ class NutritionCalculator:
             patient: Patient object with weight and age information
             
         Returns:
-            Dictionary with macronutrient requirements
+            Dictionary with macronutrient requirements.
+            The dictionary is shared with other callers and must not be modified.
         """
+        version = self.reference_data.version
         weight_category = patient.get_weight_category()
-        age_category = patient.get_postnatal_age_category()
         
-        # This would be expanded with actual macronutrient requirements from protocols
-        # For now, returning placeholder values based on weight category
+        key = ("macronutrient", weight_category)
+        macro_req = self.requirement_cache.get(version, key)
+        if macro_req is None:
+            macro_req = self._compute_macronutrient_requirements(weight_category)
+            self.requirement_cache.put(version, key, macro_req)
+        return macro_req
+    
+    def requirement_cache_stats(self):
+        """
+        Get hit/miss statistics for the memoized requirement lookups.
         
-        if weight_category == "premature_less_1000g":
-            return {
-                "glucose_mg_kg_min": {"min": 4, "max": 12},
-                "protein_g_kg_day": {"min": 2.5, "max": 3.5},
-                "fat_g_kg_day": {"min": 2.5, "max": 3.5}
-            }
-        elif weight_category == "premature_1000_1500g":
-            return {
-                "glucose_mg_kg_min": {"min": 4, "max": 12},
-                "protein_g_kg_day": {"min": 2.5, "max": 3.5},
-                "fat_g_kg_day": {"min": 2.5, "max": 3.5}
-            }
-        elif weight_category == "premature_greater_1500g":
-            return {
-                "glucose_mg_kg_min": {"min": 4, "max": 12},
-                "protein_g_kg_day": {"min": 2.0, "max": 3.0},
-                "fat_g_kg_day": {"min": 2.0, "max": 3.0}
-            }
-        else:  # term
-            return {
-                "glucose_mg_kg_min": {"min": 2.5, "max": 5.0},
-                "protein_g_kg_day": {"min": 1.5, "max": 2.5},
-                "fat_g_kg_day": {"min": 1.0, "max": 3.0}
-            }
+        Returns:
+            Dictionary with hits, misses, size, maxsize and version
+        """
+        return self.requirement_cache.stats()
+    
+    def _compute_macronutrient_requirements(self, weight_category):
+        """
+        Compute macronutrient requirements for a weight category.
+        
+        Args:
+            weight_category: Weight category name
+            
+        Returns:
+            Dictionary with macronutrient requirements
+        """
+        return MACRONUTRIENT_REQUIREMENTS.get(weight_category, MACRONUTRIENT_REQUIREMENTS["term"])
 
 
 class RecommendationEngine:
@@ -188,52 +577,94 @@ class RecommendationEngine:
         """
         self.nutrition_calculator = nutrition_calculator
     
-    def generate_recommendations(self, patient, nutrition_plan):
+    @traced()
+    def generate_recommendations(self, patient, nutrition_plan, fluid_requirements=None, total_fluid=None,
+                                 checks=None):
         """
         Generate recommendations based on patient data and nutrition plan.
         
+        The recommendations of each check are kept on the plan, so after a change
+        only the checks whose values changed need to run again.
+        
         Args:
             patient: Patient object with clinical information
             nutrition_plan: NutritionPlan object with calculated values
+            fluid_requirements: Already calculated fluid requirements, calculated if not given
+            total_fluid: Already calculated total fluid in ml/kg/day, calculated if not given
+            checks: Checks in RECOMMENDATION_CHECKS to run, reusing the plan's earlier
+                results for the others (default: run all checks)
             
         Returns:
             List of recommendation strings
         """
-        recommendations = []
+        previous = nutrition_plan.recommendation_groups if checks is not None else {}
+        checks = [check for check, _ in RECOMMENDATION_CHECKS if check not in previous or check in checks]
+        groups = dict(previous)
+        groups.update(self.recommendation_groups(patient, nutrition_plan, fluid_requirements, total_fluid, checks))
+        nutrition_plan.recommendation_groups = groups
+        return [recommendation for check, _ in RECOMMENDATION_CHECKS for recommendation in groups[check]]
+    
+    def recommendation_groups(self, patient, nutrition_plan, fluid_requirements=None, total_fluid=None, checks=None):
+        """
+        Run recommendation checks separately, so a changed plan only needs the
+        checks whose values changed.
         
-        # Check fluid requirements
-        fluid_req = self.nutrition_calculator.calculate_fluid_requirements(patient)
-        total_fluid = nutrition_plan.calculate_total_fluid()
+        Args:
+            patient: Patient object with clinical information
+            nutrition_plan: NutritionPlan object with calculated values
+            fluid_requirements: Already calculated fluid requirements, calculated if not given
+            total_fluid: Already calculated total fluid in ml/kg/day, calculated if not given
+            checks: Names of the checks in RECOMMENDATION_CHECKS to run (default: all)
+            
+        Returns:
+            Dictionary mapping each check that was run to its list of recommendation strings
+        """
+        if checks is None:
+            checks = [check for check, _ in RECOMMENDATION_CHECKS]
+        groups = {check: [] for check in checks}
+        macro_req = None
+        if {"glucose_infusion_rate", "protein", "fat"} & groups.keys():
+            macro_req = self.nutrition_calculator.get_macronutrient_requirements(patient)
         
-        if total_fluid < fluid_req["min"]:
-            recommendations.append(f"Increase total fluid intake to at least {fluid_req['min']} ml/kg/day (current: {total_fluid} ml/kg/day)")
-        elif total_fluid > fluid_req["max"]:
-            recommendations.append(f"Consider reducing total fluid intake to maximum {fluid_req['max']} ml/kg/day (current: {total_fluid} ml/kg/day)")
+        # Check fluid requirements
+        if "fluid" in groups:
+            fluid_req = fluid_requirements
+            if fluid_req is None:
+                fluid_req = self.nutrition_calculator.calculate_fluid_requirements(patient)
+            if total_fluid is None:
+                total_fluid = nutrition_plan.calculate_total_fluid()
+            
+            if total_fluid < fluid_req["min"]:
+                groups["fluid"].append(f"Increase total fluid intake to at least {fluid_req['min']} ml/kg/day (current: {total_fluid} ml/kg/day)")
+            elif total_fluid > fluid_req["max"]:
+                groups["fluid"].append(f"Consider reducing total fluid intake to maximum {fluid_req['max']} ml/kg/day (current: {total_fluid} ml/kg/day)")
         
         # Check glucose infusion rate
-        macro_req = self.nutrition_calculator.get_macronutrient_requirements(patient)
-        
-        if nutrition_plan.glucose_infusion_rate < macro_req["glucose_mg_kg_min"]["min"]:
-            recommendations.append(f"Increase glucose infusion rate to at least {macro_req['glucose_mg_kg_min']['min']} mg/kg/min (current: {nutrition_plan.glucose_infusion_rate:.2f} mg/kg/min)")
-        elif nutrition_plan.glucose_infusion_rate > macro_req["glucose_mg_kg_min"]["max"]:
-            recommendations.append(f"Consider reducing glucose infusion rate to maximum {macro_req['glucose_mg_kg_min']['max']} mg/kg/min (current: {nutrition_plan.glucose_infusion_rate:.2f} mg/kg/min)")
+        if "glucose_infusion_rate" in groups:
+            if nutrition_plan.glucose_infusion_rate < macro_req["glucose_mg_kg_min"]["min"]:
+                groups["glucose_infusion_rate"].append(f"Increase glucose infusion rate to at least {macro_req['glucose_mg_kg_min']['min']} mg/kg/min (current: {nutrition_plan.glucose_infusion_rate:.2f} mg/kg/min)")
+            elif nutrition_plan.glucose_infusion_rate > macro_req["glucose_mg_kg_min"]["max"]:
+                groups["glucose_infusion_rate"].append(f"Consider reducing glucose infusion rate to maximum {macro_req['glucose_mg_kg_min']['max']} mg/kg/min (current: {nutrition_plan.glucose_infusion_rate:.2f} mg/kg/min)")
         
         # Check protein intake
-        if nutrition_plan.total_protein < macro_req["protein_g_kg_day"]["min"]:
-            recommendations.append(f"Increase protein intake to at least {macro_req['protein_g_kg_day']['min']} g/kg/day (current: {nutrition_plan.total_protein:.2f} g/kg/day)")
-        elif nutrition_plan.total_protein > macro_req["protein_g_kg_day"]["max"]:
-            recommendations.append(f"Consider reducing protein intake to maximum {macro_req['protein_g_kg_day']['max']} g/kg/day (current: {nutrition_plan.total_protein:.2f} g/kg/day)")
+        if "protein" in groups:
+            if nutrition_plan.total_protein < macro_req["protein_g_kg_day"]["min"]:
+                groups["protein"].append(f"Increase protein intake to at least {macro_req['protein_g_kg_day']['min']} g/kg/day (current: {nutrition_plan.total_protein:.2f} g/kg/day)")
+            elif nutrition_plan.total_protein > macro_req["protein_g_kg_day"]["max"]:
+                groups["protein"].append(f"Consider reducing protein intake to maximum {macro_req['protein_g_kg_day']['max']} g/kg/day (current: {nutrition_plan.total_protein:.2f} g/kg/day)")
         
         # Check fat intake
-        if nutrition_plan.total_fat < macro_req["fat_g_kg_day"]["min"]:
-            recommendations.append(f"Increase fat intake to at least {macro_req['fat_g_kg_day']['min']} g/kg/day (current: {nutrition_plan.total_fat:.2f} g/kg/day)")
-        elif nutrition_plan.total_fat > macro_req["fat_g_kg_day"]["max"]:
-            recommendations.append(f"Consider reducing fat intake to maximum {macro_req['fat_g_kg_day']['max']} g/kg/day (current: {nutrition_plan.total_fat:.2f} g/kg/day)")
+        if "fat" in groups:
+            if nutrition_plan.total_fat < macro_req["fat_g_kg_day"]["min"]:
+                groups["fat"].append(f"Increase fat intake to at least {macro_req['fat_g_kg_day']['min']} g/kg/day (current: {nutrition_plan.total_fat:.2f} g/kg/day)")
+            elif nutrition_plan.total_fat > macro_req["fat_g_kg_day"]["max"]:
+                groups["fat"].append(f"Consider reducing fat intake to maximum {macro_req['fat_g_kg_day']['max']} g/kg/day (current: {nutrition_plan.total_fat:.2f} g/kg/day)")
         
         # Special clinical considerations
-        if patient.clinical_condition == "Sepsis":
-            recommendations.append("In sepsis, consider reducing lipid intake and monitoring triglyceride levels")
-        elif patient.clinical_condition == "Hyperglycemia":
-            recommendations.append("In hyperglycemia, consider reducing glucose infusion rate and monitoring blood glucose levels")
+        if "clinical_condition" in groups:
+            if patient.clinical_condition == "Sepsis":
+                groups["clinical_condition"].append("In sepsis, consider reducing lipid intake and monitoring triglyceride levels")
+            elif patient.clinical_condition == "Hyperglycemia":
+                groups["clinical_condition"].append("In hyperglycemia, consider reducing glucose infusion rate and monitoring blood glucose levels")
         
-        return recommendations
+        return groups
@@ -0,0 +1,157 @@
+"""
+NICU Fluid Management App - Cached Reference Data Responses
+"""
+
+import gzip
+import json
+import threading
+
+from flask import Response, request
+
+from models import WEIGHT_CATEGORY_LIMITS, DEFAULT_WEIGHT_CATEGORY, AGE_CATEGORY_RANGES, DEFAULT_AGE_CATEGORY
+from calculator import MACRONUTRIENT_REQUIREMENTS
+
+
+def reference_bundle(reference):
+    """
+    Build the combined reference data payload for the client.
+
+    Args:
+        reference: ReferenceData snapshot
+
+    Returns:
+        Dictionary with all reference tables, macronutrient requirements and category boundaries
+    """
+    weight_categories = [
+        {"category": category, "max_weight_g": limit}
+        for limit, category in WEIGHT_CATEGORY_LIMITS
+    ]
+    weight_categories.append({"category": DEFAULT_WEIGHT_CATEGORY, "max_weight_g": None})
+
+    age_categories = [
+        {"category": category, "first_day": first_day, "last_day": last_day}
+        for first_day, last_day, category in AGE_CATEGORY_RANGES
+    ]
+
+    return {
+        "version": reference.version,
+        "tpn_compositions": reference.tpn_compositions,
+        "solution_compositions": reference.solution_compositions,
+        "fluid_requirements": reference.fluid_requirements,
+        "enteral_compositions": reference.enteral_compositions,
+        "macronutrient_requirements": MACRONUTRIENT_REQUIREMENTS,
+        # Weight limits are exclusive; the last category has no limit
+        "weight_categories": weight_categories,
+        # Day ranges are inclusive; other ages fall in default_age_category
+        "age_categories": age_categories,
+        "default_age_category": DEFAULT_AGE_CATEGORY
+    }
+
+
+# Reference data payloads served by the /api/data endpoints
+REFERENCE_PAYLOADS = {
+    "tpn_compositions": lambda reference: reference.tpn_compositions,
+    "solution_compositions": lambda reference: reference.solution_compositions,
+    "fluid_requirements": lambda reference: reference.fluid_requirements,
+    "enteral_compositions": lambda reference: reference.enteral_compositions,
+    "bundle": reference_bundle,
+}
+
+
+class SerializedResponse:
+    """
+    One pre-serialized JSON payload with its gzip-compressed form and ETags.
+    """
+    def __init__(self, name, version, payload):
+        """
+        Serialize and compress a payload.
+
+        Args:
+            name: Name of the payload
+            version: Reference data version the payload was built from
+            payload: JSON-serializable data
+        """
+        self.body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        # mtime=0 keeps the compressed bytes identical across workers and restarts
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        # Each representation gets its own strong ETag
+        self.etag = f"{version}-{name}"
+        self.gzip_etag = f"{version}-{name}-gzip"
+
+
+class ReferenceResponseCache:
+    """
+    Serves reference data payloads from in-memory byte buffers.
+    Payloads are serialized and compressed once per reference data version and
+    answered with strong ETags, conditional GET (304) and Cache-Control headers.
+    """
+    def __init__(self, calculator, payloads=REFERENCE_PAYLOADS, max_age=3600):
+        """
+        Initialize the cache.
+
+        Args:
+            calculator: NutritionCalculator providing the current reference data
+            payloads: Mapping of payload name to a function building it from a ReferenceData snapshot
+            max_age: Seconds clients may use a response without revalidating it
+        """
+        self.calculator = calculator
+        self.payloads = payloads
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._version = None
+        self._responses = {}
+
+    def get(self, name):
+        """
+        Get the serialized payload for the current reference data version.
+
+        Args:
+            name: Name of the payload
+
+        Returns:
+            SerializedResponse object
+        """
+        reference = self.calculator.reference_data
+        responses = self._responses
+        if self._version != reference.version:
+            with self._lock:
+                if self._version != reference.version:
+                    self._responses = {}
+                    self._version = reference.version
+                responses = self._responses
+
+        serialized = responses.get(name)
+        if serialized is None:
+            serialized = SerializedResponse(name, reference.version, self.payloads[name](reference))
+            responses[name] = serialized
+        return serialized
+
+    def response(self, name):
+        """
+        Build the HTTP response for a payload, honouring If-None-Match and Accept-Encoding.
+
+        Args:
+            name: Name of the payload
+
+        Returns:
+            Flask Response object
+        """
+        serialized = self.get(name)
+        use_gzip = request.accept_encodings.quality('gzip') > 0
+        etag = serialized.gzip_etag if use_gzip else serialized.etag
+
+        if request.if_none_match.contains_weak(serialized.etag) or \
+                request.if_none_match.contains_weak(serialized.gzip_etag):
+            response = Response(status=304)
+        else:
+            response = Response(
+                serialized.gzip_body if use_gzip else serialized.body,
+                mimetype='application/json'
+            )
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f"private, max-age={self.max_age}"
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,525 @@
+"""
+NICU Fluid Management App - Background Jobs
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_FIELDS = (
+    "job_id", "kind", "user_id", "status", "params", "progress", "message", "result", "error",
+    "cancel_requested", "worker_pid", "created_at", "started_at", "finished_at"
+)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job handler when cancellation of its job was requested.
+    """
+
+
+class JobContext:
+    """
+    Handle given to a job handler to report progress and notice cancellation.
+    """
+    def __init__(self, queue, job_id, user_id, result_dir):
+        """
+        Initialize the context.
+
+        Args:
+            queue: JobQueue the job belongs to
+            job_id: ID of the running job
+            user_id: Owner of the job
+            result_dir: Directory for result files of the job
+        """
+        self.queue = queue
+        self.job_id = job_id
+        self.user_id = user_id
+        self.result_dir = result_dir
+
+    def progress(self, done, total=None, message=None):
+        """
+        Record the progress of the job.
+
+        Handlers should call this regularly; it is also the point where a
+        cancelled job stops.
+
+        Args:
+            done: Units of work done, or a fraction between 0 and 1 without total
+            total: Total units of work
+            message: Optional human readable status
+
+        Raises:
+            JobCancelled: If cancellation of the job was requested
+        """
+        fraction = done / total if total else done
+        if self.queue.update_progress(self.job_id, min(max(fraction, 0.0), 1.0), message):
+            raise JobCancelled()
+
+    def result_file(self, suffix):
+        """
+        Get the path of a result file for the job.
+
+        Args:
+            suffix: File name suffix, such as ".csv"
+
+        Returns:
+            Path inside the result directory
+        """
+        os.makedirs(self.result_dir, exist_ok=True)
+        return os.path.join(self.result_dir, f"{self.job_id}{suffix}")
+
+
+class JobQueue:
+    """
+    Queue of background jobs kept in a SQLite database.
+
+    Every call opens its own connection, so a queue can be shared by web
+    workers and the processes of a WorkerPool. Jobs are claimed inside an
+    immediate transaction, so each job runs exactly once.
+    """
+    def __init__(self, db_path, result_dir=None):
+        """
+        Initialize the queue and create its table if needed.
+
+        Args:
+            db_path: Path to the SQLite database file
+            result_dir: Directory for result files, next to the database by default
+        """
+        self.db_path = db_path
+        self.result_dir = result_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "job_results")
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, "
+                "kind TEXT NOT NULL, "
+                "user_id INTEGER, "
+                "status TEXT NOT NULL, "
+                "params TEXT NOT NULL, "
+                "progress REAL NOT NULL DEFAULT 0, "
+                "message TEXT, "
+                "result TEXT, "
+                "error TEXT, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, "
+                "worker_pid INTEGER, "
+                "created_at REAL NOT NULL, "
+                "started_at REAL, "
+                "finished_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_finished ON jobs (finished_at)")
+
+    @contextmanager
+    def _connect(self):
+        """
+        Open an autocommit connection to the queue database.
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def submit(self, kind, params=None, user_id=None):
+        """
+        Add a job to the queue.
+
+        Args:
+            kind: Name of the handler that runs the job
+            params: JSON-serializable parameters for the handler
+            user_id: Owner of the job
+
+        Returns:
+            ID of the new job
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (job_id, kind, user_id, status, params, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, user_id, QUEUED, json.dumps(params or {}), time.time())
+            )
+        return job_id
+
+    def get(self, job_id):
+        """
+        Get a job.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            Dictionary with the job fields, or None if the job does not exist
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. A queued job is cancelled at once; a running job stops
+        the next time its handler reports progress.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            False if the job does not exist or has already finished, True otherwise
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED)
+            )
+            if cursor.rowcount:
+                return True
+            cursor = connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?", (job_id, RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def claim(self):
+        """
+        Take the oldest queued job and mark it as running in this process.
+
+        Returns:
+            The claimed job as a dictionary, or None if the queue is empty
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ? WHERE job_id = ?",
+                        (RUNNING, os.getpid(), time.time(), row[0])
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def update_progress(self, job_id, progress, message=None):
+        """
+        Record the progress of a running job.
+
+        Args:
+            job_id: ID of the job
+            progress: Fraction of the work done, between 0 and 1
+            message: Optional human readable status
+
+        Returns:
+            True if cancellation of the job was requested
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE job_id = ?",
+                (progress, message, job_id)
+            )
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id, status, result=None, error=None):
+        """
+        Record the outcome of a job.
+
+        Args:
+            job_id: ID of the job
+            status: SUCCEEDED, FAILED or CANCELLED
+            result: JSON-serializable result of a succeeded job
+            error: Error message of a failed job
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                "progress = CASE WHEN ? = ? THEN 1 ELSE progress END WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(),
+                 status, SUCCEEDED, job_id)
+            )
+
+    def fail_interrupted(self):
+        """
+        Mark jobs whose worker process no longer exists as failed.
+
+        Returns:
+            Number of jobs marked as failed
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT job_id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+        interrupted = [job_id for job_id, worker_pid in rows if not process_exists(worker_pid)]
+        for job_id in interrupted:
+            self.finish(job_id, FAILED, error="Worker process exited while running the job")
+        return len(interrupted)
+
+    def purge_finished(self, max_age):
+        """
+        Delete jobs that finished more than max_age seconds ago, with their result files.
+
+        Args:
+            max_age: Seconds finished jobs are kept
+
+        Returns:
+            Number of jobs deleted
+        """
+        cutoff = time.time() - max_age
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT job_id FROM jobs WHERE finished_at < ? AND status IN (?, ?, ?)",
+                (cutoff, *FINISHED_STATUSES)
+            ).fetchall()
+            for (job_id,) in rows:
+                for path in glob.glob(os.path.join(self.result_dir, f"{job_id}.*")):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                connection.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return len(rows)
+
+    def run_next(self, handlers):
+        """
+        Claim the next queued job and run it in this process.
+
+        Args:
+            handlers: Dictionary mapping job kinds to functions(params, context)
+
+        Returns:
+            ID of the job that was run, or None if the queue was empty
+        """
+        job = self.claim()
+        if job is None:
+            return None
+
+        job_id = job["job_id"]
+        handler = handlers.get(job["kind"])
+        if handler is None:
+            self.finish(job_id, FAILED, error=f"Unknown job kind: {job['kind']}")
+            return job_id
+
+        logger.info(f"Running job {job_id} ({job['kind']})")
+        try:
+            result = handler(job["params"], JobContext(self, job_id, job["user_id"], self.result_dir))
+        except JobCancelled:
+            logger.info(f"Job {job_id} cancelled")
+            self.finish(job_id, CANCELLED)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}\n{traceback.format_exc()}")
+            self.finish(job_id, FAILED, error=str(e))
+        else:
+            self.finish(job_id, SUCCEEDED, result=result)
+        return job_id
+
+
+def process_exists(pid):
+    """
+    Check whether a process with the given ID is running.
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def run_worker(queue, handlers, poll_interval, initializer=None):
+    """
+    Run jobs from the queue until the process is terminated.
+
+    Args:
+        queue: JobQueue to take jobs from
+        handlers: Dictionary mapping job kinds to functions(params, context)
+        poll_interval: Seconds to wait when the queue is empty
+        initializer: Optional function called once when the worker starts
+    """
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            if queue.run_next(handlers) is None:
+                time.sleep(poll_interval)
+        except sqlite3.Error as e:
+            logger.error(f"Job queue error: {e}")
+            time.sleep(poll_interval)
+
+
+class WorkerPool:
+    """
+    Pool of processes running jobs from a JobQueue.
+
+    Only one pool per queue is started on a machine: the pool holds an
+    exclusive lock file for its lifetime, so web workers that each call
+    start() share the first pool instead of starting their own. The process
+    owning the pool checks its workers every check_interval seconds: workers
+    that died are replaced, their jobs are marked as failed, and jobs that
+    finished more than retention seconds ago are deleted.
+    """
+    def __init__(self, queue, handlers, processes=2, poll_interval=0.5, initializer=None,
+                 check_interval=5.0, retention=86400):
+        """
+        Initialize the pool.
+
+        Args:
+            queue: JobQueue to take jobs from
+            handlers: Dictionary mapping job kinds to functions(params, context)
+            processes: Number of worker processes
+            poll_interval: Seconds a worker waits when the queue is empty
+            initializer: Optional function called once in each worker process
+            check_interval: Seconds between checks of the worker processes
+            retention: Seconds finished jobs and their result files are kept, or None to keep them
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.initializer = initializer
+        self.check_interval = check_interval
+        self.retention = retention
+        self.lock_file = f"{queue.db_path}.workers.lock"
+
+        self._lock = None
+        self._workers = []
+        self._owner_pid = None
+        self._guard = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """
+        Start the worker processes unless another pool already serves the queue.
+        Called again in the process owning the pool, it replaces workers that died.
+
+        Returns:
+            True if this pool started its workers
+        """
+        with self._guard:
+            if self._workers:
+                self._replace_dead_workers()
+                return True
+            if self.processes <= 0:
+                return False
+
+            lock = open(self.lock_file, 'a')
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return False
+            self._lock = lock
+            self._owner_pid = os.getpid()
+
+            self._fail_interrupted()
+            self._workers = [self._start_worker() for _ in range(self.processes)]
+            self._stopped.clear()
+            threading.Thread(target=self._check_periodically, name="job-pool-check", daemon=True).start()
+        logger.info(f"Started {self.processes} job workers for {self.queue.db_path}")
+        return True
+
+    def _start_worker(self):
+        worker = multiprocessing.get_context("fork").Process(
+            target=run_worker,
+            args=(self.queue, self.handlers, self.poll_interval, self.initializer),
+            daemon=True
+        )
+        worker.start()
+        return worker
+
+    def _fail_interrupted(self):
+        interrupted = self.queue.fail_interrupted()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} interrupted jobs as failed")
+
+    def _replace_dead_workers(self):
+        """Start a new worker for each one that died and fail the jobs they left running. Called with the guard held."""
+        # Forked children inherit the worker list, but only the owner can manage the workers
+        if os.getpid() != self._owner_pid:
+            return 0
+        dead = [worker for worker in self._workers if not worker.is_alive()]
+        if not dead:
+            return 0
+        for worker in dead:
+            logger.error(f"Job worker {worker.pid} exited with code {worker.exitcode}; starting a new one")
+            self._workers.remove(worker)
+        self._fail_interrupted()
+        self._workers.extend(self._start_worker() for _ in dead)
+        return len(dead)
+
+    def check(self):
+        """
+        Replace workers that died and delete jobs past the retention period.
+
+        Returns:
+            Number of workers replaced
+        """
+        with self._guard:
+            if not self._workers:
+                return 0
+            replaced = self._replace_dead_workers()
+        if self.retention is not None:
+            purged = self.queue.purge_finished(self.retention)
+            if purged:
+                logger.info(f"Deleted {purged} finished jobs older than {self.retention} seconds")
+        return replaced
+
+    def _check_periodically(self):
+        while not self._stopped.wait(self.check_interval):
+            try:
+                self.check()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Job pool check failed: {e}")
+
+    def stop(self, timeout=5):
+        """
+        Terminate the worker processes and release the lock file.
+
+        Jobs that were running are left for fail_interrupted.
+
+        Args:
+            timeout: Seconds to wait for each worker to exit
+        """
+        self._stopped.set()
+        with self._guard:
+            for worker in self._workers:
+                worker.terminate()
+            for worker in self._workers:
+                worker.join(timeout)
+            self._workers = []
+            if self._lock is not None:
+                fcntl.flock(self._lock.fileno(), fcntl.LOCK_UN)
+                self._lock.close()
+                self._lock = None
@@ -0,0 +1,253 @@
+"""
+NICU Fluid Management App - Multi-Process Logging Pipeline
+"""
+
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+
+# Longest message or traceback kept in a log line, so each line fits in one datagram
+MAX_FIELD_CHARS = 16384
+
+# Seconds a record waits for the log writer to come up before it is dropped
+WRITER_WAIT_SECONDS = 1.0
+
+# Attributes every LogRecord has; any others were passed through `extra`
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, including the fields passed through `extra`.
+    """
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage()[:MAX_FIELD_CHARS],
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)[-MAX_FIELD_CHARS:]
+        if record.stack_info:
+            entry["stack"] = record.stack_info[-MAX_FIELD_CHARS:]
+        return json.dumps(entry, default=str)
+
+
+def run_log_writer(socket_path, log_file, max_bytes, backup_count, lock):
+    """
+    Write the log lines received on socket_path to a rotating log file until the process is terminated.
+
+    Args:
+        socket_path: Unix datagram socket to receive lines on
+        log_file: Path of the log file
+        max_bytes: Size at which the log file is rotated
+        backup_count: Number of rotated files to keep
+        lock: Open lock file, held by this process for its lifetime
+    """
+    # Signal handlers inherited from a web worker would keep the writer alive on termination
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2):
+        signal.signal(signum, signal.SIG_DFL)
+    parent_pid = os.getppid()
+
+    handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.bind(socket_path)
+    receiver.settimeout(1.0)
+    while True:
+        try:
+            line = receiver.recv(256 * 1024).decode("utf-8", "replace")
+        except TimeoutError:
+            # Once the process that started the writer is gone, stop when there is nothing to write
+            if os.getppid() != parent_pid:
+                return
+            continue
+        handler.emit(logging.makeLogRecord({"msg": line}))
+
+
+def start_log_writer(log_file, max_bytes=10485760, backup_count=10, wait=2.0):
+    """
+    Start the log writer process for log_file unless one is already running.
+
+    The writer holds an exclusive lock file for its lifetime, so only one
+    process on the machine writes and rotates the file.
+
+    Args:
+        log_file: Path of the log file
+        max_bytes: Size at which the log file is rotated
+        backup_count: Number of rotated files to keep
+        wait: Seconds to wait for the writer to start receiving
+
+    Returns:
+        True if this call started the writer
+    """
+    lock = open(f"{log_file}.lock", "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+
+    # Holding the lock, any socket left behind belongs to a writer that has exited
+    socket_path = f"{log_file}.sock"
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    context = multiprocessing.get_context("fork")
+    writer = context.Process(
+        target=run_log_writer,
+        args=(socket_path, log_file, max_bytes, backup_count, lock),
+        name="log-writer",
+        daemon=True
+    )
+    writer.start()
+    # The writer inherited the lock; closing this copy leaves it held by the writer only
+    lock.close()
+
+    deadline = time.monotonic() + wait
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return True
+
+
+class LogPipelineHandler(QueueHandler):
+    """
+    Logging handler that puts records on a bounded in-process queue without blocking.
+    A background thread formats them as JSON lines and sends them to the log
+    writer process, starting it if no process is writing the file. Records
+    that do not fit in the queue or cannot be delivered are dropped and counted.
+    """
+    def __init__(self, log_file, max_bytes=10485760, backup_count=10, capacity=10000, dropped_counter=None):
+        """
+        Initialize the handler and start the log writer if needed.
+
+        Args:
+            log_file: Path of the log file
+            max_bytes: Size at which the log file is rotated
+            backup_count: Number of rotated files to keep
+            capacity: Records queued in this process before new ones are dropped
+            dropped_counter: Optional counter metric, labelled with the reason a record was dropped
+        """
+        super().__init__(queue.Queue(capacity))
+        self.log_file = log_file
+        self.socket_path = f"{log_file}.sock"
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.capacity = capacity
+        self.dropped_counter = dropped_counter
+        self.setFormatter(JsonFormatter())
+
+        start_log_writer(log_file, max_bytes, backup_count)
+        self._start_process()
+        # A forked process gets its own queue and sender thread
+        os.register_at_fork(after_in_child=self._start_process)
+
+    def _start_process(self):
+        self.queue = queue.Queue(self.capacity)
+        self.dropped = {}
+        self._unreported = 0
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.settimeout(WRITER_WAIT_SECONDS)
+        threading.Thread(target=self._send_records, name="log-sender", daemon=True).start()
+
+    def prepare(self, record):
+        # Records stay in this process, so formatting is left to the sender thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._drop("queue_full")
+
+    def _drop(self, reason):
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        self._unreported += 1
+        if self.dropped_counter is not None:
+            self.dropped_counter.inc(reason=reason)
+
+    def _send_records(self):
+        while True:
+            record = self.queue.get()
+            try:
+                line = self.format(record)
+            except Exception:
+                self._drop("format_error")
+                continue
+            if self._send(line) and self._unreported:
+                dropped, self._unreported = self._unreported, 0
+                self._send(self.format(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Dropped {dropped} log records", "dropped": dict(self.dropped)
+                })))
+
+    def _send(self, line):
+        """Send one line to the writer, waiting briefly for it to come up. Returns True if sent."""
+        data = line.encode("utf-8")
+        deadline = time.monotonic() + WRITER_WAIT_SECONDS
+        while True:
+            try:
+                self._socket.sendto(data, self.socket_path)
+                return True
+            except (FileNotFoundError, ConnectionRefusedError):
+                # No writer: start one unless another process is already doing so
+                if time.monotonic() >= deadline:
+                    self._drop("writer_unavailable")
+                    return False
+                if not start_log_writer(self.log_file, self.max_bytes, self.backup_count):
+                    time.sleep(0.05)
+            except TimeoutError:
+                # The writer fell behind for a whole wait; this thread waited, the request path did not
+                self._drop("writer_busy")
+                return False
+            except OSError:
+                self._drop("send_failed")
+                return False
+
+
+class RequestLogSampler:
+    """
+    Lets through at most `rate` request log lines per second and counts the rest.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._second = None
+        self._logged = 0
+        self._skipped = 0
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Decide whether to log the current request.
+
+        Returns:
+            Number of requests skipped since the last logged one, or None to skip this one
+        """
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self._second = second
+                self._logged = 0
+            if self._logged >= self.rate:
+                self._skipped += 1
+                return None
+            self._logged += 1
+            skipped, self._skipped = self._skipped, 0
+            return skipped
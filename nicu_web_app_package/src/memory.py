@@ -0,0 +1,194 @@
+"""
+NICU Fluid Management App - Memory Diagnostics
+"""
+
+import gc
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from jobs import process_exists
+
+
+def resident_memory():
+    """
+    Resident set size of this process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_resident_memory():
+    """Highest resident set size of this process so far, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def count_objects(types):
+    """
+    Count the live instances of the given classes with one pass over the garbage collector's objects.
+
+    Returns:
+        Dictionary of class name -> instance count
+    """
+    counts = dict.fromkeys(types, 0)
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls in counts:
+            counts[cls] += 1
+    return {cls.__name__: count for cls, count in counts.items()}
+
+
+def allocation_sites(differences, top_n):
+    """Convert tracemalloc StatisticDiffs to JSON, largest growth first"""
+    return [
+        {
+            "site": str(diff.traceback[0]) if len(diff.traceback) == 1 else diff.traceback.format(),
+            "size_bytes": diff.size,
+            "size_diff_bytes": diff.size_diff,
+            "count": diff.count,
+            "count_diff": diff.count_diff,
+        }
+        for diff in differences[:top_n]
+    ]
+
+
+class MemoryMonitor:
+    """
+    Memory report of each process serving the application.
+    Every interval seconds a background thread records the process's RSS,
+    the live instances of the counted classes and the sizes of the given
+    stores, and writes them to the process's own file in a shared directory.
+    With tracemalloc_frames set, it also takes a tracemalloc snapshot and
+    reports the top_n allocation sites that grew since the previous
+    snapshot and since the first one.
+    """
+    def __init__(self, directory, interval=60.0, top_n=20, tracemalloc_frames=0, counted_types=(), sizes=None):
+        """
+        Initialize the monitor.
+
+        Args:
+            directory: Directory shared by the processes, created if needed
+            interval: Seconds between reports, or 0 to report only on request
+            top_n: Allocation sites reported per snapshot comparison
+            tracemalloc_frames: Stack frames kept per allocation, or 0 to leave tracemalloc off
+            counted_types: Classes whose live instances are counted
+            sizes: Optional function returning a dictionary of store name -> number of entries
+        """
+        self.directory = directory
+        self.interval = interval
+        self.top_n = top_n
+        self.tracemalloc_frames = tracemalloc_frames
+        self.counted_types = tuple(counted_types)
+        self.sizes = sizes
+        if tracemalloc_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(tracemalloc_frames)
+        self._start_process()
+        # A forked process reports on itself, comparing against its own first snapshot
+        os.register_at_fork(after_in_child=self._start_process)
+
+    def _start_process(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        self._first_snapshot = None
+        self._last_snapshot = None
+        self._allocations = None
+        if self.interval > 0:
+            threading.Thread(target=self._report_periodically, name="memory-report", daemon=True).start()
+
+    def _report_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self.snapshot()
+            self.write()
+
+    def snapshot(self):
+        """Take a tracemalloc snapshot and compare it with the previous and the first one."""
+        if not tracemalloc.is_tracing():
+            return
+        key_type = "lineno" if self.tracemalloc_frames == 1 else "traceback"
+        # Leave out tracemalloc's own allocations
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        with self._lock:
+            first, previous = self._first_snapshot, self._last_snapshot
+            if first is None:
+                self._first_snapshot = snapshot
+            self._last_snapshot = snapshot
+            traced, peak = tracemalloc.get_traced_memory()
+            self._allocations = {
+                "taken": time.time(),
+                "traced_bytes": traced,
+                "peak_traced_bytes": peak,
+                "since_previous": allocation_sites(snapshot.compare_to(previous, key_type), self.top_n)
+                if previous is not None else [],
+                "since_first": allocation_sites(snapshot.compare_to(first, key_type), self.top_n)
+                if first is not None else [],
+            }
+
+    def report(self):
+        """
+        Current memory report of this process.
+
+        Returns:
+            Dictionary with pid, rss_bytes, peak_rss_bytes, objects, stores and
+            allocations (the latest snapshot comparison, or None)
+        """
+        with self._lock:
+            allocations = self._allocations
+        return {
+            "pid": self._pid,
+            "time": time.time(),
+            "rss_bytes": resident_memory(),
+            "peak_rss_bytes": peak_resident_memory(),
+            "objects": count_objects(self.counted_types),
+            "stores": self.sizes() if self.sizes is not None else {},
+            "allocations": allocations,
+        }
+
+    def write(self):
+        """Replace this process's file with its current report."""
+        report = self.report()
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(report, f)
+        os.replace(temporary_path, self._path)
+
+    def collect(self):
+        """
+        Reports of all running processes: this one's is taken now, the others'
+        are their latest written ones. Files of exited processes are removed.
+
+        Returns:
+            List of reports, ordered by pid
+        """
+        reports = {self._pid: self.report()}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if report["pid"] in reports:
+                continue
+            if not process_exists(report["pid"]):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            reports[report["pid"]] = report
+        return [reports[pid] for pid in sorted(reports)]
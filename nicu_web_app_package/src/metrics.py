@@ -0,0 +1,313 @@
+"""
+NICU Fluid Management App - Process-Shared Metrics
+"""
+
+import atexit
+import bisect
+import fcntl
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from jobs import process_exists
+
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# File holding the counters and histograms of processes that have exited
+AGGREGATE_FILE = "exited-processes.json"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    A named counter, gauge or histogram with labelled samples.
+    """
+    def __init__(self, registry, kind, name, documentation, labelnames=(), buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+
+    def inc(self, amount=1, **labels):
+        """Add to a counter or gauge."""
+        self.registry._update(self, labels, amount)
+
+    def dec(self, amount=1, **labels):
+        """Subtract from a gauge."""
+        self.registry._update(self, labels, -amount)
+
+    def observe(self, value, **labels):
+        """Record one value in a histogram."""
+        self.registry._update(self, labels, value)
+
+
+class MetricsRegistry:
+    """
+    Metrics of all processes serving the application.
+    Each process keeps its samples in memory, and a background thread writes
+    them to the process's own file in a shared directory every flush_interval
+    seconds when they changed. Collecting reads every file and adds the
+    samples up; gauges of processes that are no longer running are left out.
+    """
+    def __init__(self, directory, flush_interval=1.0):
+        """
+        Initialize the registry.
+
+        Args:
+            directory: Directory shared by the processes, created if needed
+            flush_interval: Seconds between writes of this process's samples
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._start_process()
+        # A forked process reports its own samples; the parent keeps reporting the inherited ones
+        os.register_at_fork(after_in_child=self._start_process)
+        atexit.register(self.flush)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(COUNTER, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(GAUGE, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(HISTOGRAM, name, documentation, labelnames, sorted(buckets))
+
+    def _register(self, kind, name, documentation, labelnames, buckets=None):
+        if name in self.metrics:
+            raise ValueError(f"Metric {name} is already registered")
+        metric = Metric(self, kind, name, documentation, labelnames, buckets)
+        self.metrics[name] = metric
+        return metric
+
+    def _start_process(self):
+        """Start with empty samples, a new file and a flush thread, in a new process or after a fork."""
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        self._samples = {}
+        self._dirty = False
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                if self._dirty:
+                    self._write()
+
+    def _update(self, metric, labels, value):
+        key = tuple(str(labels.get(name, "")) for name in metric.labelnames)
+        with self._lock:
+            samples = self._samples.setdefault(metric.name, {})
+            if metric.kind == HISTOGRAM:
+                sample = samples.get(key)
+                if sample is None:
+                    # Count per bucket, including +Inf, followed by the sum
+                    sample = samples[key] = [0] * (len(metric.buckets) + 1) + [0.0]
+                sample[bisect.bisect_left(metric.buckets, value)] += 1
+                sample[-1] += value
+            else:
+                samples[key] = samples.get(key, 0) + value
+            self._dirty = True
+
+    def flush(self):
+        """Write this process's samples now."""
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        """Replace this process's file with its current samples. Called with the lock held."""
+        data = {
+            "pid": self._pid,
+            "kinds": {name: self.metrics[name].kind for name in self._samples},
+            "samples": {
+                name: [[list(key), value] for key, value in samples.items()]
+                for name, samples in self._samples.items()
+            }
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary_path, self._path)
+        self._dirty = False
+
+    def collect(self):
+        """
+        Add up the samples of all processes.
+
+        The counters and histograms of processes that have exited are first
+        folded into one aggregate file and their own files removed, so the
+        directory does not grow as workers come and go.
+
+        Returns:
+            Dictionary of metric name -> {label values -> value}, with
+            histogram values as bucket counts followed by the sum
+        """
+        self.flush()
+        totals = {name: {} for name in self.metrics}
+        # Collecting processes take turns, so exited files are folded in exactly once
+        with open(os.path.join(self.directory, "collect.lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            for data in self._fold_exited(self._read_files()):
+                running = None
+                for name, samples in data["samples"].items():
+                    metric = self.metrics.get(name)
+                    if metric is None:
+                        continue
+                    if metric.kind == GAUGE:
+                        if running is None:
+                            running = process_exists(data["pid"])
+                        if not running:
+                            continue
+                    for key, value in samples:
+                        add_sample(totals[name], metric.kind, tuple(key), value)
+        return totals
+
+    def _read_files(self):
+        """Read the files of all processes, as a dictionary of path -> data."""
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    files[path] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return files
+
+    def _fold_exited(self, files):
+        """
+        Add the counters and histograms of exited processes to the aggregate
+        file and remove their files; their gauges are dropped.
+        Called with the collect lock held.
+
+        Returns:
+            The data of the remaining files, including the aggregate
+        """
+        aggregate_path = os.path.join(self.directory, AGGREGATE_FILE)
+        aggregate = files.pop(aggregate_path, None) or {"pid": None, "kinds": {}, "samples": {}}
+        exited = [
+            path for path, data in files.items()
+            if data["pid"] != self._pid and not process_exists(data["pid"])
+        ]
+        if exited:
+            sums = {
+                name: {tuple(key): value for key, value in samples}
+                for name, samples in aggregate["samples"].items()
+            }
+            for path in exited:
+                data = files.pop(path)
+                for name, samples in data["samples"].items():
+                    kind = data.get("kinds", {}).get(name) or getattr(self.metrics.get(name), "kind", GAUGE)
+                    if kind == GAUGE:
+                        continue
+                    aggregate["kinds"][name] = kind
+                    for key, value in samples:
+                        add_sample(sums.setdefault(name, {}), kind, tuple(key), value)
+            aggregate["samples"] = {
+                name: [[list(key), value] for key, value in samples.items()] for name, samples in sums.items()
+            }
+            temporary_path = aggregate_path + ".tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(aggregate, f)
+            os.replace(temporary_path, aggregate_path)
+            for path in exited:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        # Temporary files left behind by processes that exited while writing
+        for path in glob.glob(os.path.join(self.directory, "*.json.tmp")):
+            pid = os.path.basename(path).split("-")[0]
+            if pid.isdigit() and not process_exists(int(pid)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return list(files.values()) + [aggregate]
+
+    def render(self):
+        """
+        Render the metrics of all processes in the Prometheus text format.
+        """
+        totals = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(totals[name].items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind != HISTOGRAM:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else format_value(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def add_sample(totals, kind, key, value):
+    """Add one sample to a dictionary of label values -> value, bucket by bucket for histograms"""
+    total = totals.get(key)
+    if total is None:
+        totals[key] = value
+    elif kind == HISTOGRAM:
+        totals[key] = [a + b for a, b in zip(total, value)]
+    else:
+        totals[key] = total + value
+
+
+def format_labels(labels):
+    """Format label pairs as {name="value",...}, escaping the values"""
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    """Format a sample value, without a fraction for whole numbers"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def count_calls(obj, method_names, counter, label="operation"):
+    """
+    Replace methods of an object with wrappers that count each call.
+
+    Args:
+        obj: Object whose methods are counted
+        method_names: Names of the methods
+        counter: Counter metric, labelled with the method name
+        label: Name of the counter label holding the method name
+    """
+    for name in method_names:
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        def counted(*args, _method=method, _labels={label: name}, **kwargs):
+            counter.inc(**_labels)
+            return _method(*args, **kwargs)
+
+        setattr(obj, name, counted)
@@ -0,0 +1,211 @@
+"""
+NICU Fluid Management App - Database Migrations
+"""
+
+import json
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from models import Patient
+
+
+logger = logging.getLogger(__name__)
+
+# Calculated values stored as nutrition_plan_db columns (migration 2)
+CALCULATED_VALUE_COLUMNS = (
+    "total_energy",
+    "total_protein",
+    "total_carbohydrate",
+    "total_fat",
+    "total_sodium",
+    "total_potassium",
+    "total_calcium",
+    "total_phosphate",
+    "total_magnesium",
+    "glucose_infusion_rate",
+    "total_parenteral_volume",
+    "total_fluid",
+)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Key of the PostgreSQL advisory lock held while a migration is applied
+MIGRATION_LOCK_KEY = 7164203
+
+
+def add_calculated_value_columns(connection):
+    """
+    Add the calculated value columns to nutrition_plan_db where they are missing.
+
+    Args:
+        connection: SQLAlchemy connection
+    """
+    existing = {column["name"] for column in inspect(connection).get_columns("nutrition_plan_db")}
+    columns = [(column, "FLOAT") for column in CALCULATED_VALUE_COLUMNS]
+    columns += [("reference_version", "VARCHAR(16)"), ("weight_category", "VARCHAR(30)")]
+    for column, column_type in columns:
+        if column not in existing:
+            connection.execute(text(f"ALTER TABLE nutrition_plan_db ADD COLUMN {column} {column_type}"))
+
+
+def backfill_calculated_values(connection):
+    """
+    Copy the calculated values of existing plans from their JSON text into the columns.
+
+    Args:
+        connection: SQLAlchemy connection
+    """
+    assignments = ", ".join(f"{column} = :{column}" for column in CALCULATED_VALUE_COLUMNS)
+    update = text(f"UPDATE nutrition_plan_db SET {assignments}, reference_version = :reference_version WHERE id = :id")
+
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            "SELECT id, calculated_values FROM nutrition_plan_db "
+            "WHERE id > :last_id AND total_energy IS NULL AND calculated_values IS NOT NULL "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            return
+
+        params = []
+        for plan_row_id, calculated_values in rows:
+            values = json.loads(calculated_values)
+            params.append(dict(
+                {column: values.get(column) for column in CALCULATED_VALUE_COLUMNS},
+                reference_version=values.get("reference_version"),
+                id=plan_row_id
+            ))
+        connection.execute(update, params)
+        last_id = rows[-1][0]
+
+
+def backfill_weight_categories(connection):
+    """
+    Set the weight category of existing plans from the current weight of their patient.
+
+    Args:
+        connection: SQLAlchemy connection
+    """
+    patients = connection.execute(text(
+        "SELECT patient_id, gestational_age_at_birth, birth_weight, current_weight FROM patient_db"
+    )).fetchall()
+    if not patients:
+        return
+    connection.execute(
+        text("UPDATE nutrition_plan_db SET weight_category = :weight_category "
+             "WHERE patient_id = :patient_id AND weight_category IS NULL"),
+        [
+            {"patient_id": row[0], "weight_category": Patient(*row).get_weight_category()}
+            for row in patients
+        ]
+    )
+
+
+# Schema changes for existing databases, as (version, description, steps), where
+# each step is an SQL statement or a function taking the connection.
+# New databases get the same schema from the models through create_all; the
+# steps must therefore be safe to run against a schema that already has them.
+MIGRATIONS = [
+    (1, "Composite indexes for patient and nutrition plan lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_patient_db_user_created ON patient_db (user_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_nutrition_plan_db_patient_user_date "
+        "ON nutrition_plan_db (patient_id, user_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_nutrition_plan_db_patient_user_created "
+        "ON nutrition_plan_db (patient_id, user_id, created_at, id)",
+    ]),
+    (2, "Calculated nutrition values as columns", [
+        add_calculated_value_columns,
+        "CREATE INDEX IF NOT EXISTS ix_nutrition_plan_db_user_date ON nutrition_plan_db (user_id, date)",
+        backfill_calculated_values,
+        backfill_weight_categories,
+    ]),
+    (3, "Index for walking all nutrition plans of a user", [
+        "CREATE INDEX IF NOT EXISTS ix_nutrition_plan_db_user_created ON nutrition_plan_db (user_id, created_at, id)",
+    ]),
+]
+
+
+def applied_versions(connection):
+    """
+    Get the migration versions recorded in the database.
+
+    Args:
+        connection: SQLAlchemy connection
+
+    Returns:
+        Set of applied version numbers
+    """
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def lock_migrations(connection):
+    """
+    Keep other processes from applying migrations until the current transaction ends.
+    PostgreSQL takes a transaction-level advisory lock and SQLite takes its write
+    lock with BEGIN IMMEDIATE; other databases are not locked.
+
+    Args:
+        connection: SQLAlchemy connection at the start of a transaction
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    elif connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def run_migrations(engine, migrations=MIGRATIONS):
+    """
+    Apply the migrations that have not been applied yet, each in its own transaction.
+
+    Several workers may start at the same time. Each migration is applied while
+    holding the migration lock and skipped if another worker recorded it first;
+    where no lock is available, a migration that fails is skipped if another
+    worker has recorded it since.
+
+    Args:
+        engine: SQLAlchemy engine
+        migrations: List of (version, description, steps)
+
+    Returns:
+        List of versions applied by this call
+    """
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    applied = []
+    for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+        if version in done:
+            continue
+        try:
+            with engine.begin() as connection:
+                lock_migrations(connection)
+                if version in applied_versions(connection):
+                    logger.info(f"Migration {version} was applied by another process")
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(connection)
+                    else:
+                        connection.execute(text(step))
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": description}
+                )
+        except DBAPIError:
+            with engine.begin() as connection:
+                if version not in applied_versions(connection):
+                    raise
+            logger.info(f"Migration {version} was applied by another process")
+            continue
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
@@ -2,6 +2,57 @@
 NICU Fluid Management App - Data Models
 """
 
+from dataclasses import dataclass
+from types import MappingProxyType
+
+
+# Weight categories as (upper weight limit in grams, exclusive; category), lightest first.
+# Patients at or above the last limit are "term".
+WEIGHT_CATEGORY_LIMITS = (
+    (1000, "premature_less_1000g"),
+    (1500, "premature_1000_1500g"),
+    (2500, "premature_greater_1500g"),
+)
+DEFAULT_WEIGHT_CATEGORY = "term"
+
+# Postnatal age categories as (first day, last day, category), both days inclusive.
+# Ages outside these ranges are "day_15_plus".
+AGE_CATEGORY_RANGES = (
+    (1, 1, "day_1"),
+    (2, 2, "day_2"),
+    (3, 3, "day_3"),
+    (4, 4, "day_4"),
+    (5, 7, "day_5_7"),
+    (8, 14, "day_8_14"),
+)
+DEFAULT_AGE_CATEGORY = "day_15_plus"
+
+# Nutrition sources in calculation order, with the plan inputs each one depends on
+SOURCE_FIELDS = (
+    ("tpn", ("tpn_type", "tpn_volume")),
+    ("lipid", ("lipid_type", "lipid_volume")),
+    ("glucose", ("glucose_concentration", "glucose_volume")),
+    ("enteral", ("enteral_feeding_type", "enteral_volume", "bmf_concentration")),
+)
+SOURCES = tuple(source for source, _ in SOURCE_FIELDS)
+FIELD_SOURCES = {field: source for source, fields in SOURCE_FIELDS for field in fields}
+
+# Nutrition plan inputs whose changes are tracked
+PLAN_INPUT_FIELDS = (
+    "total_fluid_target",
+    "enteral_volume",
+    "tpn_type",
+    "tpn_volume",
+    "lipid_type",
+    "lipid_volume",
+    "glucose_concentration",
+    "glucose_volume",
+    "enteral_feeding_type",
+    "enteral_feeding_frequency",
+    "bmf_concentration",
+)
+
+
 class Patient:
     """
     Patient model for NICU fluid management app.
@@ -38,14 +89,10 @@ class Patient:
             "premature_greater_1500g", or "term"
         """
         weight = self.current_weight
-        if weight < 1000:
-            return "premature_less_1000g"
-        elif weight < 1500:
-            return "premature_1000_1500g"
-        elif weight < 2500:
-            return "premature_greater_1500g"
-        else:
-            return "term"
+        for limit, category in WEIGHT_CATEGORY_LIMITS:
+            if weight < limit:
+                return category
+        return DEFAULT_WEIGHT_CATEGORY
     
     def get_postnatal_age_category(self):
         """
@@ -55,26 +102,21 @@ class Patient:
             String representing age category: "day_1", "day_2", etc.
         """
         age = self.postnatal_age
-        if age == 1:
-            return "day_1"
-        elif age == 2:
-            return "day_2"
-        elif age == 3:
-            return "day_3"
-        elif age == 4:
-            return "day_4"
-        elif 5 <= age <= 7:
-            return "day_5_7"
-        elif 8 <= age <= 14:
-            return "day_8_14"
-        else:
-            return "day_15_plus"
+        for first_day, last_day, category in AGE_CATEGORY_RANGES:
+            if first_day <= age <= last_day:
+                return category
+        return DEFAULT_AGE_CATEGORY
 
 
 class NutritionPlan:
     """
     Nutrition Plan model for NICU fluid management app.
     Stores nutrition plan details and provides methods for calculations.
+    
+    Changes to the inputs in PLAN_INPUT_FIELDS are tracked: changed fields are
+    collected until pop_changed_fields is called, and the cached contribution
+    of the nutrition source a changed field feeds is dropped, so the next
+    calculation only recomputes that source.
     """
     def __init__(self, plan_id, patient_id, date, total_fluid_target=None,
                  enteral_volume=0, tpn_type="NICU-mix", tpn_volume=0,
@@ -101,6 +143,10 @@ class NutritionPlan:
             enteral_feeding_frequency: Number of feedings per 24 hours
             bmf_concentration: Breast milk fortifier concentration in g/100ml
         """
+        self._changed_fields = set()
+        self.source_contributions = {}  # source -> cached contribution, see NutritionCalculator
+        self.recommendation_groups = {}  # recommendation check -> recommendations, see RecommendationEngine
+        
         self.plan_id = plan_id
         self.patient_id = patient_id
         self.date = date
@@ -128,6 +174,45 @@ class NutritionPlan:
         self.total_phosphate = 0  # mmol/kg/day
         self.total_magnesium = 0  # mmol/kg/day
         self.glucose_infusion_rate = 0  # mg/kg/min
+        self.reference_version = None  # Reference data version used for the calculated values
+    
+    def __setattr__(self, name, value):
+        if name in PLAN_INPUT_FIELDS and name in self.__dict__ and self.__dict__[name] != value:
+            self._changed_fields.add(name)
+            source = FIELD_SOURCES.get(name)
+            if source is not None:
+                self.source_contributions.pop(source, None)
+        super().__setattr__(name, value)
+    
+    def update(self, **changes):
+        """
+        Change several plan inputs at once.
+        
+        Args:
+            **changes: New values of fields in PLAN_INPUT_FIELDS
+            
+        Returns:
+            List of the fields whose value actually changed, in PLAN_INPUT_FIELDS order
+        """
+        unknown = set(changes) - set(PLAN_INPUT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown nutrition plan fields: {', '.join(sorted(unknown))}")
+        
+        changed = [field for field in PLAN_INPUT_FIELDS if field in changes and getattr(self, field) != changes[field]]
+        for field in changed:
+            setattr(self, field, changes[field])
+        return changed
+    
+    def pop_changed_fields(self):
+        """
+        Get the inputs changed since the last call and start tracking afresh.
+        
+        Returns:
+            List of changed fields in PLAN_INPUT_FIELDS order
+        """
+        changed = [field for field in PLAN_INPUT_FIELDS if field in self._changed_fields]
+        self._changed_fields.clear()
+        return changed
     
     def calculate_parenteral_volume(self):
         """
@@ -139,14 +224,19 @@ class NutritionPlan:
         self.parenteral_volume = self.tpn_volume + self.lipid_volume + self.glucose_volume
         return self.parenteral_volume
     
-    def calculate_total_fluid(self):
+    def calculate_total_fluid(self, parenteral_volume=None):
         """
         Calculate total fluid intake.
         
+        Args:
+            parenteral_volume: Already calculated parenteral volume, calculated if not given
+            
         Returns:
             Total fluid intake in ml/kg/day
         """
-        return self.enteral_volume + self.calculate_parenteral_volume()
+        if parenteral_volume is None:
+            parenteral_volume = self.calculate_parenteral_volume()
+        return self.enteral_volume + parenteral_volume
     
     def get_feeding_volume_per_feed(self):
         """
@@ -158,3 +248,39 @@ class NutritionPlan:
         if self.enteral_feeding_frequency and self.enteral_feeding_frequency > 0:
             return self.enteral_volume / self.enteral_feeding_frequency
         return None
+
+
+@dataclass(frozen=True)
+class PlanEvaluation:
+    """
+    Immutable result of evaluating a nutrition plan.
+    Holds everything derived from a plan in one pass: calculated values,
+    fluid requirements, recommendations and the feeding schedule.
+    """
+    plan_id: str
+    patient_id: str
+    calculated_values: MappingProxyType  # totals, GIR, parenteral volume and total fluid
+    fluid_requirements: MappingProxyType  # min and max in ml/kg/day
+    recommendations: tuple  # recommendation strings
+    feeding_schedule: tuple  # (time, volume_per_kg, type) per feed
+    reference_version: str  # reference data version used for the calculation
+    weight_category: str  # patient weight category the plan was evaluated for
+    
+    def to_dict(self):
+        """
+        Convert the evaluation to plain, JSON-serializable data.
+        
+        Returns:
+            Dictionary with calculated_values, fluid_requirements,
+            recommendations, feeding_schedule and weight_category
+        """
+        return {
+            "weight_category": self.weight_category,
+            "calculated_values": dict(self.calculated_values),
+            "fluid_requirements": dict(self.fluid_requirements),
+            "recommendations": list(self.recommendations),
+            "feeding_schedule": [
+                {"time": time_str, "volume_per_kg": volume_per_kg, "type": feeding_type}
+                for time_str, volume_per_kg, feeding_type in self.feeding_schedule
+            ]
+        }
@@ -1,44 +1,61 @@
 import logging
 import os
 import time
-from logging.handlers import RotatingFileHandler
-from flask import Flask, request, g
+from flask import Flask, Response, request, g
+from flask.logging import default_handler
+from log_pipeline import LogPipelineHandler, RequestLogSampler
+from metrics import MetricsRegistry
+from tracing import STATUS_ERROR, new_trace_id, parse_traceparent, tracer
 
-def setup_logging(app):
+def setup_logging(app, metrics=None):
     """
     Set up logging for the application.
     
+    Records are handed to a LogPipelineHandler without blocking and written
+    as JSON lines to logs/nicu_app.log (under app.config['LOG_DIR']) by a
+    single log writer process shared by all workers, which also rotates the file.
+    
     Args:
         app: Flask application instance
+        metrics: Optional MetricsRegistry to count dropped log records in
+        
+    Returns:
+        The LogPipelineHandler
     """
     # Ensure log directory exists
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    # Set up file handler for application logs
-    file_handler = RotatingFileHandler(
-        'logs/nicu_app.log', 
-        maxBytes=10485760,  # 10MB
-        backupCount=10
+    log_dir = app.config.get('LOG_DIR', 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    
+    dropped_counter = None
+    if metrics is not None:
+        dropped_counter = metrics.counter(
+            'nicu_log_records_dropped_total', 'Log records dropped instead of blocking a request', ('reason',)
+        )
+    
+    # Queue records for the log writer process, rotating at 10MB
+    pipeline_handler = LogPipelineHandler(
+        os.path.join(log_dir, 'nicu_app.log'),
+        max_bytes=10485760,  # 10MB
+        backup_count=10,
+        capacity=app.config.get('LOG_QUEUE_SIZE', 10000),
+        dropped_counter=dropped_counter
     )
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    
-    # Set up console handler for development
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG if app.debug else logging.INFO)
-    console_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s'
-    ))
-    
-    # Configure app logger
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(console_handler)
+    pipeline_handler.setLevel(logging.DEBUG if app.debug else logging.INFO)
+    
+    # The pipeline replaces Flask's synchronous stderr handler; development keeps a console
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(pipeline_handler)
+    if app.debug:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.DEBUG)
+        console_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s'
+        ))
+        app.logger.addHandler(console_handler)
     app.logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
     
     app.logger.info('NICU Fluid Management App startup')
+    return pipeline_handler
 
 def log_request_info():
     """Log information about each request."""
@@ -114,28 +131,130 @@ class PerformanceMonitoring:
     """Performance monitoring for the application."""
     
     @staticmethod
-    def register(app):
-        """Register performance monitoring with the Flask app."""
+    def register(app, profiler=None):
+        """
+        Register performance monitoring with the Flask app.
+        
+        Request latency and in-flight requests are recorded in a MetricsRegistry
+        shared by all worker processes through app.config['METRICS_DIR'], and
+        served in the Prometheus text format on /metrics. At most
+        app.config['LOG_REQUEST_RATE'] requests per second are logged; each
+        logged request counts the ones left out before it in `sampled_out`.
+        
+        With a profiler, a request carrying a profiling token in the
+        X-Profile-Token header or the profile_token query parameter is
+        profiled if the profiler allows it. The response says so in
+        X-Profile-Id, or gives the reason it was not profiled in X-Profile-Refused.
+        
+        Args:
+            app: Flask application instance
+            profiler: Optional RequestProfiler for on-demand request profiles
+        
+        Returns:
+            The MetricsRegistry, for registering further metrics
+        """
+        metrics = MetricsRegistry(
+            app.config.get('METRICS_DIR', 'nicu_metrics'),
+            flush_interval=app.config.get('METRICS_FLUSH_SECONDS', 1.0)
+        )
+        request_duration = metrics.histogram(
+            'nicu_http_request_duration_seconds', 'Time to handle an HTTP request, including streaming the response',
+            ('route', 'method', 'status')
+        )
+        requests_in_flight = metrics.gauge(
+            'nicu_http_requests_in_flight', 'HTTP requests being handled', ('route', 'method')
+        )
+        requests_sampled_out = metrics.counter(
+            'nicu_log_requests_sampled_out_total', 'Requests left out of the request log under load'
+        )
+        slow_request_seconds = app.config.get('SLOW_REQUEST_SECONDS', 1.0)
+        request_log_sampler = RequestLogSampler(app.config.get('LOG_REQUEST_RATE', 50))
         
         @app.before_request
         def start_timer():
-            g.start_time = time.time()
+            g.start_time = time.perf_counter()
+            # Label by URL rule rather than path, so IDs in URLs do not create new series
+            g.route = request.url_rule.rule if request.url_rule else 'unmatched'
+            requests_in_flight.inc(route=g.route, method=request.method)
         
         @app.after_request
         def log_request_time(response):
-            if hasattr(g, 'start_time'):
-                elapsed = time.time() - g.start_time
-                app.logger.info(f"Request {request.method} {request.path} took {elapsed:.6f}s")
+            if 'start_time' in g:
+                elapsed = time.perf_counter() - g.start_time
+                g.status = response.status_code
                 
                 # Add timing header to response
                 response.headers['X-Response-Time'] = f"{elapsed:.6f}s"
                 
-                # Log slow requests
-                if elapsed > 1.0:  # Log requests taking more than 1 second
-                    app.logger.warning(f"Slow request: {request.method} {request.path} took {elapsed:.6f}s")
+                fields = {
+                    'method': request.method, 'path': request.path, 'status': response.status_code,
+                    'duration_ms': round(elapsed * 1000, 3), 'trace_id': g.get('trace_id')
+                }
+                if elapsed > slow_request_seconds:
+                    # Log slow requests
+                    app.logger.warning("Slow request: %s %s took %.6fs", request.method, request.path, elapsed,
+                                       extra=fields)
+                elif app.logger.isEnabledFor(logging.INFO):
+                    # Under load only a sample of requests is logged; errors always are
+                    skipped = 0 if response.status_code >= 500 else request_log_sampler.sample()
+                    if skipped is None:
+                        requests_sampled_out.inc()
+                    else:
+                        app.logger.info("Request %s %s took %.6fs", request.method, request.path, elapsed,
+                                        extra=dict(fields, sampled_out=skipped))
             
             return response
         
+        @app.teardown_request
+        def record_request_time(error=None):
+            # Runs after a streamed response has been sent, or after an unhandled error
+            if 'start_time' in g:
+                request_duration.observe(
+                    time.perf_counter() - g.start_time,
+                    route=g.route, method=request.method, status=g.get('status', 500)
+                )
+                requests_in_flight.dec(route=g.route, method=request.method)
+        
+        if profiler is not None:
+            profiles_started = metrics.counter(
+                'nicu_request_profiles_total', 'Requests asking to be profiled, by outcome', ('outcome',)
+            )
+            
+            @app.before_request
+            def start_profile():
+                token = request.headers.get('X-Profile-Token') or request.args.get('profile_token')
+                if not token:
+                    return
+                profile = profiler.start(token, request.path)
+                if isinstance(profile, str):
+                    g.profile_refused = profile
+                    profiles_started.inc(outcome=profile)
+                else:
+                    g.profile = profile
+                    profiles_started.inc(outcome='profiled')
+            
+            @app.after_request
+            def add_profile_header(response):
+                if 'profile' in g:
+                    response.headers['X-Profile-Id'] = g.profile.id
+                elif 'profile_refused' in g:
+                    response.headers['X-Profile-Refused'] = g.profile_refused
+                return response
+            
+            @app.teardown_request
+            def save_profile(error=None):
+                # Runs after a streamed response has been sent, so the profile covers streaming too
+                if 'profile' in g:
+                    profiler.finish(g.pop('profile'), {
+                        'method': request.method, 'path': request.path,
+                        'route': g.get('route'), 'status': g.get('status', 500)
+                    })
+        
+        @app.route('/metrics')
+        def metrics_endpoint():
+            """Metrics of all worker processes in the Prometheus text format."""
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+        
         # Optional: integrate with external performance monitoring service
         if os.environ.get('NEW_RELIC_LICENSE_KEY'):
             try:
@@ -144,6 +263,49 @@ class PerformanceMonitoring:
                 app.logger.info("New Relic performance monitoring enabled")
             except ImportError:
                 app.logger.warning("New Relic package not installed")
+        
+        return metrics
+
+class RequestTracing:
+    """Per-request tracing for the application."""
+    
+    @staticmethod
+    def register(app, tracer):
+        """
+        Start a trace for each request and return its trace ID in X-Trace-Id.
+        
+        The trace ID and sampling decision of a W3C traceparent header are
+        kept; other requests get a new trace ID and are sampled by the tracer.
+        
+        Args:
+            app: Flask application instance
+            tracer: Tracer deciding which requests are traced
+        """
+        
+        @app.before_request
+        def start_request_trace():
+            trace_id, parent_span_id, sampled = parse_traceparent(request.headers.get('traceparent'))
+            g.trace_id = trace_id or new_trace_id()
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            g.trace_span = tracer.start_trace(
+                f"{request.method} {route}", g.trace_id, parent_span_id, sampled,
+                **{'http.method': request.method, 'http.route': route}
+            )
+        
+        @app.after_request
+        def add_trace_header(response):
+            if 'trace_span' in g:
+                response.headers['X-Trace-Id'] = g.trace_id
+                g.trace_span.set_attribute('http.status_code', response.status_code)
+                if response.status_code >= 500:
+                    g.trace_span.set_status(STATUS_ERROR)
+            return response
+        
+        @app.teardown_request
+        def end_request_trace(error=None):
+            # Runs after a streamed response has been sent, or after an unhandled error
+            if 'trace_span' in g:
+                tracer.end_trace(g.pop('trace_span'), error)
 
 def setup_monitoring(app):
     """
@@ -152,8 +314,14 @@ def setup_monitoring(app):
     Args:
         app: Flask application instance
     """
+    # Register performance monitoring
+    metrics = PerformanceMonitoring.register(app)
+    
     # Set up logging
-    setup_logging(app)
+    setup_logging(app, metrics)
+    
+    # Register request tracing, sampled once the tracer is configured
+    RequestTracing.register(app, tracer)
     
     # Register health checks
     HealthCheck.register(app)
@@ -161,7 +329,4 @@ def setup_monitoring(app):
     # Register error monitoring
     ErrorMonitoring.register(app)
     
-    # Register performance monitoring
-    PerformanceMonitoring.register(app)
-    
     app.logger.info("Monitoring setup complete")
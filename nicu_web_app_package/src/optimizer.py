@@ -0,0 +1,466 @@
+"""
+NICU Fluid Management App - Parenteral Volume Optimizer
+"""
+
+import numpy as np
+
+from reference_data import NUTRIENT_FIELDS
+
+
+PROTEIN = NUTRIENT_FIELDS.index("total_protein")
+FAT = NUTRIENT_FIELDS.index("total_fat")
+
+# Point of each requirement range the optimizer aims for
+TARGETS = {"min": 0.0, "mid": 0.5, "max": 1.0}
+
+# Tolerance for comparing calculated totals with requirement bounds
+TOLERANCE = 1e-9
+
+# Largest condition number of the TPN/lipid protein and fat matrix that still gives usable volumes
+MAX_CONDITION = 1e8
+
+
+class CompositionError(ValueError):
+    """
+    Raised when the selected TPN and lipid solutions cannot meet the protein
+    and fat targets independently (e.g. a lipid without fat).
+    """
+
+
+# Requirements a what-if grid is scored against, as (calculated value, requirement bounds)
+GRID_REQUIREMENTS = (
+    ("total_fluid", "fluid"),
+    ("total_protein", "protein"),
+    ("total_fat", "fat"),
+    ("glucose_infusion_rate", "gir"),
+)
+
+
+def axis_size(minimum, maximum, step):
+    """
+    Number of volumes from minimum to maximum (inclusive) in steps of step.
+
+    Args:
+        minimum: First volume in ml/kg/day
+        maximum: Last volume in ml/kg/day
+        step: Distance between volumes in ml/kg/day
+
+    Returns:
+        Number of volumes on the axis
+    """
+    if minimum < 0 or maximum < minimum:
+        raise ValueError(f"Invalid volume range: {minimum} to {maximum}")
+    if step <= 0:
+        raise ValueError(f"Volume step must be positive, got {step}")
+    return int(np.floor((maximum - minimum) / step + 1e-9)) + 1
+
+
+def volume_axis(minimum, maximum, step):
+    """
+    Volumes from minimum to maximum (inclusive) in steps of step.
+
+    Args:
+        minimum: First volume in ml/kg/day
+        maximum: Last volume in ml/kg/day
+        step: Distance between volumes in ml/kg/day
+
+    Returns:
+        NumPy array of volumes
+    """
+    return np.round(minimum + np.arange(axis_size(minimum, maximum, step)) * step, 9)
+
+
+def pareto_front(costs, limit):
+    """
+    Find the rows of a cost matrix that no other row dominates.
+
+    Rows are visited in order of their total cost. The cheapest remaining row
+    cannot be dominated, so it joins the front and every row it dominates
+    (including its duplicates) is dropped.
+
+    Args:
+        costs: (rows x objectives) array, lower is better
+        limit: Maximum number of rows to return
+
+    Returns:
+        Row indices of up to limit non-dominated rows, lowest total cost first
+    """
+    order = np.argsort(costs.sum(axis=1), kind="stable")
+    remaining = costs[order]
+    positions = order
+    front = []
+    while len(positions) and len(front) < limit:
+        front.append(positions[0])
+        keep = np.any(remaining < remaining[0], axis=1)
+        remaining = remaining[keep]
+        positions = positions[keep]
+    return np.array(front, dtype=np.intp)
+
+
+def solution_rows(solution):
+    """
+    Convert the columns returned by ParenteralOptimizer.solve_batch to one dictionary per patient.
+
+    Args:
+        solution: Dictionary returned by solve_batch
+
+    Returns:
+        List of dictionaries with plain Python values
+    """
+    count = len(solution["glucose_concentration"])
+    columns = {}
+    for name, values in solution.items():
+        if isinstance(values, np.ndarray):
+            columns[name] = values.tolist()
+        elif isinstance(values, list):
+            columns[name] = values
+        else:
+            columns[name] = [values] * count
+    return [{name: values[i] for name, values in columns.items()} for i in range(count)]
+
+
+class ParenteralOptimizer:
+    """
+    Suggests TPN, lipid and glucose volumes for a patient.
+
+    Works back from the requirements like the feeding agent notebook: TPN and
+    lipid volumes are solved from the protein and fat targets, and glucose
+    fills the remaining room up to the fluid ceiling. On top of that the
+    glucose volume is kept within the glucose infusion rate bounds, picking
+    another glucose concentration when the preferred one cannot meet them.
+    Protein and fat move from their targets towards their minimums when the
+    minimum infusion rate would not fit otherwise, and TPN and lipid are scaled
+    down together when they alone exceed the fluid ceiling.
+    """
+    def __init__(self, calculator, tpn_type="NICU-mix", lipid_type="SMOF_20%",
+                 glucose_concentration="10%", target="max"):
+        """
+        Initialize the optimizer.
+
+        Args:
+            calculator: NutritionCalculator providing requirements and compositions
+            tpn_type: TPN solution to use
+            lipid_type: Lipid solution to use
+            glucose_concentration: Preferred glucose concentration (e.g., "10%")
+            target: Point of the protein and fat ranges to aim for: "min", "mid" or "max"
+        """
+        if target not in TARGETS:
+            raise ValueError(f"Unknown target: {target}")
+        self.calculator = calculator
+        self.tpn_type = tpn_type
+        self.lipid_type = lipid_type
+        self.glucose_concentration = glucose_concentration
+        self.target = target
+
+    def requirement_columns(self, patients):
+        """
+        Collect the requirement bounds of many patients as arrays.
+
+        Args:
+            patients: Sequence of Patient objects
+
+        Returns:
+            Dictionary with fluid_min/max, protein_min/max, fat_min/max and
+            gir_min/max arrays, one value per patient
+        """
+        rows = []
+        for patient in patients:
+            fluid = self.calculator.calculate_fluid_requirements(patient)
+            macro = self.calculator.get_macronutrient_requirements(patient)
+            rows.append((
+                fluid["min"], fluid["max"],
+                macro["protein_g_kg_day"]["min"], macro["protein_g_kg_day"]["max"],
+                macro["fat_g_kg_day"]["min"], macro["fat_g_kg_day"]["max"],
+                macro["glucose_mg_kg_min"]["min"], macro["glucose_mg_kg_min"]["max"]
+            ))
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), 8)
+        names = ("fluid_min", "fluid_max", "protein_min", "protein_max", "fat_min", "fat_max", "gir_min", "gir_max")
+        return {name: values[:, column] for column, name in enumerate(names)}
+
+    def solve(self, patient, enteral_volume=0, enteral_feeding_type=None, bmf_concentration=0):
+        """
+        Suggest parenteral volumes for one patient.
+
+        Args:
+            patient: Patient object
+            enteral_volume: Enteral volume in ml/kg/day
+            enteral_feeding_type: Enteral feed type (e.g., "Breast milk")
+            bmf_concentration: Breast milk fortifier concentration in g/100ml
+
+        Returns:
+            Dictionary with the solution, see solve_batch
+        """
+        return solution_rows(self.solve_batch(
+            [patient], [enteral_volume], [enteral_feeding_type], [bmf_concentration]
+        ))[0]
+
+    def solve_batch(self, patients, enteral_volumes=None, enteral_feeding_types=None, bmf_concentrations=None):
+        """
+        Suggest parenteral volumes for many patients at once.
+
+        Protein and fat supplied by the enteral feeds are subtracted from the
+        targets before the parenteral volumes are solved.
+
+        Args:
+            patients: Sequence of Patient objects
+            enteral_volumes: Enteral volume per patient in ml/kg/day, 0 if not given
+            enteral_feeding_types: Enteral feed type per patient, counting towards fluid only if not given
+            bmf_concentrations: Breast milk fortifier concentration per patient in g/100ml, 0 if not given
+
+        Returns:
+            Dictionary with tpn_type, lipid_type and reference_version, a
+            glucose_concentration list, and NumPy arrays with one value per
+            patient for tpn_volume, lipid_volume, glucose_volume, total_fluid,
+            the nutrition values in NUTRIENT_FIELDS, glucose_infusion_rate,
+            the requirement bounds and feasible (all requirements met)
+
+        Raises:
+            CompositionError: If the TPN and lipid solutions cannot meet protein and fat targets independently
+        """
+        count = len(patients)
+        requirements = self.requirement_columns(patients)
+        enteral = np.zeros(count) if enteral_volumes is None else np.asarray(enteral_volumes, dtype=np.float64)
+        enteral_inputs = {
+            "enteral_feeding_type": enteral_feeding_types,
+            "enteral_volume": enteral,
+            "bmf_concentration": bmf_concentrations,
+        }
+        enteral_totals = self.calculator.calculate_nutrition_columns(
+            tpn_type=[None] * count,
+            tpn_volume=np.zeros(count),
+            lipid_type=[None] * count,
+            lipid_volume=np.zeros(count),
+            glucose_concentration=[None] * count,
+            glucose_volume=np.zeros(count),
+            **enteral_inputs
+        )
+        enteral_nutrients = np.column_stack([enteral_totals["total_protein"], enteral_totals["total_fat"]])
+
+        reference = self.calculator.reference_data
+        matrix = reference.composition_matrix
+        tpn_row = reference.source_index["tpn"][self.tpn_type]
+        lipid_row = reference.source_index["lipid"][self.lipid_type]
+
+        concentrations = sorted(reference.glucose_mg_per_ml, key=reference.glucose_mg_per_ml.get)
+        mg_per_ml = np.array([reference.glucose_mg_per_ml[name] for name in concentrations])
+        minutes = 24 * 60
+
+        # TPN and lipid volumes from what the protein and fat targets, and the minimum
+        # requirements, leave after the enteral feeds
+        weight = TARGETS[self.target]
+        targets = np.column_stack([
+            requirements["protein_min"] + weight * (requirements["protein_max"] - requirements["protein_min"]),
+            requirements["fat_min"] + weight * (requirements["fat_max"] - requirements["fat_min"]),
+        ]) - enteral_nutrients
+        minimums = np.column_stack([requirements["protein_min"], requirements["fat_min"]]) - enteral_nutrients
+        nutrients = matrix[[tpn_row, lipid_row]][:, [PROTEIN, FAT]]
+        # Rows that are (nearly) collinear leave protein and fat tied together; cond is inf when singular
+        if not np.linalg.cond(nutrients) < MAX_CONDITION:
+            raise CompositionError(
+                f"Selected products cannot meet protein/fat targets independently: "
+                f"{self.tpn_type} and {self.lipid_type}"
+            )
+        inverse = np.linalg.inv(nutrients.T).T
+        target_volumes = np.maximum(targets @ inverse, 0.0)
+        minimum_volumes = np.minimum(np.maximum(minimums @ inverse, 0.0), target_volumes)
+
+        # Move from the targets towards the minimums as far as needed to leave room
+        # for the minimum glucose infusion rate at the highest concentration
+        room = np.maximum(requirements["fluid_max"] - enteral, 0.0)
+        budget = np.maximum(room - requirements["gir_min"] * minutes / mg_per_ml[-1], 0.0)
+        target_used = target_volumes.sum(axis=1)
+        minimum_used = minimum_volumes.sum(axis=1)
+        span = target_used - minimum_used
+        fraction = np.clip(np.divide(budget - minimum_used, span, out=np.ones(count), where=span > 0), 0.0, 1.0)
+        volumes = minimum_volumes + fraction[:, np.newaxis] * (target_volumes - minimum_volumes)
+
+        # Scale TPN and lipid down together if they do not fit under the fluid ceiling
+        used = volumes.sum(axis=1)
+        scale = np.minimum(1.0, np.divide(room, used, out=np.ones(count), where=used > 0))
+        volumes *= scale[:, np.newaxis]
+        tpn_volume, lipid_volume = volumes[:, 0], volumes[:, 1]
+
+        # Glucose fills up to the fluid ceiling within the infusion rate bounds,
+        # evaluated for every glucose concentration at once
+        desired = np.maximum(room - tpn_volume - lipid_volume, 0.0)[:, np.newaxis]
+        glucose_low = requirements["gir_min"][:, np.newaxis] * minutes / mg_per_ml
+        glucose_high = requirements["gir_max"][:, np.newaxis] * minutes / mg_per_ml
+        glucose_options = np.minimum(np.clip(desired, glucose_low, glucose_high), desired)
+
+        fluid = enteral[:, np.newaxis] + tpn_volume[:, np.newaxis] + lipid_volume[:, np.newaxis] + glucose_options
+        gir = glucose_options * mg_per_ml / minutes
+        fluid_min = requirements["fluid_min"][:, np.newaxis]
+        gir_min = requirements["gir_min"][:, np.newaxis]
+        gir_max = requirements["gir_max"][:, np.newaxis]
+        # Relative distance from the fluid minimum and the infusion rate bounds
+        shortfall = (
+            np.maximum(fluid_min - fluid, 0.0) / fluid_min.clip(1.0)
+            + np.maximum(gir_min - gir, 0.0) / gir_min.clip(TOLERANCE)
+            + np.maximum(gir - gir_max, 0.0) / gir_max.clip(TOLERANCE)
+        )
+        if self.glucose_concentration in concentrations:
+            # The preferred concentration wins ties
+            shortfall[:, concentrations.index(self.glucose_concentration)] -= TOLERANCE
+        choice = shortfall.argmin(axis=1)
+        glucose_volume = glucose_options[np.arange(count), choice]
+        glucose_concentration = [concentrations[i] for i in choice.tolist()]
+
+        # Evaluate the suggestion exactly as a plan with these volumes would be
+        results = self.calculator.calculate_nutrition_columns(
+            tpn_type=[self.tpn_type] * count,
+            tpn_volume=tpn_volume,
+            lipid_type=[self.lipid_type] * count,
+            lipid_volume=lipid_volume,
+            glucose_concentration=glucose_concentration,
+            glucose_volume=glucose_volume,
+            **enteral_inputs
+        )
+        total_fluid = enteral + tpn_volume + lipid_volume + glucose_volume
+        feasible = (
+            (total_fluid >= requirements["fluid_min"] - TOLERANCE)
+            & (total_fluid <= requirements["fluid_max"] + TOLERANCE)
+            & (results["total_protein"] >= requirements["protein_min"] - TOLERANCE)
+            & (results["total_fat"] >= requirements["fat_min"] - TOLERANCE)
+            & (results["glucose_infusion_rate"] >= requirements["gir_min"] - TOLERANCE)
+            & (results["glucose_infusion_rate"] <= requirements["gir_max"] + TOLERANCE)
+        )
+
+        solution = {
+            "tpn_type": self.tpn_type,
+            "lipid_type": self.lipid_type,
+            "glucose_concentration": glucose_concentration,
+            "enteral_volume": enteral,
+            "tpn_volume": tpn_volume,
+            "lipid_volume": lipid_volume,
+            "glucose_volume": glucose_volume,
+            "total_fluid": total_fluid,
+            "feasible": feasible,
+        }
+        solution.update(results)
+        solution.update(requirements)
+        return solution
+
+    def _contributions(self, count, **columns):
+        """
+        Evaluate nutrition values of count plans that only use the given sources.
+
+        Args:
+            count: Number of plans
+            **columns: Arguments of calculate_nutrition_columns for the sources in use
+
+        Returns:
+            Dictionary returned by calculate_nutrition_columns
+        """
+        unused = [None] * count
+        arguments = {
+            "tpn_type": unused, "tpn_volume": np.zeros(count),
+            "lipid_type": unused, "lipid_volume": np.zeros(count),
+            "glucose_concentration": unused, "glucose_volume": np.zeros(count),
+        }
+        arguments.update(columns)
+        return self.calculator.calculate_nutrition_columns(**arguments)
+
+    def evaluate_grid(self, patient, tpn_volumes, lipid_volumes, glucose_volumes, enteral_volume=0,
+                      enteral_feeding_type=None, bmf_concentration=0, feasible_limit=1000, pareto_limit=20):
+        """
+        Evaluate every combination of TPN, lipid and glucose volumes for one patient.
+
+        Each source is evaluated once per volume on its axis, and the grid totals
+        are sums of the broadcast axis contributions, added in the same order as
+        calculate_nutrition_columns so they equal the totals of a plan with those
+        volumes. Nothing is stored.
+
+        Combinations are scored by their distance from the target point of the
+        fluid, protein, fat and glucose infusion rate ranges, relative to the
+        width of each range. The Pareto-best combinations are taken from the
+        feasible ones, or from all combinations if none is feasible.
+
+        Args:
+            patient: Patient object
+            tpn_volumes: TPN volumes in ml/kg/day to try
+            lipid_volumes: Lipid volumes in ml/kg/day to try
+            glucose_volumes: Glucose volumes in ml/kg/day to try
+            enteral_volume: Enteral volume in ml/kg/day
+            enteral_feeding_type: Enteral feed type (e.g., "Breast milk")
+            bmf_concentration: Breast milk fortifier concentration in g/100ml
+            feasible_limit: Maximum number of feasible combinations to list
+            pareto_limit: Maximum number of Pareto-best combinations to return
+
+        Returns:
+            Dictionary with the solution types, reference_version, requirements,
+            combinations (grid size), feasible_count, feasible (volume lists of up
+            to feasible_limit feasible combinations) and pareto (one dictionary
+            per combination with its volumes, nutrition values and feasibility)
+        """
+        reference = self.calculator.reference_data
+        for source, name in (("tpn", self.tpn_type), ("lipid", self.lipid_type), ("glucose", self.glucose_concentration)):
+            if name not in reference.source_index[source]:
+                raise ValueError(f"Unknown {source} solution: {name}")
+
+        requirements = {name: float(values[0]) for name, values in self.requirement_columns([patient]).items()}
+        axes = [np.asarray(volumes, dtype=np.float64).reshape(-1)
+                for volumes in (tpn_volumes, lipid_volumes, glucose_volumes)]
+        tpn_axis, lipid_axis, glucose_axis = axes
+
+        tpn = self._contributions(len(tpn_axis), tpn_type=[self.tpn_type] * len(tpn_axis), tpn_volume=tpn_axis)
+        lipid = self._contributions(len(lipid_axis), lipid_type=[self.lipid_type] * len(lipid_axis),
+                                    lipid_volume=lipid_axis)
+        glucose = self._contributions(len(glucose_axis),
+                                      glucose_concentration=[self.glucose_concentration] * len(glucose_axis),
+                                      glucose_volume=glucose_axis)
+        enteral = self._contributions(1, enteral_feeding_type=[enteral_feeding_type],
+                                      enteral_volume=np.array([enteral_volume], dtype=np.float64),
+                                      bmf_concentration=[bmf_concentration])
+
+        def grid(tpn_values, lipid_values, glucose_values):
+            total = tpn_values[:, np.newaxis, np.newaxis] + lipid_values[np.newaxis, :, np.newaxis]
+            return (total + glucose_values[np.newaxis, np.newaxis, :]).reshape(-1)
+
+        values = {
+            field: grid(tpn[field], lipid[field], glucose[field]) + enteral[field][0]
+            for field in NUTRIENT_FIELDS
+        }
+        values["glucose_infusion_rate"] = grid(np.zeros(len(tpn_axis)), np.zeros(len(lipid_axis)),
+                                               glucose["glucose_infusion_rate"])
+        values["total_fluid"] = enteral_volume + grid(*axes)
+        volumes = [
+            np.broadcast_to(axis.reshape(shape), (len(tpn_axis), len(lipid_axis), len(glucose_axis))).reshape(-1)
+            for axis, shape in zip(axes, ((-1, 1, 1), (1, -1, 1), (1, 1, -1)))
+        ]
+
+        weight = TARGETS[self.target]
+        feasible = np.ones(len(volumes[0]), dtype=bool)
+        costs = []
+        for field, name in GRID_REQUIREMENTS:
+            minimum, maximum = requirements[f"{name}_min"], requirements[f"{name}_max"]
+            feasible &= (values[field] >= minimum - TOLERANCE) & (values[field] <= maximum + TOLERANCE)
+            target = minimum + weight * (maximum - minimum)
+            costs.append(np.abs(values[field] - target) / max(maximum - minimum, TOLERANCE))
+        costs = np.column_stack(costs)
+
+        candidates = np.flatnonzero(feasible)
+        if not len(candidates):
+            candidates = np.arange(len(feasible))
+        best = candidates[pareto_front(costs[candidates], pareto_limit)]
+        listed = np.flatnonzero(feasible)[:feasible_limit]
+
+        names = ("tpn_volume", "lipid_volume", "glucose_volume")
+        pareto = []
+        for i in best.tolist():
+            row = {name: float(axis[i]) for name, axis in zip(names, volumes)}
+            row.update({field: float(column[i]) for field, column in values.items()})
+            row["feasible"] = bool(feasible[i])
+            pareto.append(row)
+
+        return {
+            "tpn_type": self.tpn_type,
+            "lipid_type": self.lipid_type,
+            "glucose_concentration": self.glucose_concentration,
+            "enteral_volume": float(enteral_volume),
+            "reference_version": tpn["reference_version"],
+            "requirements": requirements,
+            "combinations": len(feasible),
+            "feasible_count": int(feasible.sum()),
+            "feasible": {name: axis[listed].tolist() for name, axis in zip(names, volumes)},
+            "pareto": pareto,
+        }
@@ -0,0 +1,247 @@
+"""
+NICU Fluid Management App - On-Demand Request Profiling
+"""
+
+import cProfile
+import fcntl
+import glob
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+
+# Files saved for each profile, besides its metadata
+PROFILE_KINDS = ("pstats", "collapsed")
+
+PROFILE_ID = re.compile(r"^\d{13}-\d+-[0-9a-f]{8}$")
+
+# Reasons a profiling request is refused; the request itself is still served
+FORBIDDEN = "forbidden"
+INVALID_TOKEN = "invalid_token"
+EXPIRED_TOKEN = "expired_token"
+RATE_LIMITED = "rate_limited"
+
+
+class ProfileStore:
+    """
+    Directory holding the most recent profiles of all processes, as a ring:
+    saving a profile removes the oldest ones beyond `keep`.
+    """
+    def __init__(self, directory, keep=20):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, profile_id, kind):
+        """Path of one file of a profile, or None if the ID or kind is not valid"""
+        if not PROFILE_ID.match(profile_id) or kind not in PROFILE_KINDS + ("json",):
+            return None
+        return os.path.join(self.directory, f"{profile_id}.{kind}")
+
+    def save(self, profile_id, stats, collapsed, metadata):
+        """
+        Write a profile and trim the ring.
+
+        Args:
+            profile_id: ID from new_profile_id
+            stats: pstats.Stats of the profile
+            collapsed: Dictionary of collapsed stack -> sample count
+            metadata: JSON-serializable description of the request
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stats.dump_stats(self.path(profile_id, "pstats"))
+        with open(self.path(profile_id, "collapsed"), "w") as f:
+            for stack, count in sorted(collapsed.items()):
+                f.write(f"{stack} {count}\n")
+        # The metadata file is written last, so listed profiles are complete
+        temporary_path = self.path(profile_id, "json") + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(dict(metadata, id=profile_id), f)
+        os.replace(temporary_path, self.path(profile_id, "json"))
+        self._trim()
+
+    def _trim(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json")))[:-self.keep]:
+            profile_id = os.path.basename(path)[:-len(".json")]
+            for kind in ("json",) + PROFILE_KINDS:
+                try:
+                    os.unlink(self.path(profile_id, kind))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json")), reverse=True):
+            try:
+                with open(path) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+
+def new_profile_id():
+    return f"{time.time_ns() // 1000000:013d}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts the
+    samples per stack, in the collapsed format read by flame graph tools.
+    """
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack = ";".join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+class RequestProfile:
+    """
+    A running profile of one request: a deterministic cProfile of the request
+    thread plus a stack sampler for the collapsed stacks.
+    """
+    def __init__(self, sample_interval):
+        self.id = new_profile_id()
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), sample_interval)
+
+    def start(self):
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and return the request duration in seconds."""
+        self.profile.disable()
+        self.sampler.stop()
+        return time.perf_counter() - self.started
+
+
+class RequestProfiler:
+    """
+    Decides whether a request is profiled and saves its profile.
+
+    A request is profiled only if the caller is allowed to (an admin) and
+    presents a token signed with the application's secret key for that
+    request path, which expires after token_max_age seconds. At most one
+    profile is started every min_interval seconds by all processes sharing
+    the store, and one at a time in each process.
+    """
+    def __init__(self, store, secret_key, authorize, min_interval=10.0, token_max_age=600, sample_interval=0.001):
+        """
+        Initialize the profiler.
+
+        Args:
+            store: ProfileStore the profiles are saved to
+            secret_key: Key the profiling tokens are signed with
+            authorize: Callable returning True if the current user may profile requests
+            min_interval: Seconds between the starts of two profiles, across processes
+            token_max_age: Seconds a profiling token stays valid
+            sample_interval: Seconds between stack samples
+        """
+        self.store = store
+        self.authorize = authorize
+        self.min_interval = min_interval
+        self.token_max_age = token_max_age
+        self.sample_interval = sample_interval
+        self._serializer = URLSafeTimedSerializer(secret_key, salt="nicu-request-profile")
+        self._running = threading.Lock()
+
+    def make_token(self, path):
+        """Sign a token allowing a request to path to be profiled."""
+        return self._serializer.dumps(path)
+
+    def start(self, token, path):
+        """
+        Start profiling the current request if the token and rate limit allow it.
+
+        Returns:
+            The started RequestProfile, or the reason (e.g. RATE_LIMITED) it was refused
+        """
+        if not self.authorize():
+            return FORBIDDEN
+        try:
+            signed_path = self._serializer.loads(token, max_age=self.token_max_age)
+        except SignatureExpired:
+            return EXPIRED_TOKEN
+        except BadSignature:
+            return INVALID_TOKEN
+        if signed_path != path:
+            return INVALID_TOKEN
+        if not self._running.acquire(blocking=False):
+            return RATE_LIMITED
+        try:
+            if not self._claim_slot():
+                self._running.release()
+                return RATE_LIMITED
+            profile = RequestProfile(self.sample_interval)
+            profile.start()
+        except (OSError, ValueError):
+            # ValueError: another profiler is active in this process
+            self._running.release()
+            return RATE_LIMITED
+        return profile
+
+    def _claim_slot(self):
+        """Record the start of a profile unless one started less than min_interval ago, in any process."""
+        os.makedirs(self.store.directory, exist_ok=True)
+        with open(os.path.join(self.store.directory, "last_profile"), "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                last = float(f.read() or 0)
+            except ValueError:
+                last = 0.0
+            now = time.time()
+            if now - last < self.min_interval:
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(str(now))
+            return True
+
+    def finish(self, profile, metadata):
+        """Stop a profile started by start and save it to the store."""
+        try:
+            duration = profile.stop()
+            self.store.save(
+                profile.id, pstats.Stats(profile.profile), profile.sampler.stacks,
+                dict(metadata, duration_ms=round(duration * 1000, 3), samples=profile.sampler.samples,
+                     created=time.time(), pid=os.getpid())
+            )
+        finally:
+            self._running.release()
@@ -0,0 +1,370 @@
+"""
+NICU Fluid Management App - Reference Data
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Calculated NutritionPlan attributes, in composition-matrix column order
+NUTRIENT_FIELDS = (
+    "total_energy",
+    "total_protein",
+    "total_carbohydrate",
+    "total_fat",
+    "total_sodium",
+    "total_potassium",
+    "total_calcium",
+    "total_phosphate",
+    "total_magnesium",
+)
+
+# Reference data key for each calculated field
+NUTRIENT_COMPOSITION_KEYS = (
+    "energy_kcal_per_ml",
+    "protein_g_per_ml",
+    "carbohydrate_g_per_ml",
+    "fat_g_per_ml",
+    "sodium_mmol_per_ml",
+    "potassium_mmol_per_ml",
+    "calcium_mmol_per_ml",
+    "phosphate_mmol_per_ml",
+    "magnesium_mmol_per_ml",
+)
+
+# Fortifier key for each calculated field, per gram of fortifier
+FORTIFIER_COMPOSITION_KEYS = tuple(key.replace("_per_ml", "_per_g") for key in NUTRIENT_COMPOSITION_KEYS)
+
+# Fortifier used for NutritionPlan.bmf_concentration
+BMF_FORTIFIER = "BMF"
+
+
+class ReferenceData:
+    """
+    Compiled snapshot of the reference data files.
+    Replaces nested string lookups with flat, integer-indexed tables.
+    A snapshot is never modified after it is built, so a calculation that holds
+    on to one keeps seeing consistent data while a newer version is loaded.
+    """
+    def __init__(self, tpn_compositions, solution_compositions, fluid_requirements, version,
+                 enteral_compositions=None):
+        """
+        Compile the reference data.
+
+        Args:
+            tpn_compositions: Parsed contents of tpn_compositions.json
+            solution_compositions: Parsed contents of solution_compositions.json
+            fluid_requirements: Parsed contents of fluid_requirements.json
+            version: Content hash identifying this version of the reference data
+            enteral_compositions: Parsed contents of enteral_compositions.json, or None
+                if enteral feeds do not contribute nutrients
+        """
+        self.version = version
+
+        # Parsed source data, kept for the reference data API endpoints
+        self.tpn_compositions = tpn_compositions
+        self.solution_compositions = solution_compositions
+        self.fluid_requirements = fluid_requirements
+        self.enteral_compositions = enteral_compositions or {"feeds": {}, "fortifiers": {}}
+
+        self._compile_fluid_requirements(fluid_requirements["fluid_requirements"])
+        self._compile_compositions()
+        self._compile_enteral_table()
+
+    def _compile_fluid_requirements(self, requirements):
+        """
+        Flatten fluid requirements into a (weight category x age category) table.
+        """
+        self.weight_categories = tuple(name for name in requirements if name != "phototherapy_adjustment")
+        self.age_categories = tuple(dict.fromkeys(
+            age_category
+            for weight_category in self.weight_categories
+            for age_category in requirements[weight_category]
+        ))
+        self.weight_category_index = {name: i for i, name in enumerate(self.weight_categories)}
+        self.age_category_index = {name: i for i, name in enumerate(self.age_categories)}
+
+        # (min, max) per flat index weight * len(age_categories) + age, None if not defined
+        ranges = []
+        for weight_category in self.weight_categories:
+            for age_category in self.age_categories:
+                base_req = requirements[weight_category].get(age_category)
+                ranges.append((base_req["min"], base_req["max"]) if base_req else None)
+        self.fluid_ranges = tuple(ranges)
+
+        self.phototherapy_adjustments = {
+            name: (adjustment["min"], adjustment["max"])
+            for name, adjustment in requirements.get("phototherapy_adjustment", {}).items()
+        }
+
+    def _compile_compositions(self):
+        """
+        Build per-solution nutrient terms and the composition matrix.
+
+        Every TPN type, lipid solution and glucose solution becomes one matrix row
+        with the per-ml amount of each nutrient in NUTRIENT_FIELDS. A final all-zero
+        row stands in for volumes that do not contribute (zero volume or unknown type).
+        """
+        sources = (
+            ("tpn", self.tpn_compositions),
+            ("lipid", self.solution_compositions["lipid_solutions"]),
+            ("glucose", self.solution_compositions["glucose_solutions"]),
+        )
+
+        rows = []
+        self.source_index = {}
+        self.source_terms = {}
+        for source, compositions in sources:
+            index = {}
+            terms = {}
+            for name, composition in compositions.items():
+                index[name] = len(rows)
+                rows.append([composition.get(key, 0.0) for key in NUTRIENT_COMPOSITION_KEYS])
+                # (column, amount per ml) for the nutrients this solution provides
+                terms[name] = tuple(
+                    (column, composition[key])
+                    for column, key in enumerate(NUTRIENT_COMPOSITION_KEYS)
+                    if key in composition
+                )
+            self.source_index[source] = index
+            self.source_terms[source] = terms
+
+        self.zero_row = len(rows)
+        rows.append([0.0] * len(NUTRIENT_COMPOSITION_KEYS))
+        self.composition_matrix = np.array(rows, dtype=np.float64)
+
+        # Glucose in mg/ml per glucose solution, for the infusion rate
+        self.glucose_mg_per_ml = {
+            name: float(name.strip('%')) * 10  # Convert % to mg/ml
+            for name in self.source_index["glucose"]
+        }
+        self.glucose_mg_per_ml_by_row = np.zeros(len(rows), dtype=np.float64)
+        for name, row in self.source_index["glucose"].items():
+            self.glucose_mg_per_ml_by_row[row] = self.glucose_mg_per_ml[name]
+
+    def _compile_enteral_table(self):
+        """
+        Precompute the per-ml composition of every fortified feed.
+
+        The table has one row per (feed type, fortifier, concentration) on the
+        concentration grid of enteral_compositions.json, plus "unfortified" rows
+        for each feed type and a final all-zero row for plans without a known
+        feed. A plan's enteral totals are then one row lookup and one scale.
+        """
+        feeds = self.enteral_compositions["feeds"]
+        fortifiers = self.enteral_compositions["fortifiers"]
+        grid = self.enteral_compositions.get("fortifier_concentrations_g_per_100ml", {"max": 0.0, "step": 1.0})
+        self.fortifier_step = grid["step"]
+        steps = int(round(grid["max"] / grid["step"])) + 1
+        self.fortifier_concentrations = np.round(np.arange(steps) * grid["step"], 6)
+
+        feed_rows = np.array(
+            [[composition.get(key, 0.0) for key in NUTRIENT_COMPOSITION_KEYS] for composition in feeds.values()],
+            dtype=np.float64
+        ).reshape(len(feeds), len(NUTRIENT_COMPOSITION_KEYS))
+        fortifier_rows = np.array(
+            [[composition.get(key, 0.0) for key in FORTIFIER_COMPOSITION_KEYS] for composition in fortifiers.values()],
+            dtype=np.float64
+        ).reshape(len(fortifiers), len(FORTIFIER_COMPOSITION_KEYS))
+
+        # (feed, fortifier, concentration, nutrient): feed + fortifier per g * g per ml
+        table = (
+            feed_rows[:, np.newaxis, np.newaxis, :]
+            + fortifier_rows[np.newaxis, :, np.newaxis, :]
+            * (self.fortifier_concentrations / 100)[np.newaxis, np.newaxis, :, np.newaxis]
+        )
+        self.feed_index = {name: i for i, name in enumerate(feeds)}
+        self.fortifier_index = {name: i for i, name in enumerate(fortifiers)}
+        self.enteral_feed_rows = feed_rows
+        self.enteral_fortifier_rows = fortifier_rows
+
+        rows = [table.reshape(-1, len(NUTRIENT_COMPOSITION_KEYS)), feed_rows, np.zeros((1, len(NUTRIENT_COMPOSITION_KEYS)))]
+        self.enteral_table = np.concatenate(rows)
+        self.enteral_unfortified_row = len(feeds) * len(fortifiers) * steps
+        self.enteral_zero_row = len(self.enteral_table) - 1
+        # Per-ml terms of each row as Python floats, for the scalar calculation
+        self.enteral_terms = tuple(tuple(row) for row in self.enteral_table.tolist())
+
+    def enteral_row(self, feed_type, fortifier=None, concentration=0):
+        """
+        Find the enteral table row for a feed.
+
+        Args:
+            feed_type: Enteral feed type (e.g., "Breast milk")
+            fortifier: Fortifier name, or None
+            concentration: Fortifier concentration in g/100ml
+
+        Returns:
+            Row index into enteral_table, enteral_zero_row for an unknown feed type,
+            or None if the fortifier is unknown or the concentration is not on the grid
+        """
+        feed = self.feed_index.get(feed_type)
+        if feed is None:
+            return self.enteral_zero_row
+        if not concentration:
+            return self.enteral_unfortified_row + feed
+
+        fortifier_index = self.fortifier_index.get(fortifier)
+        step = int(round(concentration / self.fortifier_step))
+        if fortifier_index is None or not 0 <= step < len(self.fortifier_concentrations) or \
+                abs(self.fortifier_concentrations[step] - concentration) > 1e-9:
+            return None
+        steps = len(self.fortifier_concentrations)
+        return (feed * len(self.fortifier_index) + fortifier_index) * steps + step
+
+    def enteral_composition(self, feed_type, fortifier=None, concentration=0):
+        """
+        Get the per-ml composition of a fortified feed.
+
+        Uses the precomputed table when the concentration is on its grid and
+        computes the mix otherwise.
+
+        Args:
+            feed_type: Enteral feed type (e.g., "Breast milk")
+            fortifier: Fortifier name, or None
+            concentration: Fortifier concentration in g/100ml
+
+        Returns:
+            Tuple with the amount per ml of each nutrient in NUTRIENT_FIELDS
+        """
+        row = self.enteral_row(feed_type, fortifier, concentration)
+        if row is not None:
+            return self.enteral_terms[row]
+
+        fortifier_index = self.fortifier_index.get(fortifier)
+        if fortifier_index is None:
+            raise ValueError(f"Unknown fortifier: {fortifier}")
+        feed = self.enteral_feed_rows[self.feed_index[feed_type]]
+        return tuple((feed + self.enteral_fortifier_rows[fortifier_index] * (concentration / 100)).tolist())
+
+    def get_fluid_range(self, weight_category, age_category):
+        """
+        Look up the base fluid requirement for a weight and age category.
+
+        Args:
+            weight_category: Weight category name
+            age_category: Postnatal age category name
+
+        Returns:
+            Tuple of (min, max) in ml/kg/day, or None if not defined
+        """
+        weight_index = self.weight_category_index.get(weight_category)
+        age_index = self.age_category_index.get(age_category)
+        if weight_index is None or age_index is None:
+            return None
+        return self.fluid_ranges[weight_index * len(self.age_categories) + age_index]
+
+
+class ReferenceDataSource:
+    """
+    Loads the reference data files and keeps the compiled snapshot up to date.
+    Changed files are detected by their mtime, inode and size, and are
+    recompiled without blocking callers that are still using the previous version.
+    """
+    def __init__(self, tpn_compositions_file, solution_compositions_file, fluid_requirements_file,
+                 check_interval=1.0, enteral_compositions_file=None):
+        """
+        Load and compile the reference data.
+
+        Args:
+            tpn_compositions_file: Path to JSON file with TPN composition data
+            solution_compositions_file: Path to JSON file with solution composition data
+            fluid_requirements_file: Path to JSON file with fluid requirement data
+            check_interval: Minimum number of seconds between checks for changed files
+            enteral_compositions_file: Path to JSON file with enteral feed and fortifier
+                compositions (optional; without it enteral feeds contribute no nutrients)
+        """
+        self.files = (tpn_compositions_file, solution_compositions_file, fluid_requirements_file)
+        if enteral_compositions_file is not None:
+            self.files += (enteral_compositions_file,)
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._last_check = time.monotonic()
+
+        self._signature = self._stat_files()
+        self._snapshot = self._load()
+
+    def current(self):
+        """
+        Get the current reference data, reloading it if the files have changed.
+
+        Returns:
+            ReferenceData snapshot
+        """
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.reload_if_changed()
+        return self._snapshot
+
+    def reload_if_changed(self):
+        """
+        Recompile the reference data if any of the files changed on disk.
+
+        If another thread is already reloading, or the new files cannot be
+        read or loaded (e.g. a file briefly missing during an atomic rename,
+        or a partially written file), the current snapshot is kept.
+
+        Returns:
+            True if a new version was loaded, False otherwise
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            try:
+                signature = self._stat_files()
+            except OSError as e:
+                logger.warning(f"Keeping reference data {self._snapshot.version}, cannot read files: {e}")
+                return False
+            if signature == self._signature:
+                return False
+
+            try:
+                snapshot = self._load()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Keeping reference data {self._snapshot.version}, reload failed: {e}")
+                return False
+
+            self._signature = signature
+            if snapshot.version == self._snapshot.version:
+                return False
+
+            logger.info(f"Reference data reloaded: {self._snapshot.version} -> {snapshot.version}")
+            self._snapshot = snapshot
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def _stat_files(self):
+        """
+        Get the (mtime, inode, size) signature of the reference data files.
+        """
+        signature = []
+        for path in self.files:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_ino, stat.st_size))
+        return tuple(signature)
+
+    def _load(self):
+        """
+        Read, hash and compile the reference data files.
+        """
+        content_hash = hashlib.sha256()
+        parsed = []
+        for path in self.files:
+            with open(path, 'rb') as f:
+                content = f.read()
+            content_hash.update(os.path.basename(path).encode())
+            content_hash.update(content)
+            parsed.append(json.loads(content))
+
+        return ReferenceData(*parsed[:3], version=content_hash.hexdigest()[:16],
+                             enteral_compositions=parsed[3] if len(parsed) > 3 else None)
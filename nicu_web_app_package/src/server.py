@@ -1,6 +1,8 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 import os
 import json
+import glob
+import time
 from datetime import date
 
 app = Flask(__name__)
@@ -10,24 +12,91 @@ app.secret_key = 'supergeheim123'
 data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
 USERS_FILE = os.path.join(data_dir, 'users.json')
 
-# Helpers voor gebruikersbeheer
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+# Gebruikersbeheer: index in het geheugen, veilig bij gelijktijdige workers
+from user_store import UserStore
+user_store = UserStore(USERS_FILE)
 
-def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+# Patiënten en voedingsplannen als JSON-bestanden, zodat elke worker ze kan laden.
+# Buiten data/ (alleen referentiedata) en niet in git; RECORDS_DIR kan dit overschrijven.
+RECORDS_DIR = os.environ.get(
+    'RECORDS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'records')
+)
+
+# Bewaartermijn: records die RECORDS_RETENTION_DAYS dagen niet zijn gewijzigd worden verwijderd
+# (0 = nooit). Elke worker ruimt hooguit eens per RECORDS_PURGE_SECONDS op, bij het opslaan.
+RECORDS_RETENTION_DAYS = float(os.environ.get('RECORDS_RETENTION_DAYS', 30))
+RECORDS_PURGE_SECONDS = float(os.environ.get('RECORDS_PURGE_SECONDS', 3600))
+last_purge = 0.0
+
+def record_path(kind, record_id):
+    # Alleen gewone bestandsnamen toestaan, geen paden
+    if not record_id or record_id in ('.', '..') or os.path.basename(record_id) != record_id:
+        raise ValueError(f"Invalid ID: {record_id}")
+    return os.path.join(RECORDS_DIR, kind, f"{record_id}.json")
+
+def save_record(kind, record_id, record):
+    path = record_path(kind, record_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+    purge_records_if_due()
+
+def purge_records_if_due():
+    global last_purge
+    now = time.time()
+    if RECORDS_RETENTION_DAYS <= 0 or now - last_purge < RECORDS_PURGE_SECONDS:
+        return
+    last_purge = now
+    purge_records(now - RECORDS_RETENTION_DAYS * 86400)
+
+def purge_records(cutoff):
+    # Verwijder records (en achtergebleven tijdelijke bestanden) die voor cutoff voor het laatst zijn geschreven
+    removed = 0
+    for path in glob.glob(os.path.join(RECORDS_DIR, '*', '*.json*')):
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def load_record(kind, record_id):
+    try:
+        with open(record_path(kind, record_id), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
 
 # App modules laden
 from models import Patient, NutritionPlan
 from calculator import NutritionCalculator, RecommendationEngine
 from app import NICUFluidApp
+from store import BoundedStore
+from http_cache import ReferenceResponseCache
+
+def load_patient(patient_id):
+    record = load_record('patients', patient_id)
+    return Patient(**record) if record else None
+
+def load_nutrition_plan(plan_id):
+    record = load_record('plans', plan_id)
+    if not record:
+        return None
+    record['date'] = date.fromisoformat(record['date'])
+    return NutritionPlan(**record)
 
-# NICU app initialiseren
-nicu_app = NICUFluidApp(data_dir)
+# NICU app initialiseren, met begrensde opslag in het geheugen
+nicu_app = NICUFluidApp(
+    data_dir,
+    patient_store=BoundedStore(maxsize=1000, ttl=3600, loader=load_patient),
+    nutrition_plan_store=BoundedStore(maxsize=5000, ttl=3600, loader=load_nutrition_plan)
+)
+
+# Referentiedata voorgeserialiseerd en gecomprimeerd in het geheugen
+reference_responses = ReferenceResponseCache(nicu_app.calculator)
 
 # ROUTES
 @app.route('/')
@@ -46,15 +115,10 @@ def register():
             flash("Passwords do not match")
             return render_template('register.html')
 
-        users = load_users()
-
-        if username in users:
+        if not user_store.add(username, password):
             flash("Username already exists")
             return render_template('register.html')
 
-        users[username] = password
-        save_users(users)
-
         flash("Account successfully created!")
         return redirect(url_for('login'))
 
@@ -66,9 +130,9 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        users = load_users()
+        stored_password = user_store.get(username)
 
-        if username in users and users[username] == password:
+        if stored_password is not None and stored_password == password:
             session['username'] = username
             flash("Login successful!")
             return redirect(url_for('dashboard'))
@@ -118,27 +182,35 @@ def app_page():
 @app.route('/api/data/tpn_compositions', methods=['GET'])
 def get_tpn_compositions():
     try:
-        with open(os.path.join(data_dir, 'tpn_compositions.json'), 'r') as f:
-            tpn_compositions = json.load(f)
-        return jsonify(tpn_compositions)
+        return reference_responses.response('tpn_compositions')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/data/solution_compositions', methods=['GET'])
 def get_solution_compositions():
     try:
-        with open(os.path.join(data_dir, 'solution_compositions.json'), 'r') as f:
-            solution_compositions = json.load(f)
-        return jsonify(solution_compositions)
+        return reference_responses.response('solution_compositions')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/data/fluid_requirements', methods=['GET'])
 def get_fluid_requirements():
     try:
-        with open(os.path.join(data_dir, 'fluid_requirements.json'), 'r') as f:
-            fluid_requirements = json.load(f)
-        return jsonify(fluid_requirements)
+        return reference_responses.response('fluid_requirements')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/data/enteral_compositions', methods=['GET'])
+def get_enteral_compositions():
+    try:
+        return reference_responses.response('enteral_compositions')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/data/bundle', methods=['GET'])
+def get_reference_bundle():
+    try:
+        return reference_responses.response('bundle')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -146,15 +218,17 @@ def get_fluid_requirements():
 def create_patient():
     try:
         data = request.json
-        patient = nicu_app.create_patient(
-            patient_id=data['patientId'],
-            gestational_age_at_birth=float(data['gestationalAge']),
-            birth_weight=int(data['birthWeight']),
-            current_weight=int(data.get('currentWeight', data['birthWeight'])),
-            postnatal_age=int(data['postnatalAge']),
-            phototherapy=data.get('phototherapy', None),
-            clinical_condition=data.get('clinicalCondition', 'Normal')
-        )
+        fields = {
+            'patient_id': data['patientId'],
+            'gestational_age_at_birth': float(data['gestationalAge']),
+            'birth_weight': int(data['birthWeight']),
+            'current_weight': int(data.get('currentWeight', data['birthWeight'])),
+            'postnatal_age': int(data['postnatalAge']),
+            'phototherapy': data.get('phototherapy', None),
+            'clinical_condition': data.get('clinicalCondition', 'Normal')
+        }
+        patient = nicu_app.create_patient(**fields)
+        save_record('patients', patient.patient_id, fields)
         fluid_req = nicu_app.calculate_fluid_requirements(data['patientId'])
         return jsonify({
             "success": True,
@@ -169,44 +243,31 @@ def create_nutrition_plan():
     try:
         data = request.json
         plan_id = f"NP-{data['patientId']}-{date.today().strftime('%Y%m%d')}"
-        nutrition_plan = nicu_app.create_nutrition_plan(
-            plan_id=plan_id,
-            patient_id=data['patientId'],
-            date=date.today(),
-            total_fluid_target=float(data.get('totalFluidTarget', 0)),
-            enteral_volume=float(data.get('enteralVolume', 0)),
-            tpn_type=data.get('tpnType', 'NICU-mix'),
-            tpn_volume=float(data.get('tpnVolume', 0)),
-            lipid_type=data.get('lipidType', 'Intralipid_20%'),
-            lipid_volume=float(data.get('lipidVolume', 0)),
-            glucose_concentration=data.get('glucoseConcentration', '10%'),
-            glucose_volume=float(data.get('glucoseVolume', 0)),
-            enteral_feeding_type=data.get('enteralFeedingType', None),
-            enteral_feeding_frequency=int(data.get('enteralFeedingFrequency', 0)),
-            bmf_concentration=float(data.get('bmfConcentration', 0))
-        )
-        nicu_app.calculate_nutrition_values(plan_id)
-        recommendations = nicu_app.generate_recommendations(plan_id)
-        feeding_schedule = nicu_app.get_feeding_schedule(plan_id)
+        fields = {
+            'plan_id': plan_id,
+            'patient_id': data['patientId'],
+            'date': date.today().isoformat(),
+            'total_fluid_target': float(data.get('totalFluidTarget', 0)),
+            'enteral_volume': float(data.get('enteralVolume', 0)),
+            'tpn_type': data.get('tpnType', 'NICU-mix'),
+            'tpn_volume': float(data.get('tpnVolume', 0)),
+            'lipid_type': data.get('lipidType', 'Intralipid_20%'),
+            'lipid_volume': float(data.get('lipidVolume', 0)),
+            'glucose_concentration': data.get('glucoseConcentration', '10%'),
+            'glucose_volume': float(data.get('glucoseVolume', 0)),
+            'enteral_feeding_type': data.get('enteralFeedingType', None),
+            'enteral_feeding_frequency': int(data.get('enteralFeedingFrequency', 0)),
+            'bmf_concentration': float(data.get('bmfConcentration', 0))
+        }
+        nicu_app.create_nutrition_plan(**dict(fields, date=date.today()))
+        save_record('plans', plan_id, fields)
+        evaluation = nicu_app.evaluate_plan(plan_id).to_dict()
         response = {
             "success": True,
             "plan_id": plan_id,
-            "calculated_values": {
-                "total_energy": nutrition_plan.total_energy,
-                "total_protein": nutrition_plan.total_protein,
-                "total_carbohydrate": nutrition_plan.total_carbohydrate,
-                "total_fat": nutrition_plan.total_fat,
-                "total_sodium": nutrition_plan.total_sodium,
-                "total_potassium": nutrition_plan.total_potassium,
-                "total_calcium": nutrition_plan.total_calcium,
-                "total_phosphate": nutrition_plan.total_phosphate,
-                "total_magnesium": nutrition_plan.total_magnesium,
-                "glucose_infusion_rate": nutrition_plan.glucose_infusion_rate,
-                "total_parenteral_volume": nutrition_plan.calculate_parenteral_volume(),
-                "total_fluid": nutrition_plan.calculate_total_fluid()
-            },
-            "recommendations": recommendations,
-            "feeding_schedule": feeding_schedule
+            "calculated_values": evaluation["calculated_values"],
+            "recommendations": evaluation["recommendations"],
+            "feeding_schedule": evaluation["feeding_schedule"]
         }
         return jsonify(response)
     except Exception as e:
@@ -0,0 +1,150 @@
+"""
+NICU Fluid Management App - Bounded Object Store
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# Marker for missing values, so None can be passed as a default
+_MISSING = object()
+
+
+class BoundedStore:
+    """
+    Thread-safe key/value store with a size cap, LRU eviction and an optional time-to-live.
+    With a loader, keys that are missing (never seen, evicted or expired) are read
+    through from persistent storage, so every worker can serve every record.
+    """
+    def __init__(self, maxsize=10000, ttl=None, loader=None):
+        """
+        Initialize the store.
+
+        Args:
+            maxsize: Maximum number of entries kept in memory
+            ttl: Seconds an entry stays valid after it was stored, or None to keep it until evicted
+            loader: Function taking a key and returning the value, or None if it does not exist
+        """
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Get a value, loading it on a miss.
+
+        Args:
+            key: Key to look up
+            default: Value to return if the key does not exist
+
+        Returns:
+            Stored value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+
+        if self.loader is None:
+            return default
+
+        # Load outside the lock so a slow lookup does not block other keys
+        value = self.loader(key)
+        if value is None:
+            return default
+
+        with self._lock:
+            self.loads += 1
+            # Keep a value stored by another thread while this one was loading
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            self._insert(key, value)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._insert(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from memory. Persistent storage is not affected.
+
+        Args:
+            key: Key to remove
+            default: Value to return if the key is not in memory
+
+        Returns:
+            Removed value, or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Remove all values from memory.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get store statistics.
+
+        Returns:
+            Dictionary with size, maxsize, hits, misses, loads and evictions
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+    def _insert(self, key, value):
+        """
+        Add an entry and evict the least recently used entries over the size cap.
+        Must be called with the lock held.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, expires_at)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
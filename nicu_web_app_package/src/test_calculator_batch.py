@@ -0,0 +1,91 @@
+"""
+NICU Fluid Management App - Batch Calculation Tests
+"""
+
+from models import Patient, NutritionPlan
+from calculator import NutritionCalculator, NUTRIENT_FIELDS
+import os
+import random
+import pytest
+from datetime import date
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def make_calculator():
+    return NutritionCalculator(
+        os.path.join(DATA_DIR, 'tpn_compositions.json'),
+        os.path.join(DATA_DIR, 'solution_compositions.json'),
+        os.path.join(DATA_DIR, 'fluid_requirements.json'),
+        enteral_compositions_file=os.path.join(DATA_DIR, 'enteral_compositions.json')
+    )
+
+
+def make_random_plans(count, seed=7):
+    rng = random.Random(seed)
+    tpn_types = ["NICU-mix", "Samenstelling_B", "Unknown"]
+    lipid_types = ["Intralipid_20%", "SMOF_20%", None]
+    glucose_concentrations = ["5%", "10%", "12.5%", "15%", "17.5%", "20%", "25%", "30%"]
+    feed_types = ["Breast milk", "Donor milk", "Formula", "Unknown", None]
+    bmf_concentrations = [0, None, 1, 4, 5, 1.23, 7]
+    volumes = [0, 0, -5, 0.1, 1e-9, 150]
+    plans = []
+    for i in range(count):
+        plans.append(NutritionPlan(
+            plan_id=f"NP{i}",
+            patient_id="P001",
+            date=date.today(),
+            tpn_type=rng.choice(tpn_types),
+            tpn_volume=rng.choice(volumes + [rng.uniform(0, 120)]),
+            lipid_type=rng.choice(lipid_types),
+            lipid_volume=rng.choice(volumes + [rng.uniform(0, 40)]),
+            glucose_concentration=rng.choice(glucose_concentrations),
+            glucose_volume=rng.choice(volumes + [rng.uniform(0, 100)]),
+            enteral_volume=rng.choice(volumes + [rng.uniform(0, 160)]),
+            enteral_feeding_type=rng.choice(feed_types),
+            bmf_concentration=rng.choice(bmf_concentrations)
+        ))
+    return plans
+
+
+def test_batch_matches_scalar_exactly():
+    """
+    The batch path must reproduce the scalar path bit for bit.
+    """
+    calculator = make_calculator()
+    patient = Patient("P001", 28, 950)
+    plans = make_random_plans(5000)
+    
+    results = calculator.calculate_nutrition_values_batch(plans)
+    
+    for i, plan in enumerate(plans):
+        calculator.calculate_nutrition_values(plan, patient)
+        for field in NUTRIENT_FIELDS + ("glucose_infusion_rate",):
+            assert results[field][i] == getattr(plan, field), (field, i)
+        assert plan.reference_version == results["reference_version"]
+
+
+def test_batch_empty():
+    """
+    An empty batch returns empty result arrays.
+    """
+    results = make_calculator().calculate_nutrition_values_batch([])
+    assert all(len(results[field]) == 0 for field in NUTRIENT_FIELDS + ("glucose_infusion_rate",))
+
+
+def test_fortified_breast_milk_contribution():
+    """
+    Enteral feeds add their fortified composition to the totals.
+    """
+    calculator = make_calculator()
+    patient = Patient("P001", 28, 950)
+    plan = NutritionPlan("NP001", "P001", date.today(), enteral_volume=150,
+                         enteral_feeding_type="Breast milk", bmf_concentration=4)
+    
+    calculator.calculate_nutrition_values(plan, patient)
+    
+    assert plan.total_protein == pytest.approx((0.012 + 0.325 * 0.04) * 150)
+    assert plan.total_energy == pytest.approx((0.67 + 4.25 * 0.04) * 150)
+    assert plan.total_fat == pytest.approx((0.034 + 0.175 * 0.04) * 150)
+    assert plan.glucose_infusion_rate == 0
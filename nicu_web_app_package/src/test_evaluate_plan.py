@@ -0,0 +1,161 @@
+"""
+NICU Fluid Management App - Plan Evaluation Tests
+"""
+
+from models import NutritionPlan, PlanEvaluation
+from calculator import NutritionCalculator, RecommendationEngine
+from app import NICUFluidApp
+import dataclasses
+import json
+import os
+from contextlib import ExitStack
+from datetime import date
+from unittest import mock
+
+import pytest
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def make_app():
+    app = NICUFluidApp(DATA_DIR)
+    app.create_patient("P001", 28, 950, current_weight=950, postnatal_age=3,
+                       phototherapy="Single", clinical_condition="Sepsis")
+    app.create_nutrition_plan(
+        "NP001", "P001", date.today(),
+        total_fluid_target=150, enteral_volume=30,
+        tpn_type="NICU-mix", tpn_volume=80,
+        lipid_type="Intralipid_20%", lipid_volume=20,
+        glucose_concentration="10%", glucose_volume=20,
+        enteral_feeding_type="Breast milk", enteral_feeding_frequency=12
+    )
+    return app
+
+
+def count_calls(stack, owner, name):
+    return stack.enter_context(mock.patch.object(owner, name, autospec=True, side_effect=getattr(owner, name)))
+
+
+def test_each_step_runs_exactly_once():
+    """
+    evaluate_plan runs every calculation step exactly once.
+    """
+    app = make_app()
+    with ExitStack() as stack:
+        steps = {
+            name: count_calls(stack, owner, name)
+            for owner, name in [
+                (NutritionCalculator, "calculate_nutrition_values"),
+                (NutritionCalculator, "calculate_fluid_requirements"),
+                (NutritionCalculator, "get_macronutrient_requirements"),
+                (RecommendationEngine, "generate_recommendations"),
+                (NutritionPlan, "calculate_parenteral_volume"),
+                (NICUFluidApp, "_build_feeding_schedule"),
+            ]
+        }
+        app.evaluate_plan("NP001")
+    
+    for name, step in steps.items():
+        assert step.call_count == 1, name
+
+
+def test_evaluation_matches_individual_calls():
+    """
+    The single-pass result matches the individual NICUFluidApp methods.
+    """
+    app = make_app()
+    evaluation = app.evaluate_plan("NP001")
+    plan = app.calculate_nutrition_values("NP001")
+    
+    assert evaluation.calculated_values["total_protein"] == plan.total_protein
+    assert evaluation.calculated_values["glucose_infusion_rate"] == plan.glucose_infusion_rate
+    assert evaluation.calculated_values["total_fluid"] == plan.calculate_total_fluid()
+    assert evaluation.fluid_requirements == app.calculate_fluid_requirements("P001")
+    assert list(evaluation.recommendations) == app.generate_recommendations("NP001")
+    assert evaluation.to_dict()["feeding_schedule"] == app.get_feeding_schedule("NP001")
+    assert evaluation.reference_version == app.calculator.reference_version
+
+
+def test_evaluation_is_immutable():
+    """
+    The evaluation result cannot be modified.
+    """
+    evaluation = make_app().evaluate_plan("NP001")
+    assert isinstance(evaluation, PlanEvaluation)
+    
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        evaluation.recommendations = ()
+    with pytest.raises(TypeError):
+        evaluation.calculated_values["total_protein"] = 0
+    with pytest.raises(TypeError):
+        evaluation.feeding_schedule[0][1] = 0
+
+
+def test_export_evaluates_once(tmp_path):
+    """
+    Exporting a plan evaluates it once and writes the evaluation results.
+    """
+    app = make_app()
+    export_file = tmp_path / "plan.json"
+    
+    with mock.patch.object(NutritionCalculator, "calculate_nutrition_values", autospec=True,
+                           side_effect=NutritionCalculator.calculate_nutrition_values) as calculate:
+        assert app.export_nutrition_plan("NP001", str(export_file))
+    
+    assert calculate.call_count == 1
+    exported = json.loads(export_file.read_text())
+    assert exported["recommendations"] == list(app.evaluate_plan("NP001").recommendations)
+    assert len(exported["feeding_schedule"]) == 12
+
+
+def test_update_recalculates_only_changed_source():
+    """
+    Changing the lipid volume recalculates only the lipid contribution and
+    the recommendation checks whose values changed.
+    """
+    app = make_app()
+    app.evaluate_plan("NP001")
+    
+    with mock.patch.object(NutritionCalculator, "_source_contribution",
+                           side_effect=NutritionCalculator._source_contribution) as contribution:
+        evaluation, changes = app.update_nutrition_plan("NP001", lipid_volume=30, tpn_type="NICU-mix")
+    
+    assert [call.args[2] for call in contribution.call_args_list] == ["lipid"]
+    assert changes["fields"] == ["lipid_volume"]
+    assert changes["sources"] == ["lipid"]
+    assert set(changes["calculated_values"]) == {
+        "total_energy", "total_fat", "total_parenteral_volume", "total_fluid"
+    }
+    assert changes["recommendation_checks"] == ["fluid", "fat"]
+    
+    # The result equals evaluating the changed plan from scratch
+    fresh = make_app()
+    fresh.nutrition_plans["NP001"].lipid_volume = 30
+    expected = fresh.evaluate_plan("NP001")
+    assert evaluation.calculated_values == expected.calculated_values
+    assert evaluation.recommendations == expected.recommendations
+    
+    _, changes = app.update_nutrition_plan("NP001", lipid_volume=30)
+    assert changes == {"fields": [], "sources": [], "calculated_values": [], "recommendation_checks": []}
+    with pytest.raises(ValueError):
+        app.update_nutrition_plan("NP001", total_protein=4)
+
+
+def test_changed_inputs_drop_cached_contributions():
+    """
+    Setting a plan input drops the cached contribution of its source only.
+    """
+    plan = NutritionPlan("NP", "P001", date.today(), tpn_volume=80, glucose_volume=20)
+    calculator = make_app().calculator
+    calculator.calculate_nutrition_values(plan, None)
+    assert calculator.stale_sources(plan) == []
+    
+    plan.glucose_volume = 0
+    plan.enteral_feeding_frequency = 8
+    assert calculator.stale_sources(plan) == ["glucose"]
+    assert plan.pop_changed_fields() == ["glucose_volume", "enteral_feeding_frequency"]
+    assert plan.pop_changed_fields() == []
+    
+    calculator.calculate_nutrition_values(plan, None)
+    assert plan.glucose_infusion_rate == 0
@@ -0,0 +1,142 @@
+"""
+NICU Fluid Management App - Background Job Tests
+"""
+
+import os
+import signal
+import time
+
+from jobs import JobQueue, WorkerPool, QUEUED, SUCCEEDED, FAILED, CANCELLED
+
+
+def add(params, context):
+    for i in range(params["count"]):
+        context.progress(i + 1, params["count"], f"step {i + 1}")
+    return {"sum": params["a"] + params["b"], "user_id": context.user_id}
+
+
+def fail(params, context):
+    raise ValueError("bad input")
+
+
+def cancel_self(params, context):
+    context.queue.cancel(context.job_id)
+    context.progress(0.5)
+    return "not reached"
+
+
+def report_pid(params, context):
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def hang(params, context):
+    time.sleep(60)
+
+
+HANDLERS = {"add": add, "fail": fail, "cancel_self": cancel_self, "report_pid": report_pid, "hang": hang}
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_jobs_run_in_order_with_progress_and_outcome(tmp_path):
+    """Queued jobs run once each and record their result, error or cancellation."""
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    added = queue.submit("add", {"a": 2, "b": 3, "count": 4}, user_id=7)
+    failed = queue.submit("fail")
+    cancelled = queue.submit("cancel_self")
+    unknown = queue.submit("missing")
+    skipped = queue.submit("add", {"a": 0, "b": 0, "count": 1})
+
+    assert queue.get(added)["status"] == QUEUED
+    assert queue.cancel(skipped)
+    assert queue.get(skipped)["status"] == CANCELLED
+
+    assert [queue.run_next(HANDLERS) for _ in range(5)] == [added, failed, cancelled, unknown, None]
+
+    job = queue.get(added)
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"sum": 5, "user_id": 7}
+    assert job["progress"] == 1 and job["message"] == "step 4"
+    assert queue.get(failed)["status"] == FAILED and queue.get(failed)["error"] == "bad input"
+    assert queue.get(cancelled)["status"] == CANCELLED and queue.get(cancelled)["result"] is None
+    assert "Unknown job kind" in queue.get(unknown)["error"]
+
+    # Finished jobs can no longer be cancelled
+    assert not queue.cancel(added)
+    assert queue.get("no-such-job") is None
+
+
+def test_worker_pool_runs_each_job_once(tmp_path):
+    """Worker processes share the queue without running a job twice, and only one pool starts."""
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_ids = [queue.submit("report_pid") for _ in range(12)]
+
+    pool = WorkerPool(queue, HANDLERS, processes=3, poll_interval=0.05)
+    other = WorkerPool(queue, HANDLERS, processes=3, poll_interval=0.05)
+    assert pool.start()
+    try:
+        assert not other.start()
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            jobs = [queue.get(job_id) for job_id in job_ids]
+            if all(job["status"] == SUCCEEDED for job in jobs):
+                break
+            time.sleep(0.05)
+        assert all(job["status"] == SUCCEEDED for job in jobs)
+        assert all(job["result"] == job["worker_pid"] != os.getpid() for job in jobs)
+        worker_pids = [worker.pid for worker in pool._workers]
+    finally:
+        pool.stop()
+
+    # A job left running by a worker that is gone is marked as failed
+    stale = queue.submit("report_pid")
+    queue.claim()
+    with queue._connect() as connection:
+        connection.execute("UPDATE jobs SET worker_pid = ? WHERE job_id = ?", (worker_pids[0], stale))
+    assert queue.fail_interrupted() == 1
+    assert queue.get(stale)["status"] == FAILED
+
+
+def test_dead_workers_are_replaced(tmp_path):
+    """A worker that dies is replaced, and the job it was running is marked as failed."""
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    pool = WorkerPool(queue, HANDLERS, processes=1, poll_interval=0.05, check_interval=3600)
+    assert pool.start()
+    try:
+        hung = queue.submit("hang")
+        assert wait_for(lambda: queue.get(hung)["status"] == "running")
+        os.kill(queue.get(hung)["worker_pid"], signal.SIGKILL)
+        assert wait_for(lambda: not pool._workers[0].is_alive())
+
+        assert pool.check() == 1
+        assert queue.get(hung)["status"] == FAILED
+        after = queue.submit("report_pid")
+        assert wait_for(lambda: queue.get(after)["status"] == SUCCEEDED)
+        assert pool.check() == 0
+    finally:
+        pool.stop()
+
+
+def test_old_finished_jobs_are_purged(tmp_path):
+    """Jobs that finished before the retention period are deleted with their result files."""
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    old, recent, queued = (queue.submit("add", {"a": 1, "b": 1, "count": 1}) for _ in range(3))
+    queue.run_next(HANDLERS)
+    queue.run_next(HANDLERS)
+    os.makedirs(queue.result_dir)
+    for job_id in (old, recent):
+        open(os.path.join(queue.result_dir, f"{job_id}.csv"), "w").close()
+    with queue._connect() as connection:
+        connection.execute("UPDATE jobs SET finished_at = ? WHERE job_id = ?", (time.time() - 7200, old))
+
+    assert queue.purge_finished(3600) == 1
+    assert queue.get(old) is None
+    assert queue.get(recent)["status"] == SUCCEEDED and queue.get(queued)["status"] == QUEUED
+    assert os.listdir(queue.result_dir) == [f"{recent}.csv"]
@@ -0,0 +1,82 @@
+"""
+NICU Fluid Management App - Logging Pipeline Tests
+"""
+
+from log_pipeline import LogPipelineHandler, RequestLogSampler
+from metrics import MetricsRegistry
+from unittest import mock
+import json
+import logging
+import os
+import queue
+import tempfile
+import time
+
+
+def read_lines(log_file, count, timeout=5):
+    """Wait until the log file holds count lines and return them parsed."""
+    deadline = time.monotonic() + timeout
+    while True:
+        lines = []
+        if os.path.exists(log_file):
+            with open(log_file) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+        if len(lines) >= count or time.monotonic() > deadline:
+            return lines
+        time.sleep(0.02)
+
+
+def test_one_writer_collects_json_lines_of_all_handlers():
+    """Handlers of several workers share one writer process, which writes one JSON object per line."""
+    log_file = os.path.join(tempfile.mkdtemp(), 'nicu_app.log')
+    first = LogPipelineHandler(log_file)
+    second = LogPipelineHandler(log_file)
+    for name, handler in (('pipeline.first', first), ('pipeline.second', second)):
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+
+    logging.getLogger('pipeline.first').info("Request %s took %.1fs", "GET /", 0.5, extra={"status": 200})
+    try:
+        raise ValueError("bad input")
+    except ValueError:
+        logging.getLogger('pipeline.second').exception("Failed")
+
+    lines = sorted(read_lines(log_file, 2), key=lambda line: line["logger"])
+    assert [line["logger"] for line in lines] == ['pipeline.first', 'pipeline.second']
+    assert lines[0]["message"] == "Request GET / took 0.5s"
+    assert lines[0]["status"] == 200 and lines[0]["level"] == "INFO" and lines[0]["pid"] == os.getpid()
+    assert lines[1]["level"] == "ERROR" and "ValueError: bad input" in lines[1]["exception"]
+    assert not first.dropped and not second.dropped
+
+
+def test_full_queue_drops_and_counts_records():
+    """A full queue drops records instead of blocking, counts them and reports them once it drains."""
+    log_file = os.path.join(tempfile.mkdtemp(), 'nicu_app.log')
+    registry = MetricsRegistry(tempfile.mkdtemp())
+    handler = LogPipelineHandler(log_file, dropped_counter=registry.counter('dropped_total', 'Dropped', ('reason',)))
+
+    # Swap in a full queue the sender thread is not reading yet
+    sender_queue = handler.queue
+    handler.queue = queue.Queue(1)
+    handler.queue.put_nowait(logging.makeLogRecord({"msg": "queued"}))
+    start = time.perf_counter()
+    for _ in range(3):
+        handler.handle(logging.makeLogRecord({"msg": "dropped", "levelno": logging.INFO}))
+    assert time.perf_counter() - start < 0.1
+    assert handler.dropped == {"queue_full": 3}
+    assert registry.collect()["dropped_total"] == {("queue_full",): 3}
+
+    sender_queue.put(logging.makeLogRecord({"msg": "delivered"}))
+    lines = read_lines(log_file, 3)
+    assert [line["message"] for line in lines] == ["delivered", "Dropped 3 log records", "queued"]
+    assert lines[1]["dropped"] == {"queue_full": 3}
+
+
+def test_request_sampler_limits_lines_per_second():
+    sampler = RequestLogSampler(rate=2)
+    with mock.patch('log_pipeline.time.monotonic', return_value=100.2):
+        assert [sampler.sample() for _ in range(5)] == [0, 0, None, None, None]
+    with mock.patch('log_pipeline.time.monotonic', return_value=101.0):
+        assert sampler.sample() == 3
+        assert sampler.sample() == 0
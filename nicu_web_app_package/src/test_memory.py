@@ -0,0 +1,52 @@
+"""
+NICU Fluid Management App - Memory Diagnostics Tests
+"""
+
+from memory import MemoryMonitor
+import json
+import os
+import tempfile
+import tracemalloc
+
+
+class Leaky:
+    def __init__(self, size):
+        self.payload = bytearray(size)
+
+
+def test_report_counts_objects_and_diffs_snapshots():
+    """Reports count live instances, and snapshot diffs point at the allocation site that grew."""
+    kept = []
+    monitor = MemoryMonitor(tempfile.mkdtemp(), interval=0, top_n=5, tracemalloc_frames=1,
+                            counted_types=(Leaky,), sizes=lambda: {'kept': len(kept)})
+    try:
+        monitor.snapshot()
+        kept.extend(Leaky(10000) for _ in range(200))
+        monitor.snapshot()
+        report = monitor.report()
+    finally:
+        tracemalloc.stop()
+
+    assert report["pid"] == os.getpid()
+    assert report["rss_bytes"] > 0
+    assert report["peak_rss_bytes"] >= report["rss_bytes"]
+    assert report["objects"] == {"Leaky": 200}
+    assert report["stores"] == {"kept": 200}
+    top = report["allocations"]["since_previous"][0]
+    assert "test_memory.py" in top["site"]
+    assert top["size_diff_bytes"] >= 200 * 10000
+    assert report["allocations"]["since_first"][0]["site"] == top["site"]
+
+
+def test_collect_reports_running_processes_only():
+    """Collecting includes this process and other running ones, and removes the files of exited processes."""
+    directory = tempfile.mkdtemp()
+    monitor = MemoryMonitor(directory, interval=0)
+    monitor.write()
+    for pid, name in ((os.getppid(), 'parent.json'), (2 ** 22 + 1, 'exited.json')):
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump({"pid": pid, "rss_bytes": 1}, f)
+
+    reports = monitor.collect()
+    assert sorted(report["pid"] for report in reports) == sorted([os.getpid(), os.getppid()])
+    assert not os.path.exists(os.path.join(directory, 'exited.json'))
@@ -0,0 +1,94 @@
+"""
+NICU Fluid Management App - Metrics Tests
+"""
+
+from metrics import MetricsRegistry, count_calls
+import glob
+import json
+import os
+import tempfile
+
+
+def make_registry(directory):
+    registry = MetricsRegistry(directory, flush_interval=3600)
+    requests = registry.counter('requests_total', 'Requests', ('method',))
+    in_flight = registry.gauge('in_flight', 'In flight')
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    return registry, requests, in_flight, latency
+
+
+def test_samples_are_added_up_across_processes():
+    """Each registry writes its own file; collecting adds up all files, skipping gauges of exited processes."""
+    directory = tempfile.mkdtemp()
+    first, first_requests, first_in_flight, first_latency = make_registry(directory)
+    second, second_requests, second_in_flight, second_latency = make_registry(directory)
+
+    first_requests.inc(method='GET')
+    first_requests.inc(2, method='POST')
+    second_requests.inc(method='GET')
+    first_in_flight.inc()
+    second_in_flight.inc()
+    first_latency.observe(0.05)
+    second_latency.observe(0.5)
+    second_latency.observe(3)
+    second.flush()
+
+    # A worker that has exited: its counters still count, its gauges do not
+    with open(os.path.join(directory, 'exited.json'), 'w') as f:
+        json.dump({"pid": 2 ** 22 + 1, "samples": {"requests_total": [[["GET"], 5]], "in_flight": [[[], 4]]}}, f)
+
+    totals = first.collect()
+    assert totals["requests_total"] == {("GET",): 7, ("POST",): 2}
+    assert totals["in_flight"] == {(): 2}
+    assert totals["latency_seconds"] == {(): [1, 1, 1, 3.55]}
+
+    text = first.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1\nlatency_seconds_bucket{le="1"} 2\nlatency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+    assert 'requests_total{method="GET"} 7' in text
+    assert 'in_flight 2' in text
+
+
+def test_count_calls_and_label_escaping():
+    registry = MetricsRegistry(tempfile.mkdtemp())
+    calls = registry.counter('calls_total', 'Calls', ('operation',))
+
+    class Calculator:
+        def add(self, a, b):
+            return a + b
+
+    calculator = Calculator()
+    count_calls(calculator, ('add',), calls)
+    assert calculator.add(1, 2) == 3
+    calculator.add(a=2, b=3)
+    calls.inc(operation='say "hi"\n')
+
+    text = registry.render()
+    assert 'calls_total{operation="add"} 2' in text
+    assert 'calls_total{operation="say \\"hi\\"\\n"} 1' in text
+
+
+def test_files_of_exited_processes_are_folded_into_one():
+    """Counters of forked processes that exited survive in one aggregate file; their own files are removed."""
+    directory = tempfile.mkdtemp()
+    registry, requests, in_flight, latency = make_registry(directory)
+    requests.inc(method='GET')
+    registry.flush()
+    for _ in range(3):
+        pid = os.fork()
+        if pid == 0:
+            requests.inc(2, method='GET')
+            in_flight.inc()
+            latency.observe(0.5)
+            registry.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+    assert len(glob.glob(os.path.join(directory, '*.json'))) == 4
+
+    for _ in range(2):
+        totals = registry.collect()
+        assert totals["requests_total"] == {("GET",): 7}
+        assert totals["in_flight"] == {}
+        assert totals["latency_seconds"] == {(): [0, 3, 0, 1.5]}
+        assert len(glob.glob(os.path.join(directory, '*.json'))) == 2
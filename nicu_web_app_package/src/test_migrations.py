@@ -0,0 +1,87 @@
+"""
+NICU Fluid Management App - Database Migration Tests
+"""
+
+import json
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
+
+from migrations import run_migrations, MIGRATIONS, CALCULATED_VALUE_COLUMNS
+
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE patient_db (id INTEGER PRIMARY KEY, patient_id VARCHAR(100), user_id INTEGER, "
+    "gestational_age_at_birth FLOAT, birth_weight INTEGER, current_weight INTEGER, postnatal_age INTEGER, "
+    "created_at DATETIME)",
+    "CREATE TABLE nutrition_plan_db (id INTEGER PRIMARY KEY, plan_id VARCHAR(100), patient_id VARCHAR(100), "
+    "user_id INTEGER, date DATE, created_at DATETIME, calculated_values TEXT)",
+]
+
+
+def test_calculated_values_are_backfilled(tmp_path):
+    """Plans saved with JSON calculated values get the nutrient columns and weight category filled in."""
+    engine = create_engine('sqlite:///' + str(tmp_path / "legacy.db"))
+    values = {column: float(i) for i, column in enumerate(CALCULATED_VALUE_COLUMNS, start=1)}
+    values["reference_version"] = "abc123"
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "INSERT INTO patient_db (patient_id, user_id, gestational_age_at_birth, birth_weight, "
+            "current_weight, postnatal_age) VALUES ('LP1', 1, 28, 950, 1200, 3)"
+        ))
+        connection.execute(
+            text("INSERT INTO nutrition_plan_db (plan_id, patient_id, user_id, date, calculated_values) "
+                 "VALUES (:plan_id, 'LP1', 1, '2024-01-01', :values)"),
+            [{"plan_id": f"LNP{i}", "values": json.dumps(values)} for i in range(3)]
+        )
+
+    assert run_migrations(engine) == [version for version, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+
+    columns = {column["name"] for column in inspect(engine).get_columns("nutrition_plan_db")}
+    assert set(CALCULATED_VALUE_COLUMNS) <= columns
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT total_energy, total_fluid, reference_version, weight_category FROM nutrition_plan_db"
+        )).fetchall()
+    assert rows == [(1.0, float(len(CALCULATED_VALUE_COLUMNS)), "abc123", "premature_1000_1500g")] * 3
+
+
+def test_concurrent_workers_apply_each_migration_once(tmp_path):
+    """Workers migrating at the same time wait for each other instead of failing on the other's changes."""
+    path = 'sqlite:///' + str(tmp_path / "shared.db")
+
+    def slow_create(connection):
+        time.sleep(0.2)
+        connection.execute(text("CREATE TABLE created_once (id INTEGER PRIMARY KEY)"))
+    migrations = [(1, "Table without IF NOT EXISTS", [slow_create])]
+
+    results, errors = [], []
+
+    def migrate():
+        try:
+            results.append(run_migrations(create_engine(path), migrations))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=migrate) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(results) == [[], [], [1]]
+
+
+def test_failed_migration_is_raised(tmp_path):
+    """A migration failing without another worker having applied it is not skipped."""
+    engine = create_engine('sqlite:///' + str(tmp_path / "failing.db"))
+    with pytest.raises(OperationalError):
+        run_migrations(engine, [(1, "Broken", ["CREATE TABLE"])])
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar() == 0
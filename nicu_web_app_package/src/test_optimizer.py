@@ -0,0 +1,178 @@
+"""
+NICU Fluid Management App - Parenteral Optimizer Tests
+"""
+
+from models import Patient, NutritionPlan
+from app import NICUFluidApp
+from optimizer import CompositionError, ParenteralOptimizer, volume_axis
+import json
+import os
+import random
+import shutil
+from datetime import date
+
+import pytest
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+@pytest.fixture(scope="module")
+def app():
+    return NICUFluidApp(DATA_DIR)
+
+
+def test_suggestion_reproduces_notebook_example(app):
+    """Without enteral feeds the volumes follow from the protein/fat targets and the fluid ceiling."""
+    patient = Patient("P001", 28, 950, postnatal_age=3)
+    suggestion = app.optimizer.solve(patient)
+
+    assert suggestion["feasible"]
+    assert suggestion["tpn_volume"] == pytest.approx(3.5 / 0.0743)
+    assert suggestion["lipid_volume"] == pytest.approx(3.5 / 0.2)
+    assert suggestion["glucose_concentration"] == "10%"
+    assert suggestion["total_fluid"] == pytest.approx(suggestion["fluid_max"])
+
+    # Evaluating a plan with the suggested volumes gives the same values
+    plan = NutritionPlan(
+        "NP", "P001", date.today(),
+        tpn_type=suggestion["tpn_type"], tpn_volume=suggestion["tpn_volume"],
+        lipid_type=suggestion["lipid_type"], lipid_volume=suggestion["lipid_volume"],
+        glucose_concentration=suggestion["glucose_concentration"], glucose_volume=suggestion["glucose_volume"]
+    )
+    app.calculator.calculate_nutrition_values(plan, patient)
+    assert plan.total_protein == pytest.approx(suggestion["total_protein"])
+    assert plan.glucose_infusion_rate == pytest.approx(suggestion["glucose_infusion_rate"])
+
+
+def test_suggestion_trades_protein_for_glucose_under_fluid_limit(app):
+    """With little room left after enteral feeds, protein and fat drop towards their minimums."""
+    suggestion = app.optimizer.solve(Patient("P002", 29, 1200, postnatal_age=12), enteral_volume=80)
+
+    assert suggestion["feasible"]
+    assert suggestion["total_fluid"] <= suggestion["fluid_max"] + 1e-9
+    assert suggestion["protein_min"] <= suggestion["total_protein"] < suggestion["protein_max"]
+    assert suggestion["glucose_infusion_rate"] == pytest.approx(suggestion["gir_min"])
+
+
+def test_enteral_nutrients_reduce_parenteral_volumes(app):
+    """Protein and fat from fortified enteral feeds are taken off the TPN and lipid volumes."""
+    patient = Patient("P001", 28, 950, postnatal_age=3)
+    suggestion = app.optimizer.solve(patient, enteral_volume=40, enteral_feeding_type="Breast milk",
+                                     bmf_concentration=4)
+
+    enteral_protein = (0.012 + 0.325 * 0.04) * 40
+    enteral_fat = (0.034 + 0.175 * 0.04) * 40
+    assert suggestion["feasible"]
+    assert suggestion["tpn_volume"] == pytest.approx((3.5 - enteral_protein) / 0.0743)
+    assert suggestion["lipid_volume"] == pytest.approx((3.5 - enteral_fat) / 0.2)
+    assert suggestion["total_protein"] == pytest.approx(3.5)
+    assert suggestion["total_fat"] == pytest.approx(3.5)
+    assert suggestion["total_fluid"] == pytest.approx(suggestion["fluid_max"])
+
+
+def test_batch_matches_single_solutions_and_respects_bounds(app):
+    """Batch suggestions equal one-by-one suggestions and never exceed the fluid ceiling."""
+    rng = random.Random(7)
+    patients = [
+        Patient(f"P{i}", rng.uniform(24, 41), rng.randint(500, 4000), postnatal_age=rng.randint(1, 30),
+                phototherapy=rng.choice([None, "Single", "Double"]))
+        for i in range(300)
+    ]
+    enteral_volumes = [rng.uniform(0, 120) for _ in patients]
+
+    batch = app.optimizer.solve_batch(patients, enteral_volumes)
+    for i in range(0, len(patients), 37):
+        single = app.optimizer.solve(patients[i], enteral_volumes[i])
+        assert single["glucose_concentration"] == batch["glucose_concentration"][i]
+        assert single["tpn_volume"] == pytest.approx(batch["tpn_volume"][i])
+        assert single["glucose_volume"] == pytest.approx(batch["glucose_volume"][i])
+
+    room = batch["fluid_max"] - batch["enteral_volume"]
+    parenteral = batch["tpn_volume"] + batch["lipid_volume"] + batch["glucose_volume"]
+    assert (parenteral <= room.clip(0) + 1e-9).all()
+    assert (batch["glucose_infusion_rate"][batch["feasible"]] <= batch["gir_max"][batch["feasible"]] + 1e-9).all()
+    assert batch["feasible"].mean() > 0.8
+
+
+def test_grid_matches_plan_evaluation_and_pareto_front(app):
+    """Grid combinations equal evaluated plans, and no combination dominates a Pareto-best one."""
+    patient = Patient("P001", 28, 950, postnatal_age=3)
+    optimizer = ParenteralOptimizer(app.calculator)
+    tpn_volumes, lipid_volumes, glucose_volumes = volume_axis(30, 60, 2.5), volume_axis(5, 20, 2.5), volume_axis(40, 90, 5)
+    result = optimizer.evaluate_grid(patient, tpn_volumes, lipid_volumes, glucose_volumes, enteral_volume=20,
+                                     enteral_feeding_type="Breast milk", bmf_concentration=4, pareto_limit=1000)
+
+    assert result["combinations"] == len(tpn_volumes) * len(lipid_volumes) * len(glucose_volumes)
+    assert 0 < result["feasible_count"] == len(result["feasible"]["tpn_volume"])
+    for row in result["pareto"][:5]:
+        plan = NutritionPlan(
+            "NP", "P001", date.today(), enteral_volume=20, enteral_feeding_type="Breast milk", bmf_concentration=4,
+            tpn_type="NICU-mix", tpn_volume=row["tpn_volume"], lipid_type="SMOF_20%", lipid_volume=row["lipid_volume"],
+            glucose_concentration="10%", glucose_volume=row["glucose_volume"]
+        )
+        app.calculator.calculate_nutrition_values(plan, patient)
+        assert row["feasible"]
+        assert row["total_protein"] == plan.total_protein
+        assert row["total_energy"] == plan.total_energy
+        assert row["glucose_infusion_rate"] == plan.glucose_infusion_rate
+        assert row["total_fluid"] == plan.calculate_total_fluid()
+
+    requirements = result["requirements"]
+    names = (("total_fluid", "fluid"), ("total_protein", "protein"), ("total_fat", "fat"), ("glucose_infusion_rate", "gir"))
+
+    def costs(row):
+        return [abs(row[field] - requirements[f"{name}_max"]) for field, name in names]
+
+    pareto = [costs(row) for row in result["pareto"]]
+    feasible = result["feasible"]
+    for i in range(result["feasible_count"]):
+        plan = NutritionPlan(
+            "NP", "P001", date.today(), enteral_volume=20, enteral_feeding_type="Breast milk", bmf_concentration=4,
+            tpn_type="NICU-mix", tpn_volume=feasible["tpn_volume"][i], lipid_type="SMOF_20%",
+            lipid_volume=feasible["lipid_volume"][i], glucose_concentration="10%",
+            glucose_volume=feasible["glucose_volume"][i]
+        )
+        app.calculator.calculate_nutrition_values(plan, patient)
+        candidate = [abs(plan.calculate_total_fluid() - requirements["fluid_max"])] + [
+            abs(getattr(plan, field) - requirements[f"{name}_max"]) for field, name in names[1:]
+        ]
+        for best in pareto:
+            assert not (all(c <= b for c, b in zip(candidate, best)) and any(c < b for c, b in zip(candidate, best)))
+
+    with pytest.raises(ValueError):
+        ParenteralOptimizer(app.calculator, tpn_type="Unknown").evaluate_grid(patient, [1], [1], [1])
+
+def test_app_suggests_for_stored_patients(app):
+    app.create_patient("W1", 28, 950, postnatal_age=3)
+    app.create_patient("W2", 40, 3500, postnatal_age=20)
+
+    suggestions = app.suggest_parenteral_volumes(["W1", "W2"], [0, 100])
+    assert [suggestion["patient_id"] for suggestion in suggestions] == ["W1", "W2"]
+    assert suggestions[1]["enteral_volume"] == 100
+    assert ParenteralOptimizer(app.calculator, target="min").solve(app.patients["W1"])["total_protein"] == \
+        pytest.approx(suggestions[0]["protein_min"])
+    with pytest.raises(ValueError):
+        ParenteralOptimizer(app.calculator, target="most")
+
+
+def degenerate_app(tmp_path):
+    """App whose SMOF lipid has no fat, so TPN and lipid cannot set protein and fat independently."""
+    data_dir = tmp_path / 'data'
+    shutil.copytree(DATA_DIR, data_dir)
+    solutions_file = data_dir / 'solution_compositions.json'
+    solutions = json.loads(solutions_file.read_text())
+    solutions["lipid_solutions"]["SMOF_20%"]["fat_g_per_ml"] = 0
+    solutions_file.write_text(json.dumps(solutions))
+    return NICUFluidApp(str(data_dir))
+
+
+def test_degenerate_composition_is_reported(tmp_path):
+    """A singular protein/fat matrix raises a CompositionError instead of a linear algebra error."""
+    degenerate = degenerate_app(tmp_path)
+    with pytest.raises(CompositionError, match="cannot meet protein/fat targets independently"):
+        degenerate.optimizer.solve(Patient("P001", 28, 950, postnatal_age=3))
+    # Other lipids still work
+    assert ParenteralOptimizer(degenerate.calculator, lipid_type="Intralipid_20%").solve(
+        Patient("P001", 28, 950, postnatal_age=3)
+    )["lipid_volume"] > 0
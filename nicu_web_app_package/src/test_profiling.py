@@ -0,0 +1,54 @@
+"""
+NICU Fluid Management App - Request Profiling Tests
+"""
+
+from profiling import FORBIDDEN, INVALID_TOKEN, RATE_LIMITED, ProfileStore, RequestProfile, RequestProfiler
+import os
+import tempfile
+import time
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profiles_are_saved_to_a_bounded_ring():
+    """A profile has pstats and collapsed stacks; only the newest `keep` profiles are kept."""
+    store = ProfileStore(tempfile.mkdtemp(), keep=2)
+    profiler = RequestProfiler(store, 'secret', authorize=lambda: True, min_interval=0)
+    saved = []
+    for _ in range(3):
+        profile = profiler.start(profiler.make_token('/plan'), '/plan')
+        busy(0.05)
+        profiler.finish(profile, {'path': '/plan'})
+        saved.append(profile.id)
+
+    profiles = store.list()
+    assert [profile["id"] for profile in profiles] == saved[:0:-1]
+    assert profiles[0]["samples"] > 0
+    assert sorted(os.listdir(store.directory)) == sorted(
+        [f"{profile_id}.{kind}" for profile_id in saved[1:] for kind in ('json', 'pstats', 'collapsed')]
+        + ['last_profile']
+    )
+    with open(store.path(saved[-1], 'collapsed')) as f:
+        assert any('test_profiling.py:busy' in line for line in f)
+    assert store.path('../users', 'json') is None
+
+
+def test_profiling_is_authorized_and_rate_limited():
+    """Tokens are checked against the path, and one profile starts per interval across profilers sharing a store."""
+    directory = tempfile.mkdtemp()
+    first = RequestProfiler(ProfileStore(directory), 'secret', authorize=lambda: True, min_interval=60)
+    second = RequestProfiler(ProfileStore(directory), 'secret', authorize=lambda: True, min_interval=60)
+    token = first.make_token('/plan')
+
+    assert RequestProfiler(ProfileStore(directory), 'secret', authorize=lambda: False).start(token, '/plan') == FORBIDDEN
+    assert first.start(token, '/other') == INVALID_TOKEN
+    assert RequestProfiler(ProfileStore(directory), 'other', authorize=lambda: True).start(token, '/plan') == INVALID_TOKEN
+    profile = first.start(token, '/plan')
+    assert isinstance(profile, RequestProfile)
+    assert second.start(token, '/plan') == RATE_LIMITED
+    first.finish(profile, {'path': '/plan'})
+    assert first.start(token, '/plan') == RATE_LIMITED
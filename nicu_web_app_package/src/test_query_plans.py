@@ -0,0 +1,144 @@
+"""
+NICU Fluid Management App - Query Plan Tests
+
+Records the SQL issued by the API endpoints and checks with EXPLAIN QUERY PLAN,
+on a SQLite database seeded with NICU_QUERY_PLAN_ROWS nutrition plans
+(default 1,000,000), that every query is answered through an index.
+"""
+
+import os
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+
+# Use a throwaway database for the web server under test
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test_nicu_app.db'))
+os.environ.setdefault('JOB_DATABASE', os.path.join(tempfile.mkdtemp(), 'test_nicu_jobs.db'))
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp())
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp())
+
+import web_server
+from migrations import run_migrations
+
+
+SEED_PLANS = int(os.environ.get('NICU_QUERY_PLAN_ROWS', 1000000))
+PLANS_PER_PATIENT = 50
+
+# Full table scans and sorts that no index supports
+FULL_SCAN = re.compile(r"\bSCAN (patient_db|nutrition_plan_db|user)\b(?! USING (COVERING )?INDEX)")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE FOR ORDER BY")
+
+
+@pytest.fixture(scope="module")
+def seeded_engine(tmp_path_factory):
+    """SQLite database with the application schema, migrations and seeded plans."""
+    engine = create_engine('sqlite:///' + str(tmp_path_factory.mktemp("query_plans") / "seeded.db"))
+    web_server.db.metadata.create_all(engine)
+    run_migrations(engine)
+
+    patients = max(1, SEED_PLANS // PLANS_PER_PATIENT)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, username, email, password_hash, role) VALUES (1, 'admin', 'a@b', '-', 'admin')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO patient_db (patient_id, user_id, gestational_age_at_birth, birth_weight, "
+            "current_weight, postnatal_age, created_at) VALUES (?, ?, 28, 950, 950, 3, ?)",
+            [(f"SP{i}", 1 + i % 5, start + timedelta(minutes=i)) for i in range(patients)]
+        )
+        for chunk_start in range(0, SEED_PLANS, 100000):
+            connection.exec_driver_sql(
+                "INSERT INTO nutrition_plan_db (plan_id, patient_id, user_id, date, total_fluid_target, "
+                "tpn_volume, created_at) VALUES (?, ?, ?, ?, 150, 80, ?)",
+                [
+                    (f"SNP{i}", f"SP{i % patients}", 1 + (i % patients) % 5,
+                     date(2020, 1, 1) + timedelta(days=i // patients), start + timedelta(seconds=i))
+                    for i in range(chunk_start, min(chunk_start + 100000, SEED_PLANS))
+                ]
+            )
+        connection.exec_driver_sql("ANALYZE")
+    return engine
+
+
+class RecordingContext:
+    """Job context for running a handler in the test process"""
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def progress(self, done, total=None, message=None):
+        pass
+
+
+@pytest.fixture(scope="module")
+def recorded_queries():
+    """SELECT statements and parameters issued while calling every API endpoint."""
+    client = web_server.app.test_client()
+    client.get('/')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.append((statement, parameters))
+
+    with web_server.app.app_context():
+        engine = web_server.db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        client.post('/api/patient', json={
+            'patientId': 'QP001', 'gestationalAge': 28, 'birthWeight': 950, 'postnatalAge': 3
+        })
+        plan = {'patientId': 'QP001', 'tpnVolume': 80, 'glucoseVolume': 20}
+        plan_id = client.post('/api/nutrition_plan', json=plan).get_json()["plan_id"]
+        client.post('/api/nutrition_plans:batch', json=[plan, plan])
+        client.post('/api/nutrition_plan', json=plan)
+
+        cursor = client.get('/api/patients?limit=1').get_json()["next_cursor"]
+        client.get(f'/api/patients?limit=1&cursor={cursor}')
+        cursor = client.get('/api/nutrition_plans/QP001?limit=1').get_json()["next_cursor"]
+        client.get(f'/api/nutrition_plans/QP001?limit=1&cursor={cursor}')
+        client.get('/api/patient/QP001')
+        client.get(f'/api/nutrition_plan/{plan_id}')
+        client.get(f'/api/export_plan/{plan_id}')
+        client.get('/api/reports/nutrition_by_weight_category?start=2020-01-01&end=2020-03-31')
+        client.get('/api/export/plans?start=2020-01-01&end=2020-01-31').get_data()
+        client.get('/api/export/plans?format=csv&patient_id=QP001').get_data()
+        client.get('/dashboard')
+        with web_server.app.app_context():
+            user_id = web_server.User.query.filter_by(username='admin').first().id
+        # Small pages, so that continuation pages are recorded too
+        batch_size = web_server.app.config['MAX_PLAN_BATCH_SIZE']
+        web_server.app.config['MAX_PLAN_BATCH_SIZE'] = 2
+        try:
+            assert web_server.recompute_plans_job({}, RecordingContext(user_id))["recomputed"] >= 4
+            assert web_server.recompute_plans_job({'patient_id': 'QP001'}, RecordingContext(user_id))["recomputed"] == 4
+        finally:
+            web_server.app.config['MAX_PLAN_BATCH_SIZE'] = batch_size
+
+        # Rehydration of evicted patients and plans
+        web_server.nicu_app.patients.clear()
+        web_server.nicu_app.nutrition_plans.clear()
+        with web_server.app.app_context():
+            web_server.nicu_app.evaluate_plan(plan_id)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    return queries
+
+
+def test_api_queries_use_indexes(seeded_engine, recorded_queries):
+    """No API query scans a full table or sorts rows outside an index."""
+    assert len(recorded_queries) > 10
+
+    with seeded_engine.connect() as connection:
+        for statement, parameters in recorded_queries:
+            plan = "\n".join(
+                row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, tuple(parameters))
+            )
+            assert not FULL_SCAN.search(plan), f"Full table scan:\n{statement}\n{plan}"
+            assert not TEMP_SORT.search(plan), f"Sort without index:\n{statement}\n{plan}"
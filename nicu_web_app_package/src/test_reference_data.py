@@ -0,0 +1,159 @@
+"""
+NICU Fluid Management App - Reference Data Tests
+"""
+
+from models import Patient, NutritionPlan
+from calculator import NutritionCalculator
+import json
+import os
+import shutil
+from datetime import date
+
+import pytest
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+REFERENCE_FILES = ('tpn_compositions.json', 'solution_compositions.json', 'fluid_requirements.json')
+
+
+def make_calculator(data_dir):
+    return NutritionCalculator(*(os.path.join(data_dir, name) for name in REFERENCE_FILES), reload_interval=0)
+
+
+def copy_reference_data(tmp_path):
+    for name in REFERENCE_FILES:
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    return tmp_path
+
+
+def test_hot_reload_picks_up_changed_file(tmp_path):
+    """
+    Changed reference data is picked up without recreating the calculator,
+    while a snapshot already in use stays unchanged.
+    """
+    data_dir = copy_reference_data(tmp_path)
+    calculator = make_calculator(data_dir)
+    patient = Patient("P001", 28, 950, postnatal_age=3)
+    plan = NutritionPlan("NP001", "P001", date.today(), tpn_volume=100)
+    
+    in_flight = calculator.reference_data
+    calculator.calculate_nutrition_values(plan, patient)
+    assert plan.total_protein == 0.0743 * 100
+    assert plan.reference_version == in_flight.version
+    
+    tpn_file = data_dir / 'tpn_compositions.json'
+    tpn = json.loads(tpn_file.read_text())
+    tpn["NICU-mix"]["protein_g_per_ml"] = 0.08
+    tpn_file.write_text(json.dumps(tpn))
+    
+    calculator.calculate_nutrition_values(plan, patient)
+    assert plan.total_protein == 0.08 * 100
+    assert plan.reference_version != in_flight.version
+    assert in_flight.tpn_compositions["NICU-mix"]["protein_g_per_ml"] == 0.0743
+
+
+def test_invalid_file_keeps_previous_version(tmp_path):
+    """
+    A partially written file does not replace the loaded reference data.
+    """
+    data_dir = copy_reference_data(tmp_path)
+    calculator = make_calculator(data_dir)
+    version = calculator.reference_version
+    
+    (data_dir / 'fluid_requirements.json').write_text('{"fluid_requirements": {')
+    
+    assert calculator.reference_version == version
+    assert calculator.calculate_fluid_requirements(Patient("P001", 28, 950, postnatal_age=3)) == {"min": 120, "max": 140}
+
+
+def test_missing_file_keeps_previous_version(tmp_path):
+    """
+    A reference file that is briefly missing (e.g. mid-deploy) does not break
+    requests; the loaded data is kept and the returned file is picked up.
+    """
+    data_dir = copy_reference_data(tmp_path)
+    calculator = make_calculator(data_dir)
+    version = calculator.reference_version
+    
+    tpn_file = data_dir / 'tpn_compositions.json'
+    tpn = json.loads(tpn_file.read_text())
+    tpn_file.unlink()
+    
+    assert calculator.reference_data.version == version
+    assert calculator.calculate_fluid_requirements(Patient("P001", 28, 950, postnatal_age=3)) == {"min": 120, "max": 140}
+    
+    tpn["NICU-mix"]["protein_g_per_ml"] = 0.08
+    tpn_file.write_text(json.dumps(tpn))
+    assert calculator.reference_version != version
+
+
+def test_fluid_requirements_lookup():
+    """
+    Compiled fluid requirement lookups match the reference table.
+    """
+    calculator = make_calculator(DATA_DIR)
+    with open(os.path.join(DATA_DIR, 'fluid_requirements.json')) as f:
+        table = json.load(f)["fluid_requirements"]
+    
+    patient = Patient("P001", 38, 3200, postnatal_age=10, phototherapy="Double")
+    expected = table["term"]["day_8_14"]
+    adjustment = table["phototherapy_adjustment"]["double"]
+    assert calculator.calculate_fluid_requirements(patient) == {
+        "min": expected["min"] + adjustment["min"],
+        "max": expected["max"] + adjustment["max"]
+    }
+
+
+def test_requirement_cache_hits_and_invalidation(tmp_path):
+    """
+    Requirement lookups are memoized per patient category and recomputed
+    after the reference data changes.
+    """
+    data_dir = copy_reference_data(tmp_path)
+    calculator = make_calculator(data_dir)
+    
+    for weight in (950, 960, 970):
+        patient = Patient("P001", 28, weight, postnatal_age=3, phototherapy="Single")
+        assert calculator.calculate_fluid_requirements(patient) == {"min": 130, "max": 160}
+        calculator.get_macronutrient_requirements(patient)
+    
+    stats = calculator.requirement_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (4, 2, 2)
+    
+    fluid_file = data_dir / 'fluid_requirements.json'
+    table = json.loads(fluid_file.read_text())
+    table["fluid_requirements"]["premature_less_1000g"]["day_3"] = {"min": 125, "max": 145}
+    fluid_file.write_text(json.dumps(table))
+    
+    assert calculator.calculate_fluid_requirements(patient) == {"min": 135, "max": 165}
+    assert calculator.requirement_cache_stats()["misses"] == 3
+
+
+def test_enteral_table_and_version(tmp_path):
+    """
+    Fortified feed compositions come from the precomputed table on the
+    concentration grid and are computed directly off the grid. Changing the
+    compositions file changes the reference version.
+    """
+    data_dir = copy_reference_data(tmp_path)
+    shutil.copy(os.path.join(DATA_DIR, 'enteral_compositions.json'), data_dir / 'enteral_compositions.json')
+    calculator = NutritionCalculator(
+        *(os.path.join(data_dir, name) for name in REFERENCE_FILES), reload_interval=0,
+        enteral_compositions_file=os.path.join(data_dir, 'enteral_compositions.json')
+    )
+    reference = calculator.reference_data
+    
+    on_grid = reference.enteral_row("Breast milk", "BMF", 4)
+    assert on_grid is not None
+    assert list(reference.enteral_table[on_grid]) == list(reference.enteral_composition("Breast milk", "BMF", 4))
+    assert reference.enteral_row("Breast milk", "BMF", 1.23) is None
+    assert reference.enteral_composition("Breast milk", "BMF", 1.23)[1] == pytest.approx(0.012 + 0.325 * 0.0123)
+    assert not reference.enteral_table[reference.enteral_row("Unknown", "BMF", 4)].any()
+    
+    enteral_file = data_dir / 'enteral_compositions.json'
+    compositions = json.loads(enteral_file.read_text())
+    compositions["fortifiers"]["BMF"]["protein_g_per_g"] = 0.35
+    enteral_file.write_text(json.dumps(compositions))
+    
+    assert calculator.reference_version != reference.version
+    assert calculator.reference_data.enteral_composition("Breast milk", "BMF", 4)[1] == pytest.approx(0.012 + 0.35 * 0.04)
@@ -0,0 +1,79 @@
+"""
+NICU Fluid Management App - Bounded Store Tests
+"""
+
+from store import BoundedStore
+from app import NICUFluidApp
+from datetime import date
+from unittest import mock
+import os
+
+import pytest
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def test_evicts_least_recently_used():
+    """The store never holds more than maxsize entries and evicts the least recently used first."""
+    store = BoundedStore(maxsize=2)
+    store["a"] = 1
+    store["b"] = 2
+    store.get("a")
+    store["c"] = 3
+
+    assert len(store) == 2
+    assert "b" not in store
+    assert store["a"] == 1 and store["c"] == 3
+    assert store.stats()["evictions"] == 1
+    with pytest.raises(KeyError):
+        store["b"]
+
+
+def test_entries_expire():
+    """Entries older than the time-to-live are dropped."""
+    store = BoundedStore(maxsize=10, ttl=60)
+    with mock.patch("store.time.monotonic", return_value=1000.0):
+        store["a"] = 1
+    with mock.patch("store.time.monotonic", return_value=1059.0):
+        assert store.get("a") == 1
+    with mock.patch("store.time.monotonic", return_value=1061.0):
+        assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_read_through_loader():
+    """Missing keys are loaded once and then served from memory; unknown keys are not cached."""
+    backing = {"a": 1}
+    loader = mock.Mock(side_effect=backing.get)
+    store = BoundedStore(maxsize=10, loader=loader)
+
+    assert store["a"] == 1
+    assert store["a"] == 1
+    assert store.get("missing", "default") == "default"
+    assert "missing" not in store
+    assert loader.call_count == 3
+    assert store.stats()["loads"] == 1
+    assert store.stats()["hits"] == 1
+
+
+def test_app_rehydrates_evicted_plans():
+    """A plan evicted from memory is evaluated again from the backing storage."""
+    records = {}
+    app = NICUFluidApp(
+        DATA_DIR,
+        patient_store=BoundedStore(maxsize=1, loader=lambda key: records.get(("patient", key))),
+        nutrition_plan_store=BoundedStore(maxsize=1, loader=lambda key: records.get(("plan", key)))
+    )
+    for i in range(3):
+        patient = app.create_patient(f"P{i}", 28, 950 + i * 500, postnatal_age=3)
+        plan = app.create_nutrition_plan(f"NP{i}", f"P{i}", date.today(), tpn_volume=80, glucose_volume=20)
+        records[("patient", patient.patient_id)] = patient
+        records[("plan", plan.plan_id)] = plan
+
+    assert len(app.patients) == 1 and len(app.nutrition_plans) == 1
+    evaluation = app.evaluate_plan("NP0")
+    assert evaluation.patient_id == "P0"
+    assert evaluation.fluid_requirements == app.calculator.calculate_fluid_requirements(records[("patient", "P0")])
+    with pytest.raises(ValueError):
+        app.evaluate_plan("NP-missing")
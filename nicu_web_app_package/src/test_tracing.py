@@ -0,0 +1,100 @@
+"""
+NICU Fluid Management App - Tracing Tests
+"""
+
+from tracing import NOOP_SPAN, JsonLinesExporter, Tracer, otlp_trace, parse_traceparent, span, traced
+import json
+import os
+import time
+
+
+class ListExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+
+@traced()
+def calculate(value):
+    with span("round", digits=2):
+        return round(value * 1.5, 2)
+
+
+def test_nested_spans_are_exported_with_the_root_span():
+    """Spans started inside a traced call are its children; ending the root span exports the whole trace."""
+    exporter = ListExporter()
+    tracer = Tracer(1.0, exporter)
+    root = tracer.start_trace("POST /plan", "ab" * 16, **{"http.method": "POST"})
+    assert calculate(2) == 3.0
+    assert exporter.traces == []
+    tracer.end_trace(root)
+
+    assert span("outside") is NOOP_SPAN
+    assert len(exporter.traces) == 1
+    spans = otlp_trace(exporter.traces[0], {"service.name": "test"})["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    names = [item["name"] for item in spans]
+    assert names == ["POST /plan", "calculate", "round"]
+    root_span, call_span, round_span = spans
+    assert "parentSpanId" not in root_span
+    assert root_span["kind"] == 2
+    assert call_span["parentSpanId"] == root_span["spanId"]
+    assert round_span["parentSpanId"] == call_span["spanId"]
+    assert round_span["attributes"] == [{"key": "digits", "value": {"intValue": "2"}}]
+    assert int(root_span["startTimeUnixNano"]) <= int(call_span["startTimeUnixNano"])
+    assert int(call_span["endTimeUnixNano"]) <= int(root_span["endTimeUnixNano"])
+
+
+def test_sampling_is_decided_once_per_request():
+    """Unsampled requests get no-op spans; a caller's traceparent decision overrides the sample rate."""
+    exporter = ListExporter()
+    tracer = Tracer(0.0, exporter)
+    assert tracer.start_trace("GET /", "cd" * 16) is NOOP_SPAN
+    trace_id, parent_span_id, sampled = parse_traceparent("00-" + "cd" * 16 + "-" + "ef" * 8 + "-01")
+    assert (trace_id, parent_span_id, sampled) == ("cd" * 16, "ef" * 8, True)
+    tracer.end_trace(tracer.start_trace("GET /", trace_id, parent_span_id, sampled))
+    assert len(exporter.traces) == 1
+    assert parse_traceparent("00-" + "0" * 32 + "-" + "ef" * 8 + "-01") == (None, None, None)
+    assert parse_traceparent("garbage") == (None, None, None)
+    assert Tracer(1.0, None).start_trace("GET /", "cd" * 16) is NOOP_SPAN
+
+
+def test_disabled_tracing_overhead():
+    """Outside a sampled trace, a traced call costs well under 2 microseconds more than a plain call."""
+    def plain(value):
+        return value
+
+    wrapped = traced()(plain)
+    calls = 100000
+
+    def best_time(function):
+        best = float("inf")
+        for _ in range(5):
+            started = time.perf_counter()
+            for value in range(calls):
+                function(value)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    overhead = (best_time(wrapped) - best_time(plain)) / calls
+    assert overhead < 2e-6
+
+
+def test_trace_file_is_rotated(tmp_path):
+    """The trace file is rotated at max_bytes, keeping backup_count files, also when another exporter rotated it."""
+    path = str(tmp_path / "traces.jsonl")
+    exporters = [JsonLinesExporter(path, max_bytes=2000, backup_count=2) for _ in range(2)]
+    for i in range(40):
+        tracer = Tracer(1.0, exporters[i % 2])
+        root = tracer.start_trace("GET /rotated", "ab" * 16)
+        calculate(i)
+        tracer.end_trace(root)
+        exporters[i % 2].flush()
+
+    assert sorted(os.listdir(tmp_path)) == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2", "traces.jsonl.lock"]
+    for name in ("traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"):
+        assert os.path.getsize(tmp_path / name) <= 2000
+        with open(tmp_path / name) as f:
+            assert all(json.loads(line)["resourceSpans"] for line in f)
+    assert sum(exporter.dropped for exporter in exporters) == 0
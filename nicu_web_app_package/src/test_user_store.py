@@ -0,0 +1,66 @@
+"""
+NICU Fluid Management App - User Store Tests
+"""
+
+from user_store import UserStore
+import json
+import multiprocessing
+import os
+
+
+PROCESSES = 6
+USERS_PER_PROCESS = 60
+
+
+def register_users(users_file, worker):
+    """Register unique users and race the other workers for one shared name."""
+    store = UserStore(users_file, compact_threshold=25)
+    won_shared_name = store.add("shared", f"worker-{worker}")
+    for i in range(USERS_PER_PROCESS):
+        assert store.add(f"user-{worker}-{i}", f"password-{i}")
+    return won_shared_name
+
+
+def test_concurrent_registration_loses_no_writes(tmp_path):
+    """Processes registering at the same time keep every user and each name exactly once."""
+    users_file = str(tmp_path / "users.json")
+    with open(users_file, 'w') as f:
+        json.dump({"admin": "admin"}, f)
+
+    with multiprocessing.get_context("fork").Pool(PROCESSES) as pool:
+        won = pool.starmap(register_users, [(users_file, worker) for worker in range(PROCESSES)])
+
+    assert sum(won) == 1
+
+    store = UserStore(users_file)
+    assert len(store) == PROCESSES * USERS_PER_PROCESS + 2
+    assert store.get("admin") == "admin"
+    assert store.get("shared") == f"worker-{won.index(True)}"
+    assert store.get(f"user-{PROCESSES - 1}-{USERS_PER_PROCESS - 1}") == f"password-{USERS_PER_PROCESS - 1}"
+
+    # After a compaction everything lives in the JSON file
+    store.compact()
+    with open(users_file) as f:
+        assert len(json.load(f)) == PROCESSES * USERS_PER_PROCESS + 2
+    assert os.path.getsize(f"{users_file}.journal") == 0
+
+
+def test_index_follows_other_writers(tmp_path):
+    """A store sees users added by another store instance without re-reading unchanged files."""
+    users_file = str(tmp_path / "users.json")
+    reader = UserStore(users_file)
+    writer = UserStore(users_file, compact_threshold=2)
+
+    assert reader.get("alice") is None
+    assert writer.add("alice", "a")
+    assert reader.get("alice") == "a"
+    assert writer.add("bob", "b")  # triggers a compaction
+    assert not writer.add("alice", "other")
+    assert reader.get("alice") == "a" and reader.get("bob") == "b"
+
+    # An interrupted write leaves a partial line that later entries recover from
+    with open(f"{users_file}.journal", 'a') as f:
+        f.write('{"username": "carol"')
+    assert writer.add("dave", "d")
+    assert reader.get("dave") == "d"
+    assert reader.get("carol") is None
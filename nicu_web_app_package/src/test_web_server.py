@@ -0,0 +1,664 @@
+"""
+NICU Fluid Management App - Web Server Tests
+"""
+
+import gzip
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+
+import pytest
+from sqlalchemy import event
+
+# Use a throwaway database for the web server under test
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test_nicu_app.db'))
+os.environ.setdefault('JOB_DATABASE', os.path.join(tempfile.mkdtemp(), 'test_nicu_jobs.db'))
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp())
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp())
+
+import web_server
+from models import Patient
+from tracing import JsonLinesExporter, tracer
+
+
+PLAN = {
+    'patientId': 'WP001',
+    'totalFluidTarget': 150,
+    'enteralVolume': 30,
+    'tpnVolume': 80,
+    'lipidVolume': 20,
+    'glucoseVolume': 20,
+    'enteralFeedingType': 'Breast milk',
+    'enteralFeedingFrequency': 12
+}
+
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client logged in as the default admin user, with one patient."""
+    client = web_server.app.test_client()
+    client.get('/')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    client.post('/api/patient', json={
+        'patientId': 'WP001', 'gestationalAge': 28, 'birthWeight': 950,
+        'postnatalAge': 3, 'phototherapy': 'Single'
+    })
+    return client
+
+
+def fetch_all_pages(client, url, limit=3):
+    """Follow next_cursor until the last page and return all items."""
+    items = []
+    cursor = None
+    while True:
+        query = f"?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url + query).get_json()
+        items.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def plan_count(client):
+    return len(fetch_all_pages(client, '/api/nutrition_plans/WP001', limit=200))
+
+
+def test_batch_create_matches_single_create(client):
+    """Plans created in a batch get the same results as plans created one at a time."""
+    single = client.post('/api/nutrition_plan', json=PLAN).get_json()
+    response = client.post('/api/nutrition_plans:batch', json=[PLAN, dict(PLAN, tpnVolume=60)])
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body["success"] is True
+    assert body["created"] == 2
+    first = body["results"][0]
+    assert first["index"] == 0
+    assert first["calculated_values"] == single["calculated_values"]
+    assert first["recommendations"] == single["recommendations"]
+    assert first["feeding_schedule"] == single["feeding_schedule"]
+
+    stored = client.get(f"/api/nutrition_plan/{body['results'][1]['plan_id']}").get_json()
+    assert stored["tpn_volume"] == 60
+    assert stored["calculated_values"] == body["results"][1]["calculated_values"]
+
+
+def test_batch_create_reports_item_errors(client):
+    """Invalid items are reported individually and valid items are still saved."""
+    before = plan_count(client)
+    response = client.post('/api/nutrition_plans:batch', json=[
+        PLAN,
+        dict(PLAN, patientId='UNKNOWN'),
+        dict(PLAN, tpnVolume='a lot'),
+        "not a plan"
+    ])
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body["success"] is False
+    assert (body["created"], body["failed"]) == (1, 3)
+    assert [result["success"] for result in body["results"]] == [True, False, False, False]
+    assert body["results"][1]["error"] == "Patient not found or access denied"
+    assert plan_count(client) == before + 1
+
+
+def test_batch_create_limits(client):
+    """Oversized batches and non-array bodies are rejected without saving anything."""
+    before = plan_count(client)
+    max_batch_size = web_server.app.config['MAX_PLAN_BATCH_SIZE']
+
+    assert client.post('/api/nutrition_plans:batch', json=[PLAN] * (max_batch_size + 1)).status_code == 413
+    assert client.post('/api/nutrition_plans:batch', json=PLAN).status_code == 400
+    assert plan_count(client) == before
+
+
+def test_batch_create_queries_do_not_grow_with_batch_size(client):
+    """Creating a batch issues the same SELECTs for 2 plans as for 20."""
+    with web_server.app.app_context():
+        engine = web_server.db.engine
+
+    def count_selects(batch):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            assert client.post('/api/nutrition_plans:batch', json=batch).get_json()["created"] == len(batch)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        return len(statements)
+
+    assert count_selects([PLAN] * 20) == count_selects([PLAN] * 2)
+
+
+def test_batch_create_failure_keeps_no_plans(client, monkeypatch):
+    """A failed commit rolls back the batch and leaves none of its plans in memory."""
+    before = plan_count(client)
+    plan_ids = []
+    new_plan_id = web_server.new_plan_id
+
+    def record_plan_id(patient_id):
+        plan_ids.append(new_plan_id(patient_id))
+        return plan_ids[-1]
+
+    def fail():
+        raise RuntimeError("database unavailable")
+    monkeypatch.setattr(web_server, 'new_plan_id', record_plan_id)
+    monkeypatch.setattr(web_server.db.session, 'commit', fail)
+    response = client.post('/api/nutrition_plans:batch', json=[PLAN, dict(PLAN, tpnVolume=60)])
+    monkeypatch.undo()
+
+    assert response.status_code == 500
+    assert len(plan_ids) == 2
+    with web_server.app.app_context():
+        assert not any(plan_id in web_server.nicu_app.nutrition_plans for plan_id in plan_ids)
+    assert plan_count(client) == before
+
+
+def test_plans_are_rehydrated_from_database(client):
+    """Plans and patients missing from a worker's memory are loaded from the database."""
+    plan_id = client.post('/api/nutrition_plan', json=PLAN).get_json()["plan_id"]
+    expected = web_server.nicu_app.evaluate_plan(plan_id).to_dict()
+
+    web_server.nicu_app.patients.clear()
+    web_server.nicu_app.nutrition_plans.clear()
+    with web_server.app.app_context():
+        evaluation = web_server.nicu_app.evaluate_plan(plan_id).to_dict()
+
+    assert evaluation == expected
+    assert web_server.nicu_app.nutrition_plans.stats()["loads"] >= 1
+
+
+def test_reference_data_conditional_get(client):
+    """Reference data is served with an ETag, gzip on request and 304 for a matching If-None-Match."""
+    version = web_server.nicu_app.calculator.reference_version
+    with open(os.path.join(web_server.data_dir, 'tpn_compositions.json')) as f:
+        expected = json.load(f)
+
+    response = client.get('/api/data/tpn_compositions')
+    assert response.status_code == 200
+    assert response.get_json() == expected
+    assert response.headers['ETag'] == f'"{version}-tpn_compositions"'
+    assert 'max-age=' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+    compressed = client.get('/api/data/tpn_compositions', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == expected
+
+    for etag in (response.headers['ETag'], compressed.headers['ETag']):
+        not_modified = client.get('/api/data/tpn_compositions', headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert not_modified.data == b''
+
+    stale = client.get('/api/data/tpn_compositions', headers={'If-None-Match': '"old-tpn_compositions"'})
+    assert stale.status_code == 200
+
+
+def test_app_page_uses_reference_bundle(client):
+    """The served page loads the bundle, and the products it offers before then are in the bundle."""
+    page = client.get('/app').get_data(as_text=True)
+    bundle = client.get('/api/data/bundle').get_json()
+
+    assert "fetch('/api/data/bundle'" in page
+    assert "'If-None-Match'" in page
+    # The inline script is the only client; the page loads no other application script
+    assert re.findall(r'<script src="([^"]+)"', page) == [
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js'
+    ]
+    products = {
+        'tpnType': bundle["tpn_compositions"],
+        'lipidType': bundle["solution_compositions"]["lipid_solutions"],
+        'glucoseConcentration': bundle["solution_compositions"]["glucose_solutions"],
+        'enteralFeedingType': bundle["enteral_compositions"]["feeds"],
+    }
+    for element_id, available in products.items():
+        select = re.search(rf'<select[^>]*id="{element_id}".*?</select>', page, re.S).group(0)
+        values = re.findall(r'<option value="([^"]*)"', select)
+        assert values and set(values) <= set(available)
+
+
+def test_reference_bundle(client):
+    """The bundle holds all reference tables and category boundaries matching the Patient model."""
+    reference = web_server.nicu_app.calculator.reference_data
+    response = client.get('/api/data/bundle')
+    bundle = response.get_json()
+
+    assert response.headers['ETag'] == f'"{reference.version}-bundle"'
+    assert bundle["version"] == reference.version
+    assert bundle["tpn_compositions"] == reference.tpn_compositions
+    assert bundle["solution_compositions"] == reference.solution_compositions
+    assert bundle["fluid_requirements"] == reference.fluid_requirements
+    assert bundle["macronutrient_requirements"]["term"] == \
+        web_server.nicu_app.calculator.get_macronutrient_requirements(Patient("P", 40, 3500))
+
+    def weight_category(weight):
+        for entry in bundle["weight_categories"]:
+            if entry["max_weight_g"] is None or weight < entry["max_weight_g"]:
+                return entry["category"]
+
+    def age_category(age):
+        for entry in bundle["age_categories"]:
+            if entry["first_day"] <= age <= entry["last_day"]:
+                return entry["category"]
+        return bundle["default_age_category"]
+
+    for weight in range(400, 4000, 50):
+        assert weight_category(weight) == Patient("P", 30, weight).get_weight_category()
+    for age in [0, 0.5, 4.5, 7.5] + list(range(1, 30)):
+        assert age_category(age) == Patient("P", 30, 1000, postnatal_age=age).get_postnatal_age_category()
+
+    assert client.get('/api/data/bundle', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_keyset_pagination(client):
+    """Pages follow (created_at, id) newest first, without gaps or duplicates."""
+    for i in range(7):
+        client.post('/api/patient', json={
+            'patientId': f'PG{i:03d}', 'gestationalAge': 30, 'birthWeight': 1200, 'postnatalAge': 2
+        })
+        client.post('/api/nutrition_plan', json=dict(PLAN, patientId=f'PG{i:03d}'))
+
+    patients = fetch_all_pages(client, '/api/patients')
+    with web_server.app.app_context():
+        expected = [
+            row.patient_id for row in web_server.PatientDB.query.order_by(
+                web_server.PatientDB.created_at.desc(), web_server.PatientDB.id.desc()
+            )
+        ]
+    assert [patient["patient_id"] for patient in patients] == expected
+
+    first_page = client.get('/api/patients?limit=2&fields=patient_id,current_weight').get_json()
+    assert len(first_page["items"]) == 2
+    assert set(first_page["items"][0]) == {"patient_id", "current_weight"}
+    assert first_page["next_cursor"]
+
+    plans = fetch_all_pages(client, '/api/nutrition_plans/PG003', limit=1)
+    assert len(plans) == 1
+    assert set(plans[0]) == {"plan_id", "date", "total_fluid_target", "created_at"}
+
+    assert client.get('/api/patients?fields=password_hash').status_code == 400
+    assert client.get('/api/patients?cursor=not-a-cursor').status_code == 400
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_nutrition_report_by_weight_category(client):
+    """The ward report aggregates the stored nutrient columns of the user's plans in SQL."""
+    client.post('/api/patient', json={
+        'patientId': 'RP001', 'gestationalAge': 34, 'birthWeight': 2000, 'postnatalAge': 5
+    })
+    plans = [dict(PLAN, patientId='RP001', tpnVolume=tpn_volume) for tpn_volume in (60, 100)]
+    created = [client.post('/api/nutrition_plan', json=plan).get_json()["plan_id"] for plan in plans]
+    proteins = [
+        client.get(f'/api/nutrition_plan/{plan_id}').get_json()["calculated_values"]["total_protein"]
+        for plan_id in created
+    ]
+
+    today = web_server.date.today().isoformat()
+    report = client.get(f'/api/reports/nutrition_by_weight_category?start={today}&end={today}')
+    assert report.status_code == 200
+    categories = {row["weight_category"]: row for row in report.get_json()["categories"]}
+    assert "premature_less_1000g" in categories
+    row = categories["premature_greater_1500g"]
+    assert row["plan_count"] == 2
+    assert row["mean_protein"] == pytest.approx(sum(proteins) / 2)
+    assert (row["min_protein"], row["max_protein"]) == pytest.approx((min(proteins), max(proteins)))
+
+    empty = client.get('/api/reports/nutrition_by_weight_category?end=2000-01-01').get_json()
+    assert empty["categories"] == []
+    assert client.get('/api/reports/nutrition_by_weight_category?start=yesterday').status_code == 400
+    assert client.get(
+        '/api/reports/nutrition_by_weight_category?start=2020-01-02&end=2020-01-01'
+    ).status_code == 400
+
+
+def test_bulk_plan_export(client):
+    """The bulk export streams every plan of a patient as NDJSON or CSV."""
+    client.post('/api/patient', json={
+        'patientId': 'XP001', 'gestationalAge': 30, 'birthWeight': 1300, 'postnatalAge': 4
+    })
+    created = [
+        client.post('/api/nutrition_plan', json=dict(PLAN, patientId='XP001', tpnVolume=tpn_volume)).get_json()["plan_id"]
+        for tpn_volume in (50, 70, 90)
+    ]
+    calculated = client.get(f'/api/nutrition_plan/{created[0]}').get_json()["calculated_values"]
+
+    response = client.get('/api/export/plans?patient_id=XP001')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["plan_id"] for row in rows] == created
+    assert rows[0]["tpn_volume"] == 50
+    assert rows[0]["weight_category"] == "premature_1000_1500g"
+    assert rows[0]["total_protein"] == pytest.approx(calculated["total_protein"])
+
+    response = client.get('/api/export/plans?format=csv&patient_id=XP001')
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].split(',') == list(web_server.EXPORT_FIELDS)
+    assert [line.split(',')[0] for line in lines[1:]] == created
+
+    assert client.get('/api/export/plans?patient_id=XP001&end=2000-01-01').get_data(as_text=True) == ""
+    assert client.get('/api/export/plans?format=xml').status_code == 400
+
+
+def wait_for_job(client, job_id, timeout=30):
+    """Poll a job until it has finished and return its status."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish: {job}")
+
+
+def test_background_jobs(client):
+    """Exports and recomputations run in the job workers and report their results."""
+    response = client.post('/api/jobs', json={'kind': 'export_plans', 'params': {'format': 'csv', 'patient_id': 'WP001'}})
+    assert response.status_code == 202
+    assert response.headers['Location'].endswith(response.get_json()["job_id"])
+    job = wait_for_job(client, response.get_json()["job_id"])
+    assert job["status"] == "succeeded" and job["progress"] == 1
+
+    result = client.get(job["result_url"])
+    assert result.mimetype == 'text/csv'
+    assert result.get_data() == client.get('/api/export/plans?format=csv&patient_id=WP001').get_data()
+
+    job_id = client.post('/api/jobs', json={'kind': 'recompute_plans', 'params': {'patient_id': 'WP001'}}).get_json()["job_id"]
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "succeeded"
+    recomputed = client.get(job["result_url"]).get_json()
+    assert recomputed["recomputed"] == plan_count(client)
+    assert recomputed["reference_version"] == web_server.nicu_app.calculator.reference_version
+
+    assert client.post(f'/api/jobs/{job_id}/cancel').status_code == 409
+    assert client.post('/api/jobs', json={'kind': 'delete_everything'}).status_code == 400
+    assert client.post('/api/jobs', json={'kind': 'export_plans', 'params': {'format': 'xml'}}).status_code == 400
+    assert client.get('/api/jobs/unknown').status_code == 404
+    assert client.get(f'/api/jobs/{job_id}/result').status_code == 200
+
+
+class RecordingContext:
+    """Job context for running a handler in the test process"""
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.updates = []
+
+    def progress(self, done, total=None, message=None):
+        self.updates.append((done, total))
+
+
+def test_recompute_job_uses_stored_inputs(client):
+    """The recompute job calculates from the rows' inputs, not from plans cached before another worker's change."""
+    plan_id = client.post('/api/nutrition_plan', json=PLAN).get_json()["plan_id"]
+    with web_server.app.app_context():
+        # Changed through another worker: this worker's cache still holds the old plan
+        row = web_server.NutritionPlanDB.query.filter_by(plan_id=plan_id).first()
+        row.tpn_volume = 40
+        web_server.db.session.commit()
+        context = RecordingContext(row.user_id)
+
+    result = web_server.recompute_plans_job({'patient_id': 'WP001'}, context)
+
+    with web_server.app.app_context():
+        row = web_server.NutritionPlanDB.query.filter_by(plan_id=plan_id).first()
+        assert row.total_parenteral_volume == 40 + PLAN['lipidVolume'] + PLAN['glucoseVolume']
+        assert web_server.nicu_app.nutrition_plans.get(plan_id).tpn_volume == PLAN['tpnVolume']
+    assert result["recomputed"] == plan_count(client)
+    assert context.updates[-1] == (result["recomputed"], result["recomputed"])
+
+
+def test_parenteral_suggestions(client):
+    """The ward can get volume suggestions for several patients in one request."""
+    response = client.post('/api/parenteral_suggestions', json=[
+        {'patientId': 'WP001'}, {'patientId': 'WP001', 'enteralVolume': 40}
+    ])
+    assert response.status_code == 200
+    suggestions = response.get_json()["suggestions"]
+    assert [suggestion["enteral_volume"] for suggestion in suggestions] == [0, 40]
+    assert all(suggestion["patient_id"] == 'WP001' for suggestion in suggestions)
+    assert suggestions[0]["total_fluid"] == pytest.approx(suggestions[0]["fluid_max"])
+
+    assert client.post('/api/parenteral_suggestions', json=[{'patientId': 'nobody'}]).status_code == 404
+    assert client.post('/api/parenteral_suggestions', json={'patientId': 'WP001'}).status_code == 400
+    assert client.post('/api/parenteral_suggestions', json=[{'patientId': 'WP001', 'enteralVolume': 'a'}]).status_code == 400
+
+
+def test_degenerate_composition_is_unprocessable(client, tmp_path):
+    """Suggestions for products that cannot meet protein and fat targets answer 422, not 500."""
+    from test_optimizer import degenerate_app
+    optimizer = web_server.nicu_app.optimizer
+    web_server.nicu_app.optimizer = degenerate_app(tmp_path).optimizer
+    try:
+        response = client.post('/api/parenteral_suggestions', json=[{'patientId': 'WP001'}])
+    finally:
+        web_server.nicu_app.optimizer = optimizer
+    assert response.status_code == 422
+    assert "cannot meet protein/fat targets independently" in response.get_json()["error"]
+
+
+def test_whatif_grid_does_not_store_plans(client):
+    """The what-if endpoint evaluates a volume grid without creating plans."""
+    before = plan_count(client)
+    response = client.post('/api/plan/whatif', json={
+        'patientId': 'WP001',
+        'tpnVolume': {'min': 20, 'max': 60, 'step': 1},
+        'lipidVolume': {'min': 5, 'max': 20, 'step': 0.5},
+        'glucoseVolume': {'min': 40, 'max': 100, 'step': 2},
+        'enteralVolume': 20, 'enteralFeedingType': 'Breast milk',
+        'feasibleLimit': 5
+    })
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["combinations"] == 41 * 31 * 31
+    assert result["feasible_count"] > 5 == len(result["feasible"]["tpn_volume"])
+    assert 0 < len(result["pareto"]) <= 20 and all(row["feasible"] for row in result["pareto"])
+    assert plan_count(client) == before
+
+    too_large = {'patientId': 'WP001', 'tpnVolume': {'min': 0, 'max': 100, 'step': 0.1},
+                 'lipidVolume': {'min': 0, 'max': 40, 'step': 0.1}}
+    assert client.post('/api/plan/whatif', json=too_large).status_code == 413
+    assert client.post('/api/plan/whatif', json={'patientId': 'nobody'}).status_code == 404
+    assert client.post('/api/plan/whatif', json={'patientId': 'WP001', 'tpnVolume': {'step': 0}}).status_code == 400
+    assert client.post('/api/plan/whatif', json={'patientId': 'WP001', 'target': 'most'}).status_code == 400
+
+
+def test_whatif_limits_are_capped(client):
+    """paretoLimit and feasibleLimit are capped at their maximum and must be positive integers."""
+    grid = {'patientId': 'WP001', 'tpnVolume': {'min': 20, 'max': 60, 'step': 1},
+            'lipidVolume': {'min': 5, 'max': 20, 'step': 0.5}, 'glucoseVolume': {'min': 40, 'max': 100, 'step': 2},
+            'enteralVolume': 20, 'enteralFeedingType': 'Breast milk', 'target': 'min'}
+    maximum = web_server.app.config['WHATIF_MAX_PARETO_LIMIT']
+    web_server.app.config['WHATIF_MAX_PARETO_LIMIT'] = 2
+    try:
+        response = client.post('/api/plan/whatif', json=dict(grid, paretoLimit=10 ** 9))
+    finally:
+        web_server.app.config['WHATIF_MAX_PARETO_LIMIT'] = maximum
+    assert response.status_code == 200
+    assert 0 < len(response.get_json()["pareto"]) <= 2
+
+    for limit in (0, -5, 2.5, '10', True):
+        assert client.post('/api/plan/whatif', json=dict(grid, paretoLimit=limit)).status_code == 400
+        assert client.post('/api/plan/whatif', json=dict(grid, feasibleLimit=limit)).status_code == 400
+
+    feasible_limit = web_server.app.config['WHATIF_FEASIBLE_LIMIT']
+    response = client.post('/api/plan/whatif', json=dict(grid, feasibleLimit=feasible_limit + 1, target='max'))
+    assert response.status_code == 200
+    assert len(response.get_json()["feasible"]) <= feasible_limit
+
+
+def test_patch_nutrition_plan(client):
+    """Changing one input of a plan stores the new values and reports what changed."""
+    plan_id = client.post('/api/nutrition_plan', json=PLAN).get_json()["plan_id"]
+    before = plan_count(client)
+
+    response = client.patch(f'/api/nutrition_plan/{plan_id}', json={'lipidVolume': 25})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["changes"]["fields"] == ["lipid_volume"]
+    assert result["changes"]["sources"] == ["lipid"]
+    assert "total_fat" in result["changes"]["calculated_values"]
+    assert "total_protein" not in result["changes"]["calculated_values"]
+
+    stored = client.get(f'/api/nutrition_plan/{plan_id}').get_json()
+    expected = client.post('/api/nutrition_plan', json=dict(PLAN, lipidVolume=25)).get_json()
+    assert stored["lipid_volume"] == 25
+    assert stored["calculated_values"]["total_fat"] == expected["calculated_values"]["total_fat"]
+    assert stored["recommendations"] == expected["recommendations"]
+    assert plan_count(client) == before + 1
+
+    assert client.patch(f'/api/nutrition_plan/{plan_id}', json={'patientId': 'WP002'}).status_code == 400
+    assert client.patch(f'/api/nutrition_plan/{plan_id}', json={'lipidVolume': 'a'}).status_code == 400
+    assert client.patch('/api/nutrition_plan/unknown', json={'lipidVolume': 1}).status_code == 404
+
+
+def test_live_recompute_returns_changed_results(client):
+    """Live recomputes return only what changed and drop stale requests."""
+    patient = {'gestationalAge': 28, 'birthWeight': 950, 'postnatalAge': 3, 'phototherapy': 'Single'}
+    plan = {key: value for key, value in PLAN.items() if key != 'patientId'}
+
+    def recompute(seq, base_seq, **changes):
+        return client.post('/api/plan/recompute', json={
+            'draftId': 'editor-1', 'seq': seq, 'baseSeq': base_seq,
+            'patient': patient, 'plan': dict(plan, **changes)
+        })
+
+    first = recompute(1, None).get_json()
+    assert first["full"] and first["seq"] == 1
+    assert first["fluid_requirements"] == {"min": 130, "max": 160}
+    stored = client.post('/api/nutrition_plan', json=PLAN).get_json()
+    assert first["calculated_values"] == stored["calculated_values"]
+
+    second = recompute(2, 1, lipidVolume=25).get_json()
+    assert not second["full"]
+    assert set(second["calculated_values"]) == {"total_energy", "total_fat", "total_parenteral_volume", "total_fluid"}
+    assert "feeding_schedule" not in second and "fluid_requirements" not in second
+
+    assert recompute(2, 1, lipidVolume=30).status_code == 409
+    # A client that missed the last response gets everything again
+    assert recompute(3, 1, lipidVolume=30).get_json()["full"]
+    assert client.post('/api/plan/recompute', json={'seq': 4, 'plan': plan}).status_code == 400
+
+
+def test_app_page_uses_live_recompute(client):
+    """The served page recomputes edits on the server, sending plan keys the endpoint accepts."""
+    page = client.get('/app').get_data(as_text=True)
+    assert "fetch('/api/plan/recompute'" in page
+
+    read_inputs = re.search(r'function readPlanInputs\(\) \{.*?\n            \}', page, re.S).group(0)
+    inputs = dict(re.findall(r"(\w+): document\.getElementById\('(\w+)'\)\.value", read_inputs))
+    assert set(inputs) == {key for key in PLAN if key != 'patientId'} | {'tpnType', 'lipidType', 'glucoseConcentration', 'bmfConcentration'}
+    assert all(f'id="{element_id}"' in page for element_id in inputs.values())
+
+    # Form values arrive as strings
+    plan = {key: str(PLAN.get(key, '')) for key in inputs}
+    plan.update(tpnType='NICU-mix', lipidType='SMOF_20%', glucoseConcentration='10%', bmfConcentration='0')
+    response = client.post('/api/plan/recompute', json={
+        'draftId': 'page-smoke', 'seq': 1, 'baseSeq': None,
+        'patient': {'patientId': 'WP001', 'gestationalAge': '28', 'birthWeight': '950', 'currentWeight': '',
+                    'postnatalAge': '3', 'phototherapy': 'Single', 'clinicalCondition': 'Normal'},
+        'plan': plan
+    })
+    assert response.status_code == 200
+    assert response.get_json()["full"]
+
+
+def test_metrics_endpoint(client):
+    """/metrics reports request latency per route, calculator calls and commit timings."""
+    client.get('/api/patient/WP001')
+    client.post('/api/nutrition_plan', json=PLAN)
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE nicu_http_request_duration_seconds histogram' in text
+    assert 'nicu_http_request_duration_seconds_count{route="/api/patient/<patient_id>",method="GET",status="200"}' in text
+    assert 'nicu_http_request_duration_seconds_bucket{route="/api/nutrition_plan",method="POST",status="200",le="+Inf"}' in text
+    # The request for /metrics itself is still being handled
+    assert 'nicu_http_requests_in_flight{route="/metrics",method="GET"} 1' in text
+    assert 'nicu_calculator_calls_total{operation="calculate_nutrition_values"}' in text
+    assert 'nicu_db_commit_duration_seconds_count{outcome="committed"}' in text
+
+
+def test_traced_plan_creation(client):
+    """A sampled POST /api/nutrition_plan exports nested spans for the hot path under the caller's trace ID."""
+    trace_file = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+    exporter = JsonLinesExporter(trace_file)
+    tracer.configure(0.0, exporter)
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    try:
+        response = client.post('/api/nutrition_plan', json=PLAN,
+                               headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'})
+        # Not sampled by the caller, and the sample rate is 0
+        unsampled = client.post('/api/nutrition_plan', json=PLAN)
+        exporter.flush()
+    finally:
+        tracer.configure(0.0, None)
+
+    assert response.status_code == 200
+    assert response.headers['X-Trace-Id'] == trace_id
+    # Every request gets a trace ID for its log lines, but only sampled ones are exported
+    assert unsampled.headers['X-Trace-Id'] != trace_id
+    with open(trace_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1
+    spans = lines[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {span["name"]: span for span in spans}
+    root = by_name["POST /api/nutrition_plan"]
+    assert root["parentSpanId"] == '00f067aa0ba902b7'
+    assert {"key": "http.status_code", "value": {"intValue": "200"}} in root["attributes"]
+    assert all(span["traceId"] == trace_id for span in spans)
+
+    evaluate = by_name["NICUFluidApp.evaluate_plan"]
+    assert evaluate["parentSpanId"] == root["spanId"]
+    for name in ("NutritionCalculator.calculate_nutrition_values", "NutritionCalculator.calculate_fluid_requirements",
+                 "RecommendationEngine.generate_recommendations", "NICUFluidApp._build_feeding_schedule"):
+        assert by_name[name]["traceId"] == trace_id
+    for name in ("NICUFluidApp.create_nutrition_plan", "db.commit", "serialize"):
+        assert by_name[name]["parentSpanId"] == root["spanId"]
+
+
+def test_admin_request_profiling(client):
+    """An admin with a signed token gets one request profiled and can download the profile."""
+    token = client.post('/api/admin/profiles/token', json={'path': '/api/patient/WP001'}).get_json()["token"]
+    response = client.get('/api/patient/WP001', headers={'X-Profile-Token': token})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+
+    # Profiles are rate limited, and a token only covers the path it was signed for
+    again = client.get(f'/api/patient/WP001?profile_token={token}')
+    assert again.status_code == 200
+    assert again.headers['X-Profile-Refused'] == 'rate_limited'
+    assert client.get('/api/patients', headers={'X-Profile-Token': token}).headers['X-Profile-Refused'] == 'invalid_token'
+
+    profiles = client.get('/api/admin/profiles').get_json()["profiles"]
+    assert profiles[0]["id"] == profile_id
+    assert profiles[0]["route"] == '/api/patient/<patient_id>'
+    assert profiles[0]["status"] == 200
+
+    stats_file = os.path.join(tempfile.mkdtemp(), 'profile.pstats')
+    with open(stats_file, 'wb') as f:
+        f.write(client.get(profiles[0]["files"]["pstats"]).data)
+    functions = {name for _, _, name in pstats.Stats(stats_file).stats}
+    assert 'get_patient' in functions
+    assert client.get(profiles[0]["files"]["collapsed"]).status_code == 200
+    assert client.get('/api/admin/profiles/..%2Fsecret.pstats').status_code == 404
+
+
+def test_memory_report(client):
+    """The memory report of this worker counts live patients and plans and the store sizes."""
+    client.post('/api/nutrition_plan', json=PLAN)
+    report = client.get('/api/admin/memory').get_json()
+    assert report["tracemalloc"] is False
+    worker = next(worker for worker in report["workers"] if worker["pid"] == os.getpid())
+    assert worker["rss_bytes"] > 0
+    assert worker["objects"]["NutritionPlan"] >= worker["stores"]["nutrition_plans"] >= 1
+    assert worker["objects"]["Patient"] >= 1
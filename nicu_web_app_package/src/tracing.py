@@ -0,0 +1,372 @@
+"""
+NICU Fluid Management App - Request Tracing
+"""
+
+import contextvars
+import fcntl
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+
+SERVICE_NAME = "nicu-fluid-app"
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# Spans kept per trace; further spans are counted on the root span instead
+MAX_SPANS_PER_TRACE = 1000
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# Innermost open span of the sampled trace being handled, or None
+_current_span = contextvars.ContextVar("nicu_current_span", default=None)
+
+
+def new_trace_id():
+    return f"{random.getrandbits(128):032x}"
+
+
+def new_span_id():
+    return f"{random.getrandbits(64):016x}"
+
+
+class Trace:
+    """
+    The spans of one sampled request, exported together when its root span ends.
+    """
+    __slots__ = ("trace_id", "exporter", "spans", "dropped_spans")
+
+    def __init__(self, trace_id, exporter):
+        self.trace_id = trace_id
+        self.exporter = exporter
+        self.spans = []
+        self.dropped_spans = 0
+
+
+class Span:
+    """
+    A timed operation within a trace. Used as a context manager it becomes
+    the parent of the spans started inside it.
+    """
+    __slots__ = ("trace", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "is_root", "_token")
+
+    def __init__(self, trace, name, parent_span_id=None, kind=SPAN_KIND_INTERNAL, attributes=None, is_root=False):
+        self.trace = trace
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = STATUS_UNSET
+        self.is_root = is_root
+        self.end_ns = None
+        self._token = None
+        if len(trace.spans) < MAX_SPANS_PER_TRACE:
+            trace.spans.append(self)
+        else:
+            trace.dropped_spans += 1
+        self.start_ns = time.time_ns()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_status(self, status):
+        self.status = status
+
+    def end(self, error=None):
+        """End the span, marking it as failed if error is given; ending the root span exports the trace."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.attributes["error.message"] = str(error)
+        if self.is_root:
+            if self.trace.dropped_spans:
+                self.attributes["trace.dropped_spans"] = self.trace.dropped_spans
+            self.trace.exporter.export(self.trace)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+
+class _NoopSpan:
+    """
+    Stands in for spans outside a sampled trace, so instrumented code costs one context variable lookup.
+    """
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_status(self, status):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attributes):
+    """
+    Start a child span of the current span.
+
+    Returns:
+        Span to use as a context manager (or to end()), or NOOP_SPAN if the request is not sampled
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes=attributes)
+
+
+def traced(name=None):
+    """
+    Decorator running the function in a child span of the current span,
+    named after the function's qualified name unless a name is given.
+    """
+    def decorate(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return function(*args, **kwargs)
+            with Span(parent.trace, span_name, parent.span_id):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Tracer:
+    """
+    Starts the root span of sampled requests. The sampling decision is made
+    once per request (head-based): a caller's W3C traceparent decision is kept,
+    otherwise sample_rate of the requests are traced.
+    """
+    def __init__(self, sample_rate=0.0, exporter=None):
+        self.configure(sample_rate, exporter)
+
+    def configure(self, sample_rate, exporter):
+        """
+        Set the fraction of requests to trace and where their traces go.
+
+        Args:
+            sample_rate: Fraction of requests without a caller's decision to trace, 0 to 1
+            exporter: Object with export(trace), or None to disable tracing
+        """
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+        self.exporter = exporter
+
+    def start_trace(self, name, trace_id, parent_span_id=None, sampled=None, **attributes):
+        """
+        Start the root span of a request and make it the current span.
+
+        Args:
+            name: Span name
+            trace_id: 32-digit hexadecimal trace ID
+            parent_span_id: Span ID of the caller, if it sent one
+            sampled: The caller's sampling decision, or None to decide here
+
+        Returns:
+            Root Span, or NOOP_SPAN if the request is not sampled
+        """
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled or self.exporter is None:
+            return NOOP_SPAN
+        root = Span(Trace(trace_id, self.exporter), name, parent_span_id, SPAN_KIND_SERVER, attributes, is_root=True)
+        _current_span.set(root)
+        return root
+
+    def end_trace(self, root, error=None):
+        """End a root span started by start_trace and export its trace."""
+        _current_span.set(None)
+        root.end(error)
+
+
+def parse_traceparent(header):
+    """
+    Read a W3C traceparent header.
+
+    Returns:
+        Tuple of (trace ID, parent span ID, sampled), or (None, None, None) if missing or invalid
+    """
+    match = TRACEPARENT.match(header or "")
+    if not match or match.group(1) == "0" * 32:
+        return None, None, None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def otlp_value(value):
+    """Convert an attribute value to an OTLP/JSON AnyValue"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_trace(trace, resource_attributes):
+    """
+    Convert the finished spans of a trace to an OTLP/JSON ExportTraceServiceRequest.
+    """
+    spans = []
+    for item in trace.spans:
+        if item.end_ns is None:
+            continue
+        entry = {
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": item.kind,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns),
+            "attributes": otlp_attributes(item.attributes),
+            "status": {"code": item.status},
+        }
+        if item.parent_span_id:
+            entry["parentSpanId"] = item.parent_span_id
+        spans.append(entry)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": otlp_attributes(resource_attributes)},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]
+    }
+
+
+class JsonLinesExporter:
+    """
+    Appends each trace as one OTLP/JSON line to a file, as read by the
+    OpenTelemetry Collector's otlpjsonfile receiver. Traces are queued and
+    written by a background thread; when the queue is full they are dropped
+    and counted. Each line is written with a single append, so processes can
+    share the file. A line that would take the file past max_bytes first
+    rotates it to path.1 ... path.<backup_count>, under a lock file shared
+    by the processes; the others reopen the new file on their next write.
+    """
+    def __init__(self, path, capacity=1000, max_bytes=0, backup_count=0):
+        """
+        Initialize the exporter.
+
+        Args:
+            path: JSON-lines file to append to
+            capacity: Traces queued in this process before new ones are dropped
+            max_bytes: Size at which the file is rotated, or 0 to never rotate it
+            backup_count: Number of rotated files to keep
+        """
+        self.path = path
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._start_process()
+        # A forked process gets its own queue and writer thread
+        os.register_at_fork(after_in_child=self._start_process)
+
+    def _start_process(self):
+        self.queue = queue.Queue(self.capacity)
+        self.dropped = 0
+        self.resource_attributes = {"service.name": SERVICE_NAME, "process.pid": os.getpid()}
+        threading.Thread(target=self._write_traces, name="trace-writer", daemon=True).start()
+
+    def export(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5):
+        """Wait until the queued traces have been written."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _rotate(self, fd, size):
+        """
+        Make room for size more bytes: reopen the file if another process has
+        rotated it, otherwise rotate it. The given descriptor stays open if this fails.
+
+        Returns:
+            File descriptor to write to
+        """
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(fd).st_ino
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                new_fd = self._open()
+                current_size = os.fstat(new_fd).st_size
+                if current_size == 0 or current_size + size <= self.max_bytes:
+                    os.close(fd)
+                    return new_fd
+                os.close(new_fd)
+            if self.backup_count > 0:
+                for number in range(self.backup_count - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{number}"):
+                        os.replace(f"{self.path}.{number}", f"{self.path}.{number + 1}")
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.unlink(self.path)
+            new_fd = self._open()
+            os.close(fd)
+            return new_fd
+
+    def _write_traces(self):
+        fd = None
+        while True:
+            trace = self.queue.get()
+            try:
+                if fd is None:
+                    fd = self._open()
+                line = (json.dumps(otlp_trace(trace, self.resource_attributes), separators=(",", ":")) + "\n").encode("utf-8")
+                if self.max_bytes > 0:
+                    current_size = os.fstat(fd).st_size
+                    if current_size > 0 and current_size + len(line) > self.max_bytes:
+                        fd = self._rotate(fd, len(line))
+                os.write(fd, line)
+            except (OSError, TypeError, ValueError):
+                self.dropped += 1
+            finally:
+                self.queue.task_done()
+
+
+# Tracer of this process, configured by the web server
+tracer = Tracer()
@@ -0,0 +1,224 @@
+"""
+NICU Fluid Management App - File-Based User Store
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore:
+    """
+    Username/password store kept in a JSON file, safe for concurrent processes.
+
+    Users are kept in an in-memory index that is only rebuilt when the files change
+    on disk. New users are appended to a journal next to the JSON file; once the
+    journal holds compact_threshold entries it is merged into the JSON file with
+    an atomic write-rename. All writes happen under an exclusive file lock.
+    """
+    def __init__(self, users_file, compact_threshold=100):
+        """
+        Initialize the store.
+
+        Args:
+            users_file: Path to the JSON file with {username: password}
+            compact_threshold: Number of journal entries that triggers a compaction
+        """
+        self.users_file = users_file
+        self.journal_file = f"{users_file}.journal"
+        self.lock_file = f"{users_file}.lock"
+        self.compact_threshold = compact_threshold
+
+        self._thread_lock = threading.Lock()
+        self._users = {}
+        self._signature = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def get(self, username):
+        """
+        Get the password of a user.
+
+        Args:
+            username: Name of the user
+
+        Returns:
+            Stored password, or None if the user does not exist
+        """
+        with self._thread_lock:
+            self._refresh()
+            return self._users.get(username)
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __len__(self):
+        with self._thread_lock:
+            self._refresh()
+            return len(self._users)
+
+    def add(self, username, password):
+        """
+        Add a user unless the username is already taken.
+
+        Args:
+            username: Name of the new user
+            password: Password of the new user
+
+        Returns:
+            True if the user was added, False if the username already exists
+        """
+        with self._thread_lock, self._file_lock(fcntl.LOCK_EX):
+            self._refresh(locked=True)
+            if username in self._users:
+                return False
+
+            line = json.dumps({"username": username, "password": password}) + "\n"
+            with open(self.journal_file, 'ab') as f:
+                # Terminate a line left incomplete by an interrupted write
+                if f.tell() > 0 and not self._journal_ends_with_newline():
+                    line = "\n" + line
+                f.write(line.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            self._users[username] = password
+
+            # Read our own entry back so the index stays in step with the journal
+            self._refresh(locked=True)
+            if self._journal_entries >= self.compact_threshold:
+                self._compact()
+            return True
+
+    def compact(self):
+        """
+        Merge the journal into the JSON file.
+        """
+        with self._thread_lock, self._file_lock(fcntl.LOCK_EX):
+            self._refresh(locked=True)
+            self._compact()
+
+    @contextmanager
+    def _file_lock(self, operation):
+        """
+        Hold an inter-process lock on the lock file.
+        """
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _stat_files(self):
+        """
+        Get the (mtime, inode, size) signature of the JSON file and the journal.
+        """
+        signature = []
+        for path in (self.users_file, self.journal_file):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_ino, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _refresh(self, locked=False):
+        """
+        Bring the index up to date with the files on disk.
+
+        When only the journal grew, just the new journal lines are read.
+        Must be called with the thread lock held.
+
+        Args:
+            locked: True if the caller already holds the file lock
+        """
+        signature = self._stat_files()
+        if signature == self._signature:
+            return
+
+        if not locked:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._refresh(locked=True)
+            return
+
+        # The files may have changed while waiting for the lock
+        signature = self._stat_files()
+        users_stat, journal_stat = signature
+        if self._signature is not None and users_stat == self._signature[0] and \
+                journal_stat is not None and self._signature[1] is not None and \
+                journal_stat[1] == self._signature[1][1] and journal_stat[2] >= self._journal_offset:
+            self._read_journal()
+        else:
+            self._users = self._read_users_file()
+            self._journal_offset = 0
+            self._journal_entries = 0
+            self._read_journal()
+        self._signature = signature
+
+    def _read_users_file(self):
+        """
+        Read the compacted JSON file.
+        """
+        try:
+            with open(self.users_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _read_journal(self):
+        """
+        Apply journal lines written since the last read.
+        """
+        try:
+            with open(self.journal_file, 'rb') as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Incomplete line from a write in progress or an interrupted write
+                        break
+                    self._journal_offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping invalid line in {self.journal_file}")
+                        continue
+                    self._users.setdefault(entry["username"], entry["password"])
+                    self._journal_entries += 1
+        except FileNotFoundError:
+            pass
+
+    def _journal_ends_with_newline(self):
+        """
+        Check whether the last journal line is complete.
+        """
+        with open(self.journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _compact(self):
+        """
+        Write the index to the JSON file atomically and empty the journal.
+        Must be called with the exclusive file lock held.
+        """
+        tmp_file = f"{self.users_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self._users, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.users_file)
+
+        with open(self.journal_file, 'w'):
+            pass
+
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._signature = self._stat_files()
+        logger.info(f"Compacted user store {self.users_file} ({len(self._users)} users)")
@@ -1,10 +1,16 @@
 import os
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, Response, stream_with_context, send_file
 import json
+import base64
+import csv
+import io
 from datetime import date
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import load_only
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+import time
 import uuid
 
 # Initialize Flask app
@@ -14,6 +20,72 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-testing')
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///nicu_app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Maximum number of plans accepted by the batch plan endpoint
+app.config['MAX_PLAN_BATCH_SIZE'] = int(os.environ.get('MAX_PLAN_BATCH_SIZE', 100))
+
+# Size caps and time-to-live (seconds) of the in-memory patient and plan stores
+app.config['PATIENT_STORE_SIZE'] = int(os.environ.get('PATIENT_STORE_SIZE', 1000))
+app.config['NUTRITION_PLAN_STORE_SIZE'] = int(os.environ.get('NUTRITION_PLAN_STORE_SIZE', 5000))
+app.config['STORE_TTL_SECONDS'] = float(os.environ.get('STORE_TTL_SECONDS', 3600))
+
+# Page sizes for the listing endpoints
+app.config['DEFAULT_PAGE_SIZE'] = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+# Seconds clients may cache reference data before revalidating it with the ETag
+app.config['REFERENCE_DATA_MAX_AGE'] = int(os.environ.get('REFERENCE_DATA_MAX_AGE', 3600))
+
+# Rows fetched from the database cursor per chunk of a bulk export
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+# Plans being edited live kept per worker for incremental recomputes, and their time-to-live (seconds)
+app.config['DRAFT_STORE_SIZE'] = int(os.environ.get('DRAFT_STORE_SIZE', 1000))
+app.config['DRAFT_TTL_SECONDS'] = float(os.environ.get('DRAFT_TTL_SECONDS', 3600))
+
+# Largest volume grid and number of feasible combinations listed by the what-if endpoint
+app.config['WHATIF_MAX_COMBINATIONS'] = int(os.environ.get('WHATIF_MAX_COMBINATIONS', 100000))
+app.config['WHATIF_FEASIBLE_LIMIT'] = int(os.environ.get('WHATIF_FEASIBLE_LIMIT', 1000))
+# Most Pareto-best combinations a what-if request may ask for (each one costs a pass over the feasible grid)
+app.config['WHATIF_MAX_PARETO_LIMIT'] = int(os.environ.get('WHATIF_MAX_PARETO_LIMIT', 100))
+
+# SQLite database of the background job queue and number of job worker processes
+app.config['JOB_DATABASE'] = os.environ.get('JOB_DATABASE', 'nicu_jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Hours finished jobs and their result files are kept
+app.config['JOB_RETENTION_HOURS'] = float(os.environ.get('JOB_RETENTION_HOURS', 24))
+
+# Directory where each worker process writes its metrics for /metrics, and how often (seconds)
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', 'nicu_metrics')
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', 1.0))
+
+# Requests taking longer than this many seconds are logged as slow
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+
+# Log directory, log records queued per worker before new ones are dropped, and request log lines per second per worker
+app.config['LOG_DIR'] = os.environ.get('LOG_DIR', 'logs')
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+app.config['LOG_REQUEST_RATE'] = int(os.environ.get('LOG_REQUEST_RATE', 50))
+
+# Fraction of requests traced (0 disables tracing), the OTLP JSON-lines file their spans are appended to,
+# its size in bytes at which it is rotated (0 never rotates it) and the number of rotated files kept
+app.config['TRACE_SAMPLE_RATE'] = float(os.environ.get('TRACE_SAMPLE_RATE', 0.0))
+app.config['TRACE_FILE'] = os.environ.get('TRACE_FILE', os.path.join(app.config['LOG_DIR'], 'traces.jsonl'))
+app.config['TRACE_MAX_BYTES'] = int(os.environ.get('TRACE_MAX_BYTES', 10485760))
+app.config['TRACE_BACKUP_COUNT'] = int(os.environ.get('TRACE_BACKUP_COUNT', 10))
+
+# Admin-requested request profiles: directory, profiles kept, seconds between profiles, token lifetime and sampling interval
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.config['LOG_DIR'], 'profiles'))
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 20))
+app.config['PROFILE_MIN_INTERVAL_SECONDS'] = float(os.environ.get('PROFILE_MIN_INTERVAL_SECONDS', 10.0))
+app.config['PROFILE_TOKEN_MAX_AGE'] = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 600))
+app.config['PROFILE_SAMPLE_INTERVAL'] = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.001))
+
+# Per-worker memory reports: directory, seconds between reports, tracemalloc frames per allocation (0 disables) and allocation sites reported
+app.config['MEMORY_DIR'] = os.environ.get('MEMORY_DIR', os.path.join(app.config['METRICS_DIR'], 'memory'))
+app.config['MEMORY_REPORT_SECONDS'] = float(os.environ.get('MEMORY_REPORT_SECONDS', 60.0))
+app.config['MEMORY_TRACEMALLOC_FRAMES'] = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', 0))
+app.config['MEMORY_TOP_N'] = int(os.environ.get('MEMORY_TOP_N', 20))
 db = SQLAlchemy(app)
 
 # Initialize login manager
@@ -22,13 +94,47 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 # Import our application modules
-from models import Patient, NutritionPlan
+from models import Patient, NutritionPlan, PLAN_INPUT_FIELDS
 from calculator import NutritionCalculator, RecommendationEngine
 from app import NICUFluidApp
+from store import BoundedStore
+from http_cache import ReferenceResponseCache
+from migrations import run_migrations, CALCULATED_VALUE_COLUMNS
+from jobs import JobQueue, WorkerPool, SUCCEEDED, FINISHED_STATUSES
+from optimizer import CompositionError, axis_size, volume_axis
+from monitoring import PerformanceMonitoring, RequestTracing, setup_logging
+from metrics import count_calls
+from tracing import JsonLinesExporter, span, tracer
+from profiling import ProfileStore, RequestProfiler, PROFILE_KINDS
+from memory import MemoryMonitor
 
-# Initialize NICU Fluid App
-data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
-nicu_app = NICUFluidApp(data_dir)
+def is_admin():
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+# Profiles of single requests, taken when an admin asks for them with a signed token
+request_profiler = RequestProfiler(
+    ProfileStore(app.config['PROFILE_DIR'], keep=app.config['PROFILE_KEEP']),
+    app.config['SECRET_KEY'],
+    authorize=is_admin,
+    min_interval=app.config['PROFILE_MIN_INTERVAL_SECONDS'],
+    token_max_age=app.config['PROFILE_TOKEN_MAX_AGE'],
+    sample_interval=app.config['PROFILE_SAMPLE_INTERVAL']
+)
+
+# Request latency and in-flight metrics, served on /metrics, and on-demand request profiles
+metrics = PerformanceMonitoring.register(app, profiler=request_profiler)
+
+# JSON log lines, written by one log writer process for all workers
+setup_logging(app, metrics)
+
+# Spans of sampled requests, appended to TRACE_FILE
+if app.config['TRACE_SAMPLE_RATE'] > 0:
+    tracer.configure(app.config['TRACE_SAMPLE_RATE'], JsonLinesExporter(
+        app.config['TRACE_FILE'],
+        max_bytes=app.config['TRACE_MAX_BYTES'],
+        backup_count=app.config['TRACE_BACKUP_COUNT']
+    ))
+RequestTracing.register(app, tracer)
 
 # Database models
 class User(UserMixin, db.Model):
@@ -57,6 +163,11 @@ class PatientDB(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
     nutrition_plans = db.relationship('NutritionPlanDB', backref='patient', lazy=True)
+    
+    __table_args__ = (
+        # Patient listing per user, newest first
+        db.Index('ix_patient_db_user_created', 'user_id', 'created_at', 'id'),
+    )
 
 class NutritionPlanDB(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -77,15 +188,262 @@ class NutritionPlanDB(db.Model):
     bmf_concentration = db.Column(db.Float)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
-    # Calculated values stored as JSON
+    # Calculated values, stored as columns so they can be aggregated in SQL
+    total_energy = db.Column(db.Float)
+    total_protein = db.Column(db.Float)
+    total_carbohydrate = db.Column(db.Float)
+    total_fat = db.Column(db.Float)
+    total_sodium = db.Column(db.Float)
+    total_potassium = db.Column(db.Float)
+    total_calcium = db.Column(db.Float)
+    total_phosphate = db.Column(db.Float)
+    total_magnesium = db.Column(db.Float)
+    glucose_infusion_rate = db.Column(db.Float)
+    total_parenteral_volume = db.Column(db.Float)
+    total_fluid = db.Column(db.Float)
+    reference_version = db.Column(db.String(16))
+    weight_category = db.Column(db.String(30))
+    
+    # Calculated values of plans saved before the columns above existed, as JSON
     calculated_values = db.Column(db.Text)
     recommendations = db.Column(db.Text)
     feeding_schedule = db.Column(db.Text)
+    
+    __table_args__ = (
+        # Plans of a patient by date, and plan listing per patient, newest first
+        db.Index('ix_nutrition_plan_db_patient_user_date', 'patient_id', 'user_id', 'date'),
+        db.Index('ix_nutrition_plan_db_patient_user_created', 'patient_id', 'user_id', 'created_at', 'id'),
+        # Reports over a date range
+        db.Index('ix_nutrition_plan_db_user_date', 'user_id', 'date'),
+        # Recompute jobs walking all plans of a user
+        db.Index('ix_nutrition_plan_db_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+def stored_calculated_values(plan):
+    """Get the calculated values of a plan row as a dictionary"""
+    if plan.total_energy is None:
+        return json.loads(plan.calculated_values) if plan.calculated_values else {}
+    values = {column: getattr(plan, column) for column in CALCULATED_VALUE_COLUMNS}
+    values['reference_version'] = plan.reference_version
+    return values
+
+# In-memory patient and plan stores, backed by the database
+def load_patient(patient_id):
+    """Rebuild a Patient from the database, or None if it does not exist"""
+    row = PatientDB.query.filter_by(patient_id=patient_id).first()
+    if row is None:
+        return None
+    return patient_from_row(row)
+
+def patient_from_row(row):
+    """Build a Patient from its database row"""
+    return Patient(
+        row.patient_id,
+        row.gestational_age_at_birth,
+        row.birth_weight,
+        row.current_weight,
+        row.postnatal_age,
+        row.phototherapy,
+        row.clinical_condition
+    )
+
+def load_nutrition_plan(plan_id):
+    """Rebuild a NutritionPlan from the database, or None if it does not exist"""
+    row = NutritionPlanDB.query.filter_by(plan_id=plan_id).first()
+    if row is None:
+        return None
+    return nutrition_plan_from_row(row)
+
+def nutrition_plan_from_row(row):
+    """Build a NutritionPlan from the inputs stored on its database row"""
+    return NutritionPlan(
+        row.plan_id,
+        row.patient_id,
+        row.date,
+        total_fluid_target=row.total_fluid_target,
+        enteral_volume=row.enteral_volume,
+        tpn_type=row.tpn_type,
+        tpn_volume=row.tpn_volume,
+        lipid_type=row.lipid_type,
+        lipid_volume=row.lipid_volume,
+        glucose_concentration=row.glucose_concentration,
+        glucose_volume=row.glucose_volume,
+        enteral_feeding_type=row.enteral_feeding_type,
+        enteral_feeding_frequency=row.enteral_feeding_frequency,
+        bmf_concentration=row.bmf_concentration
+    )
+
+# Initialize NICU Fluid App
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+nicu_app = NICUFluidApp(
+    data_dir,
+    patient_store=BoundedStore(
+        maxsize=app.config['PATIENT_STORE_SIZE'],
+        ttl=app.config['STORE_TTL_SECONDS'],
+        loader=load_patient
+    ),
+    nutrition_plan_store=BoundedStore(
+        maxsize=app.config['NUTRITION_PLAN_STORE_SIZE'],
+        ttl=app.config['STORE_TTL_SECONDS'],
+        loader=load_nutrition_plan
+    ),
+    draft_store=BoundedStore(
+        maxsize=app.config['DRAFT_STORE_SIZE'],
+        ttl=app.config['DRAFT_TTL_SECONDS']
+    )
+)
+
+# Memory of each worker: RSS, live patients and plans, store sizes and tracemalloc growth
+memory_monitor = MemoryMonitor(
+    app.config['MEMORY_DIR'],
+    interval=app.config['MEMORY_REPORT_SECONDS'],
+    top_n=app.config['MEMORY_TOP_N'],
+    tracemalloc_frames=app.config['MEMORY_TRACEMALLOC_FRAMES'],
+    counted_types=(Patient, NutritionPlan),
+    sizes=lambda: {
+        'patients': len(nicu_app.patients),
+        'nutrition_plans': len(nicu_app.nutrition_plans),
+        'drafts': len(nicu_app.drafts)
+    }
+)
+
+# Count calculator calls per operation
+calculator_calls = metrics.counter(
+    'nicu_calculator_calls_total', 'Calls of the nutrition calculator', ('operation',)
+)
+count_calls(
+    nicu_app.calculator,
+    ('calculate_fluid_requirements', 'calculate_nutrition_values', 'calculate_nutrition_values_batch',
+     'calculate_nutrition_columns'),
+    calculator_calls
+)
+
+# Time database commits, including the flush that precedes them
+db_commit_duration = metrics.histogram(
+    'nicu_db_commit_duration_seconds', 'Time to flush and commit a database session', ('outcome',)
+)
+
+@event.listens_for(db.session, 'before_commit')
+def start_commit_timer(session):
+    session.info['commit_started'] = time.perf_counter()
+    session.info['commit_span'] = span('db.commit')
+
+@event.listens_for(db.session, 'after_commit')
+def record_commit_time(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        db_commit_duration.observe(time.perf_counter() - started, outcome='committed')
+        session.info.pop('commit_span').end()
+
+@event.listens_for(db.session, 'after_rollback')
+def record_failed_commit_time(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        db_commit_duration.observe(time.perf_counter() - started, outcome='failed')
+        session.info.pop('commit_span').end(error='rolled back')
+
+# Pre-serialized reference data responses
+reference_responses = ReferenceResponseCache(nicu_app.calculator, max_age=app.config['REFERENCE_DATA_MAX_AGE'])
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# Fields that can be selected on the listing endpoints, and the fields returned by default
+PATIENT_LIST_FIELDS = (
+    'patient_id', 'gestational_age_at_birth', 'birth_weight', 'current_weight',
+    'postnatal_age', 'phototherapy', 'clinical_condition', 'created_at'
+)
+PLAN_LIST_FIELDS = (
+    'plan_id', 'patient_id', 'date', 'total_fluid_target', 'enteral_volume', 'tpn_type', 'tpn_volume',
+    'lipid_type', 'lipid_volume', 'glucose_concentration', 'glucose_volume', 'created_at',
+    'weight_category'
+) + CALCULATED_VALUE_COLUMNS
+PLAN_LIST_DEFAULT_FIELDS = ('plan_id', 'date', 'total_fluid_target', 'created_at')
+
+# Columns of the bulk plan export, and the media type of each export format
+EXPORT_FIELDS = (
+    'plan_id', 'patient_id', 'date', 'total_fluid_target', 'enteral_volume', 'tpn_type', 'tpn_volume',
+    'lipid_type', 'lipid_volume', 'glucose_concentration', 'glucose_volume', 'enteral_feeding_type',
+    'enteral_feeding_frequency', 'bmf_concentration', 'weight_category', 'reference_version'
+) + CALCULATED_VALUE_COLUMNS
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def encode_cursor(row):
+    """Create an opaque pagination cursor pointing after a row"""
+    return base64.urlsafe_b64encode(str(row.id).encode()).decode()
+
+def decode_cursor(cursor):
+    """Get the row ID from a pagination cursor"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+def page_params(allowed_fields, default_fields):
+    """Read limit, cursor and fields from the query string"""
+    limit = request.args.get('limit', app.config['DEFAULT_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    
+    cursor = request.args.get('cursor')
+    after_id = decode_cursor(cursor) if cursor else None
+    
+    fields = request.args.get('fields')
+    if fields:
+        fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = default_fields
+    
+    return limit, after_id, fields
+
+def date_range_params():
+    """Read the optional start and end dates (ISO format) from the query string"""
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start = date.fromisoformat(start) if start else None
+    end = date.fromisoformat(end) if end else None
+    if start and end and start > end:
+        raise ValueError("start must not be after end")
+    return start, end
+
+def serialize_row(row, fields):
+    """Convert the selected fields of a database row to JSON-compatible values"""
+    result = {}
+    for field in fields:
+        value = getattr(row, field)
+        result[field] = value.isoformat() if isinstance(value, date) else value
+    return result
+
+def keyset_page(query, model, limit, after_id, fields):
+    """
+    Get one page of rows, newest first, ordered by (created_at, id).
+    The cursor holds the ID of the last row of the previous page; its created_at
+    is looked up in the same query so the comparison uses the stored value.
+    """
+    if after_id is not None:
+        anchor_created_at = db.session.query(model.created_at).filter(model.id == after_id).scalar_subquery()
+        query = query.filter(db.or_(
+            model.created_at < anchor_created_at,
+            db.and_(model.created_at == anchor_created_at, model.id < after_id)
+        ))
+    
+    columns = {getattr(model, field) for field in fields} | {model.id, model.created_at}
+    rows = (
+        query.options(load_only(*columns))
+        .order_by(model.created_at.desc(), model.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {
+        "items": [serialize_row(row, fields) for row in rows[:limit]],
+        "next_cursor": next_cursor
+    }
+
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -148,8 +506,14 @@ def index():
 @login_required
 def dashboard():
     """Render the dashboard page"""
-    patients = PatientDB.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard.html', patients=patients)
+    query = PatientDB.query.filter_by(user_id=current_user.id)
+    page = keyset_page(query, PatientDB, app.config['DEFAULT_PAGE_SIZE'], None, PATIENT_LIST_FIELDS)
+    return render_template(
+        'dashboard.html',
+        patients=page["items"],
+        patient_count=query.count(),
+        next_cursor=page["next_cursor"]
+    )
 
 @app.route('/app')
 @login_required
@@ -163,9 +527,7 @@ def nicu_app_page():
 def get_tpn_compositions():
     """API endpoint to get TPN compositions"""
     try:
-        with open(os.path.join(data_dir, 'tpn_compositions.json'), 'r') as f:
-            tpn_compositions = json.load(f)
-        return jsonify(tpn_compositions)
+        return reference_responses.response('tpn_compositions')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -174,9 +536,7 @@ def get_tpn_compositions():
 def get_solution_compositions():
     """API endpoint to get solution compositions"""
     try:
-        with open(os.path.join(data_dir, 'solution_compositions.json'), 'r') as f:
-            solution_compositions = json.load(f)
-        return jsonify(solution_compositions)
+        return reference_responses.response('solution_compositions')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -185,31 +545,38 @@ def get_solution_compositions():
 def get_fluid_requirements():
     """API endpoint to get fluid requirements"""
     try:
-        with open(os.path.join(data_dir, 'fluid_requirements.json'), 'r') as f:
-            fluid_requirements = json.load(f)
-        return jsonify(fluid_requirements)
+        return reference_responses.response('fluid_requirements')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/data/enteral_compositions', methods=['GET'])
+@login_required
+def get_enteral_compositions():
+    """API endpoint to get enteral feed and fortifier compositions"""
+    try:
+        return reference_responses.response('enteral_compositions')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/data/bundle', methods=['GET'])
+@login_required
+def get_reference_bundle():
+    """API endpoint to get all reference data in one versioned payload"""
+    try:
+        return reference_responses.response('bundle')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/patients', methods=['GET'])
 @login_required
 def get_patients():
-    """API endpoint to get all patients for the current user"""
+    """API endpoint to get the patients of the current user, one page at a time"""
     try:
-        patients = PatientDB.query.filter_by(user_id=current_user.id).all()
-        result = []
-        for patient in patients:
-            result.append({
-                'patient_id': patient.patient_id,
-                'gestational_age_at_birth': patient.gestational_age_at_birth,
-                'birth_weight': patient.birth_weight,
-                'current_weight': patient.current_weight,
-                'postnatal_age': patient.postnatal_age,
-                'phototherapy': patient.phototherapy,
-                'clinical_condition': patient.clinical_condition,
-                'created_at': patient.created_at.isoformat()
-            })
-        return jsonify(result)
+        limit, after_id, fields = page_params(PATIENT_LIST_FIELDS, PATIENT_LIST_FIELDS)
+        query = PatientDB.query.filter_by(user_id=current_user.id)
+        return jsonify(keyset_page(query, PatientDB, limit, after_id, fields))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -286,22 +653,17 @@ def create_patient():
 @app.route('/api/nutrition_plans/<patient_id>', methods=['GET'])
 @login_required
 def get_nutrition_plans(patient_id):
-    """API endpoint to get all nutrition plans for a patient"""
+    """API endpoint to get the nutrition plans of a patient, one page at a time"""
     try:
         patient = PatientDB.query.filter_by(patient_id=patient_id, user_id=current_user.id).first()
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
         
-        plans = NutritionPlanDB.query.filter_by(patient_id=patient_id, user_id=current_user.id).all()
-        result = []
-        for plan in plans:
-            result.append({
-                'plan_id': plan.plan_id,
-                'date': plan.date.isoformat(),
-                'total_fluid_target': plan.total_fluid_target,
-                'created_at': plan.created_at.isoformat()
-            })
-        return jsonify(result)
+        limit, after_id, fields = page_params(PLAN_LIST_FIELDS, PLAN_LIST_DEFAULT_FIELDS)
+        query = NutritionPlanDB.query.filter_by(patient_id=patient_id, user_id=current_user.id)
+        return jsonify(keyset_page(query, NutritionPlanDB, limit, after_id, fields))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -329,7 +691,7 @@ def get_nutrition_plan(plan_id):
             'enteral_feeding_type': plan.enteral_feeding_type,
             'enteral_feeding_frequency': plan.enteral_feeding_frequency,
             'bmf_concentration': plan.bmf_concentration,
-            'calculated_values': json.loads(plan.calculated_values) if plan.calculated_values else {},
+            'calculated_values': stored_calculated_values(plan),
             'recommendations': json.loads(plan.recommendations) if plan.recommendations else [],
             'feeding_schedule': json.loads(plan.feeding_schedule) if plan.feeding_schedule else []
         }
@@ -337,6 +699,82 @@ def get_nutrition_plan(plan_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def keep(value):
+    """Return a request value unchanged"""
+    return value
+
+# Nutrition plan inputs in request bodies: (request key, NutritionPlan field, conversion, default)
+PLAN_REQUEST_FIELDS = (
+    ('totalFluidTarget', 'total_fluid_target', float, 0),
+    ('enteralVolume', 'enteral_volume', float, 0),
+    ('tpnType', 'tpn_type', keep, 'NICU-mix'),
+    ('tpnVolume', 'tpn_volume', float, 0),
+    ('lipidType', 'lipid_type', keep, 'Intralipid_20%'),
+    ('lipidVolume', 'lipid_volume', float, 0),
+    ('glucoseConcentration', 'glucose_concentration', keep, '10%'),
+    ('glucoseVolume', 'glucose_volume', float, 0),
+    ('enteralFeedingType', 'enteral_feeding_type', keep, None),
+    ('enteralFeedingFrequency', 'enteral_feeding_frequency', int, 0),
+    ('bmfConcentration', 'bmf_concentration', float, 0),
+)
+
+def parse_plan_fields(data):
+    """Convert a nutrition plan request body into NutritionPlan keyword arguments"""
+    return {
+        field: convert(data.get(key, default))
+        for key, field, convert, default in PLAN_REQUEST_FIELDS
+    }
+
+def parse_plan_changes(data):
+    """Convert a partial nutrition plan request body into the fields it changes"""
+    keys = {key for key, _, _, _ in PLAN_REQUEST_FIELDS}
+    unknown = sorted(set(data) - keys)
+    if unknown:
+        raise ValueError(f"Unknown or read-only nutrition plan fields: {', '.join(unknown)}")
+    return {
+        field: convert(data[key])
+        for key, field, convert, _ in PLAN_REQUEST_FIELDS
+        if key in data
+    }
+
+def new_plan_id(patient_id):
+    """
+    Create a unique nutrition plan ID. The full random UUID makes collisions
+    negligible; the unique constraint on plan_id rejects any that remain.
+    """
+    return f"NP-{patient_id}-{date.today().strftime('%Y%m%d')}-{uuid.uuid4().hex}"
+
+def apply_evaluation(record, evaluation):
+    """Store the results of a plan evaluation on its database row"""
+    for column in CALCULATED_VALUE_COLUMNS:
+        setattr(record, column, evaluation["calculated_values"][column])
+    record.reference_version = evaluation["calculated_values"]["reference_version"]
+    record.weight_category = evaluation["weight_category"]
+    record.recommendations = json.dumps(evaluation["recommendations"])
+    record.feeding_schedule = json.dumps(evaluation["feeding_schedule"])
+    return record
+
+def build_plan_record(plan_id, patient_id, fields, evaluation):
+    """Create the database row for an evaluated nutrition plan"""
+    record = NutritionPlanDB(
+        plan_id=plan_id,
+        patient_id=patient_id,
+        user_id=current_user.id,
+        date=date.today(),
+        **fields
+    )
+    return apply_evaluation(record, evaluation)
+
+def plan_result(plan_id, evaluation):
+    """Build the API response for a created nutrition plan"""
+    return {
+        "success": True,
+        "plan_id": plan_id,
+        "calculated_values": evaluation["calculated_values"],
+        "recommendations": evaluation["recommendations"],
+        "feeding_schedule": evaluation["feeding_schedule"]
+    }
+
 @app.route('/api/nutrition_plan', methods=['POST'])
 @login_required
 def create_nutrition_plan():
@@ -349,87 +787,297 @@ def create_nutrition_plan():
         if not patient:
             return jsonify({"error": "Patient not found or access denied"}), 404
         
-        # Create a unique plan ID
-        plan_id = f"NP-{data['patientId']}-{date.today().strftime('%Y%m%d')}-{uuid.uuid4().hex[:4]}"
+        plan_id = new_plan_id(data['patientId'])
+        fields = parse_plan_fields(data)
         
         # Create nutrition plan in memory for calculations
-        nutrition_plan = nicu_app.create_nutrition_plan(
+        nicu_app.create_nutrition_plan(
             plan_id=plan_id,
             patient_id=data['patientId'],
             date=date.today(),
-            total_fluid_target=float(data.get('totalFluidTarget', 0)),
-            enteral_volume=float(data.get('enteralVolume', 0)),
-            tpn_type=data.get('tpnType', 'NICU-mix'),
-            tpn_volume=float(data.get('tpnVolume', 0)),
-            lipid_type=data.get('lipidType', 'Intralipid_20%'),
-            lipid_volume=float(data.get('lipidVolume', 0)),
-            glucose_concentration=data.get('glucoseConcentration', '10%'),
-            glucose_volume=float(data.get('glucoseVolume', 0)),
-            enteral_feeding_type=data.get('enteralFeedingType', None),
-            enteral_feeding_frequency=int(data.get('enteralFeedingFrequency', 0)),
-            bmf_concentration=float(data.get('bmfConcentration', 0))
+            **fields
         )
         
-        # Calculate nutrition values
-        nicu_app.calculate_nutrition_values(plan_id)
-        
-        # Generate recommendations
-        recommendations = nicu_app.generate_recommendations(plan_id)
-        
-        # Get feeding schedule
-        feeding_schedule = nicu_app.get_feeding_schedule(plan_id)
-        
-        # Prepare calculated values
-        calculated_values = {
-            "total_energy": nutrition_plan.total_energy,
-            "total_protein": nutrition_plan.total_protein,
-            "total_carbohydrate": nutrition_plan.total_carbohydrate,
-            "total_fat": nutrition_plan.total_fat,
-            "total_sodium": nutrition_plan.total_sodium,
-            "total_potassium": nutrition_plan.total_potassium,
-            "total_calcium": nutrition_plan.total_calcium,
-            "total_phosphate": nutrition_plan.total_phosphate,
-            "total_magnesium": nutrition_plan.total_magnesium,
-            "glucose_infusion_rate": nutrition_plan.glucose_infusion_rate,
-            "total_parenteral_volume": nutrition_plan.calculate_parenteral_volume(),
-            "total_fluid": nutrition_plan.calculate_total_fluid()
-        }
+        # Calculate nutrition values, recommendations and feeding schedule in one pass
+        evaluation = nicu_app.evaluate_plan(plan_id).to_dict()
         
         # Save nutrition plan to database
-        db_plan = NutritionPlanDB(
-            plan_id=plan_id,
-            patient_id=data['patientId'],
-            user_id=current_user.id,
-            date=date.today(),
-            total_fluid_target=float(data.get('totalFluidTarget', 0)),
-            enteral_volume=float(data.get('enteralVolume', 0)),
-            tpn_type=data.get('tpnType', 'NICU-mix'),
-            tpn_volume=float(data.get('tpnVolume', 0)),
-            lipid_type=data.get('lipidType', 'Intralipid_20%'),
-            lipid_volume=float(data.get('lipidVolume', 0)),
-            glucose_concentration=data.get('glucoseConcentration', '10%'),
-            glucose_volume=float(data.get('glucoseVolume', 0)),
-            enteral_feeding_type=data.get('enteralFeedingType', None),
-            enteral_feeding_frequency=int(data.get('enteralFeedingFrequency', 0)),
-            bmf_concentration=float(data.get('bmfConcentration', 0)),
-            calculated_values=json.dumps(calculated_values),
-            recommendations=json.dumps(recommendations),
-            feeding_schedule=json.dumps(feeding_schedule)
+        db.session.add(build_plan_record(plan_id, data['patientId'], fields, evaluation))
+        db.session.commit()
+        
+        with span('serialize'):
+            return jsonify(plan_result(plan_id, evaluation))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/nutrition_plan/<plan_id>', methods=['PATCH'])
+@login_required
+def update_nutrition_plan(plan_id):
+    """API endpoint to change inputs of a nutrition plan, recalculating only what they affect"""
+    try:
+        record = NutritionPlanDB.query.filter_by(plan_id=plan_id, user_id=current_user.id).first()
+        if not record:
+            return jsonify({"error": "Nutrition plan not found or access denied"}), 404
+        
+        data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        changes = parse_plan_changes(data)
+        
+        # The cached plan may predate changes made through another worker
+        nutrition_plan = nicu_app.nutrition_plans.get(plan_id)
+        nutrition_plan.update(**{field: getattr(record, field) for field in PLAN_INPUT_FIELDS})
+        
+        try:
+            evaluation, changed = nicu_app.update_nutrition_plan(plan_id, **changes)
+            for field in changed["fields"]:
+                setattr(record, field, getattr(nutrition_plan, field))
+            evaluation = evaluation.to_dict()
+            apply_evaluation(record, evaluation)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            nicu_app.nutrition_plans.pop(plan_id)
+            raise
+        
+        result = plan_result(plan_id, evaluation)
+        result["changes"] = changed
+        return jsonify(result)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Plan inputs the feeding schedule depends on
+SCHEDULE_FIELDS = {'enteral_volume', 'enteral_feeding_frequency', 'enteral_feeding_type'}
+
+def recompute_result(sequence, evaluation, changes):
+    """Build the response of a live recompute with only the results that changed"""
+    result = {"seq": sequence, "full": changes["full"]}
+    if changes["full"]:
+        result.update(evaluation)
+        return result
+    
+    result["calculated_values"] = {
+        name: evaluation["calculated_values"][name] for name in changes["calculated_values"]
+    }
+    if changes["recommendation_checks"]:
+        result["recommendations"] = evaluation["recommendations"]
+    if SCHEDULE_FIELDS.intersection(changes["fields"]):
+        result["feeding_schedule"] = evaluation["feeding_schedule"]
+    return result
+
+@app.route('/api/plan/recompute', methods=['POST'])
+@login_required
+def recompute_plan():
+    """
+    API endpoint to recalculate a plan while it is being edited.
+    Nothing is stored; the response only contains the results that changed
+    since the caller's previous call, and stale calls are answered with 409.
+    """
+    try:
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get('patient'), dict):
+            return jsonify({"error": "Expected a JSON object with patient and plan"}), 400
+        
+        patient_data = data['patient']
+        patient = Patient(
+            patient_data.get('patientId'),
+            float(patient_data['gestationalAge']),
+            int(patient_data['birthWeight']),
+            int(patient_data.get('currentWeight') or patient_data['birthWeight']),
+            int(patient_data['postnatalAge']),
+            patient_data.get('phototherapy'),
+            patient_data.get('clinicalCondition', 'Normal')
         )
+        sequence = int(data['seq'])
+        base_sequence = data.get('baseSeq')
+        base_sequence = int(base_sequence) if base_sequence is not None else None
         
-        db.session.add(db_plan)
-        db.session.commit()
+        recomputed = nicu_app.recompute_draft(
+            f"{current_user.id}:{data.get('draftId')}",
+            patient,
+            sequence,
+            base_sequence,
+            **parse_plan_changes(data.get('plan', {}))
+        )
+        if recomputed is None:
+            return jsonify({"error": "A newer recompute has already been applied", "seq": sequence}), 409
         
-        # Prepare response
-        response = {
-            "success": True,
-            "plan_id": plan_id,
-            "calculated_values": calculated_values,
-            "recommendations": recommendations,
-            "feeding_schedule": feeding_schedule
+        evaluation, changes = recomputed
+        return jsonify(recompute_result(sequence, evaluation.to_dict(), changes))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/nutrition_plans:batch', methods=['POST'])
+@login_required
+def create_nutrition_plans_batch():
+    """
+    API endpoint to create several nutrition plans at once.
+    Valid plans are calculated in one batch and saved in a single transaction;
+    invalid plans are reported per item without affecting the others.
+    """
+    try:
+        data = request.json
+        if not isinstance(data, list):
+            return jsonify({"error": "Expected a JSON array of nutrition plans"}), 400
+        
+        max_batch_size = app.config['MAX_PLAN_BATCH_SIZE']
+        if len(data) > max_batch_size:
+            return jsonify({"error": f"Batch contains {len(data)} plans, the maximum is {max_batch_size}"}), 413
+        
+        # Look up all referenced patients of the current user in one query
+        patient_ids = {item.get('patientId') for item in data if isinstance(item, dict)}
+        owned_patients = {
+            patient_id for (patient_id,) in db.session.query(PatientDB.patient_id).filter(
+                PatientDB.patient_id.in_(patient_ids),
+                PatientDB.user_id == current_user.id
+            )
+        }
+        
+        results = [None] * len(data)
+        accepted = []
+        for index, item in enumerate(data):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Nutrition plan must be a JSON object")
+                if item.get('patientId') not in owned_patients:
+                    raise ValueError("Patient not found or access denied")
+                
+                plan_id = new_plan_id(item['patientId'])
+                fields = parse_plan_fields(item)
+                nicu_app.create_nutrition_plan(
+                    plan_id=plan_id,
+                    patient_id=item['patientId'],
+                    date=date.today(),
+                    **fields
+                )
+                accepted.append((index, plan_id, item['patientId'], fields))
+            except (KeyError, TypeError, ValueError) as e:
+                results[index] = {"index": index, "success": False, "error": str(e)}
+        
+        try:
+            # Calculate all accepted plans in one batch
+            evaluations = nicu_app.evaluate_plans([plan_id for _, plan_id, _, _ in accepted])
+            
+            records = []
+            for (index, plan_id, patient_id, fields), evaluation in zip(accepted, evaluations):
+                evaluation = evaluation.to_dict()
+                records.append(build_plan_record(plan_id, patient_id, fields, evaluation))
+                results[index] = {"index": index, **plan_result(plan_id, evaluation)}
+            
+            # Save all plans in a single transaction
+            db.session.add_all(records)
+            db.session.commit()
+        except Exception:
+            # None of the plans were saved, so none may stay in memory
+            db.session.rollback()
+            for _, plan_id, _, _ in accepted:
+                nicu_app.nutrition_plans.pop(plan_id)
+            raise
+        
+        return jsonify({
+            "success": len(accepted) == len(data),
+            "created": len(accepted),
+            "failed": len(data) - len(accepted),
+            "results": results
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/parenteral_suggestions', methods=['POST'])
+@login_required
+def suggest_parenteral_volumes():
+    """API endpoint to suggest TPN, lipid and glucose volumes for several patients at once"""
+    try:
+        data = request.json
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return jsonify({"error": "Expected a JSON array of patients"}), 400
+        
+        max_batch_size = app.config['MAX_PLAN_BATCH_SIZE']
+        if len(data) > max_batch_size:
+            return jsonify({"error": f"Request contains {len(data)} patients, the maximum is {max_batch_size}"}), 413
+        
+        patient_ids = [item.get('patientId') for item in data]
+        owned_patients = {
+            patient_id for (patient_id,) in db.session.query(PatientDB.patient_id).filter(
+                PatientDB.patient_id.in_(set(patient_ids)),
+                PatientDB.user_id == current_user.id
+            )
         }
+        missing = [patient_id for patient_id in patient_ids if patient_id not in owned_patients]
+        if missing:
+            return jsonify({"error": f"Patients not found or access denied: {', '.join(map(str, missing))}"}), 404
         
-        return jsonify(response)
+        enteral_volumes = [float(item.get('enteralVolume', 0)) for item in data]
+        enteral_feeding_types = [item.get('enteralFeedingType') for item in data]
+        bmf_concentrations = [float(item.get('bmfConcentration') or 0) for item in data]
+        return jsonify({"suggestions": nicu_app.suggest_parenteral_volumes(
+            patient_ids, enteral_volumes, enteral_feeding_types, bmf_concentrations
+        )})
+    except CompositionError as e:
+        return jsonify({"error": str(e)}), 422
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def whatif_range(spec):
+    """Parse a what-if volume as (min, max, step) from a number or a {min, max, step} object"""
+    if spec is None:
+        return (0.0, 0.0, 1.0)
+    if isinstance(spec, dict):
+        minimum = float(spec.get('min', 0))
+        return (minimum, float(spec.get('max', minimum)), float(spec.get('step', 1)))
+    return (float(spec), float(spec), 1.0)
+
+def whatif_limit(name, value, maximum):
+    """Check a requested number of combinations to return and cap it at maximum"""
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError(f"{name} must be a positive integer")
+    return min(value, maximum)
+
+@app.route('/api/plan/whatif', methods=['POST'])
+@login_required
+def evaluate_whatif():
+    """API endpoint to evaluate a grid of TPN, lipid and glucose volumes without storing a plan"""
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        
+        patient = PatientDB.query.filter_by(patient_id=data.get('patientId'), user_id=current_user.id).first()
+        if not patient:
+            return jsonify({"error": "Patient not found or access denied"}), 404
+        
+        ranges = [whatif_range(data.get(name)) for name in ('tpnVolume', 'lipidVolume', 'glucoseVolume')]
+        combinations = 1
+        for volume_range in ranges:
+            combinations *= axis_size(*volume_range)
+        max_combinations = app.config['WHATIF_MAX_COMBINATIONS']
+        if combinations > max_combinations:
+            return jsonify({"error": f"Grid has {combinations} combinations, the maximum is {max_combinations}"}), 413
+        
+        feasible_limit = app.config['WHATIF_FEASIBLE_LIMIT']
+        result = nicu_app.evaluate_volume_grid(
+            patient.patient_id,
+            *(volume_axis(*volume_range) for volume_range in ranges),
+            tpn_type=data.get('tpnType', 'NICU-mix'),
+            lipid_type=data.get('lipidType', 'SMOF_20%'),
+            glucose_concentration=data.get('glucoseConcentration', '10%'),
+            target=data.get('target', 'max'),
+            enteral_volume=float(data.get('enteralVolume', 0)),
+            enteral_feeding_type=data.get('enteralFeedingType'),
+            bmf_concentration=float(data.get('bmfConcentration') or 0),
+            feasible_limit=whatif_limit('feasibleLimit', data.get('feasibleLimit', feasible_limit), feasible_limit),
+            pareto_limit=whatif_limit('paretoLimit', data.get('paretoLimit', 20), app.config['WHATIF_MAX_PARETO_LIMIT'])
+        )
+        return jsonify(result)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -472,7 +1120,7 @@ def export_plan(plan_id):
                 "enteral_feeding_frequency": plan.enteral_feeding_frequency,
                 "bmf_concentration": plan.bmf_concentration
             },
-            "calculated_values": json.loads(plan.calculated_values) if plan.calculated_values else {},
+            "calculated_values": stored_calculated_values(plan),
             "recommendations": json.loads(plan.recommendations) if plan.recommendations else [],
             "feeding_schedule": json.loads(plan.feeding_schedule) if plan.feeding_schedule else []
         }
@@ -481,6 +1129,379 @@ def export_plan(plan_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/reports/nutrition_by_weight_category', methods=['GET'])
+@login_required
+def nutrition_by_weight_category():
+    """API endpoint to summarize the calculated intake of plans per weight category"""
+    try:
+        start, end = date_range_params()
+        
+        query = db.session.query(
+            NutritionPlanDB.weight_category,
+            func.count(NutritionPlanDB.id),
+            func.avg(NutritionPlanDB.total_energy),
+            func.avg(NutritionPlanDB.total_protein),
+            func.min(NutritionPlanDB.total_protein),
+            func.max(NutritionPlanDB.total_protein),
+            func.avg(NutritionPlanDB.glucose_infusion_rate),
+            func.avg(NutritionPlanDB.total_fluid)
+        ).filter(
+            NutritionPlanDB.user_id == current_user.id,
+            NutritionPlanDB.total_energy.isnot(None)
+        )
+        if start:
+            query = query.filter(NutritionPlanDB.date >= start)
+        if end:
+            query = query.filter(NutritionPlanDB.date <= end)
+        rows = query.group_by(NutritionPlanDB.weight_category).all()
+        
+        categories = [
+            {
+                "weight_category": category,
+                "plan_count": count,
+                "mean_energy": mean_energy,
+                "mean_protein": mean_protein,
+                "min_protein": min_protein,
+                "max_protein": max_protein,
+                "mean_glucose_infusion_rate": mean_gir,
+                "mean_total_fluid": mean_fluid
+            }
+            for category, count, mean_energy, mean_protein, min_protein, max_protein, mean_gir, mean_fluid in rows
+        ]
+        return jsonify({
+            "start": request.args.get('start'),
+            "end": request.args.get('end'),
+            "categories": categories
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def export_partitions(query):
+    """Yield the rows of a query in lists of EXPORT_BATCH_SIZE, streamed from a server-side cursor"""
+    result = db.session.execute(
+        query.execution_options(stream_results=True, yield_per=app.config['EXPORT_BATCH_SIZE'])
+    )
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def ndjson_chunks(partitions, fields):
+    """Format row partitions as newline-delimited JSON objects"""
+    for rows in partitions:
+        yield "".join(json.dumps(dict(zip(fields, row)), default=date.isoformat) + "\n" for row in rows)
+
+def csv_chunks(partitions, fields):
+    """Format row partitions as CSV with a header line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+EXPORT_WRITERS = {'ndjson': ndjson_chunks, 'csv': csv_chunks}
+
+def export_query(user_id, patient_id=None, start=None, end=None):
+    """Build the query selecting the export columns of a user's plans, ordered by date"""
+    table = NutritionPlanDB.__table__
+    query = select(*[table.c[field] for field in EXPORT_FIELDS]).where(table.c.user_id == user_id)
+    if patient_id:
+        query = query.where(table.c.patient_id == patient_id)
+    if start:
+        query = query.where(table.c.date >= start)
+    if end:
+        query = query.where(table.c.date <= end)
+    return query.order_by(table.c.date, table.c.id)
+
+@app.route('/api/export/plans', methods=['GET'])
+@login_required
+def export_plans():
+    """API endpoint to stream all nutrition plans of the current user as NDJSON or CSV"""
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_WRITERS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        start, end = date_range_params()
+        query = export_query(current_user.id, request.args.get('patient_id'), start, end)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    chunks = EXPORT_WRITERS[export_format](export_partitions(query), EXPORT_FIELDS)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_MEDIA_TYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename=nutrition_plans.{export_format}'}
+    )
+
+# Background jobs
+def export_plans_job(params, context):
+    """Write an export of the user's nutrition plans to a result file"""
+    export_format = params.get('format', 'ndjson')
+    start = date.fromisoformat(params['start']) if params.get('start') else None
+    end = date.fromisoformat(params['end']) if params.get('end') else None
+    
+    with app.app_context():
+        query = export_query(context.user_id, params.get('patient_id'), start, end)
+        total = db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+        
+        filename = context.result_file(f".{export_format}")
+        exported = 0
+        
+        def counted_partitions():
+            nonlocal exported
+            for rows in export_partitions(query):
+                yield rows
+                exported += len(rows)
+                context.progress(exported, total, f"Exported {exported} of {total} plans")
+        
+        with open(filename, 'w', newline='') as f:
+            for chunk in EXPORT_WRITERS[export_format](counted_partitions(), EXPORT_FIELDS):
+                f.write(chunk)
+    
+    return {"file": filename, "format": export_format, "rows": exported}
+
+def recompute_plans_job(params, context):
+    """Recalculate the stored values of the user's nutrition plans with the current reference data"""
+    with app.app_context():
+        query = NutritionPlanDB.query.filter_by(user_id=context.user_id)
+        if params.get('patient_id'):
+            query = query.filter_by(patient_id=params['patient_id'])
+        total = query.count()
+        
+        # Walk the plans by (created_at, id), the order of the plan indexes. Like keyset_page, the
+        # last row's created_at is looked up in the query so the comparison uses the stored value.
+        recomputed = 0
+        last_id = None
+        while True:
+            page = query
+            if last_id is not None:
+                last_created_at = db.session.query(NutritionPlanDB.created_at).filter(
+                    NutritionPlanDB.id == last_id
+                ).scalar_subquery()
+                page = page.filter(
+                    db.tuple_(NutritionPlanDB.created_at, NutritionPlanDB.id) > db.tuple_(last_created_at, last_id)
+                )
+            rows = page.order_by(NutritionPlanDB.created_at, NutritionPlanDB.id).limit(
+                app.config['MAX_PLAN_BATCH_SIZE']
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            # Calculate from the rows' inputs: a cached plan may predate changes made through another worker
+            patients = {
+                patient.patient_id: patient_from_row(patient)
+                for patient in PatientDB.query.filter(
+                    PatientDB.patient_id.in_({row.patient_id for row in rows}),
+                    PatientDB.user_id == context.user_id
+                )
+            }
+            evaluations = nicu_app.evaluate_detached_plans(
+                [nutrition_plan_from_row(row) for row in rows],
+                [patients[row.patient_id] for row in rows]
+            )
+            for row, evaluation in zip(rows, evaluations):
+                apply_evaluation(row, evaluation.to_dict())
+            db.session.commit()
+            
+            recomputed += len(rows)
+            context.progress(recomputed, total, f"Recomputed {recomputed} of {total} plans")
+    
+    return {"recomputed": recomputed, "reference_version": nicu_app.calculator.reference_version}
+
+JOB_HANDLERS = {
+    'export_plans': export_plans_job,
+    'recompute_plans': recompute_plans_job,
+}
+
+def check_job_params(kind, params):
+    """Validate the parameters of a job before it is queued"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if not isinstance(params, dict):
+        raise ValueError("Job params must be a JSON object")
+    if params.get('format', 'ndjson') not in EXPORT_WRITERS:
+        raise ValueError(f"Unknown export format: {params['format']}")
+    for key in ('start', 'end'):
+        if params.get(key):
+            date.fromisoformat(params[key])
+    return params
+
+def init_job_worker():
+    """Drop the database connections a job worker inherited from its parent process"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+job_queue = JobQueue(app.config['JOB_DATABASE'])
+job_workers = WorkerPool(
+    job_queue,
+    JOB_HANDLERS,
+    processes=app.config['JOB_WORKERS'],
+    initializer=init_job_worker,
+    retention=app.config['JOB_RETENTION_HOURS'] * 3600
+)
+
+def job_view(job):
+    """Build the API representation of a job"""
+    view = {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "error": job["error"],
+        "cancel_requested": job["cancel_requested"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "status_url": url_for('get_job', job_id=job["job_id"])
+    }
+    if job["status"] == SUCCEEDED:
+        view["result_url"] = url_for('get_job_result', job_id=job["job_id"])
+    return view
+
+def get_own_job(job_id):
+    """Get a job of the current user, or None"""
+    job = job_queue.get(job_id)
+    if job is None or job["user_id"] != current_user.id:
+        return None
+    return job
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def submit_job():
+    """API endpoint to queue a background job"""
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        kind = data.get('kind')
+        params = check_job_params(kind, data.get('params', {}))
+        
+        job_id = job_queue.submit(kind, params, user_id=current_user.id)
+        job_workers.start()
+        return jsonify(job_view(job_queue.get(job_id))), 202, {'Location': url_for('get_job', job_id=job_id)}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """API endpoint to get the status and progress of a job"""
+    try:
+        job = get_own_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job_view(job))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@login_required
+def get_job_result(job_id):
+    """API endpoint to get the result of a finished job"""
+    try:
+        job = get_own_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] != SUCCEEDED:
+            return jsonify({"error": f"Job is {job['status']}", "job": job_view(job)}), 409
+        
+        result = job["result"]
+        if isinstance(result, dict) and result.get("file"):
+            return send_file(
+                os.path.abspath(result["file"]),
+                mimetype=EXPORT_MEDIA_TYPES.get(result.get("format"), 'application/octet-stream'),
+                as_attachment=True,
+                download_name=f"nutrition_plans.{result.get('format')}"
+            )
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """API endpoint to cancel a queued or running job"""
+    try:
+        job = get_own_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] in FINISHED_STATUSES or not job_queue.cancel(job_id):
+            return jsonify({"error": f"Job is already {job_queue.get(job_id)['status']}"}), 409
+        return jsonify(job_view(job_queue.get(job_id)))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/profiles/token', methods=['POST'])
+@login_required
+def create_profile_token():
+    """API endpoint to get a token for profiling requests to one path"""
+    if not is_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    data = request.json
+    path = data.get('path') if isinstance(data, dict) else None
+    if not isinstance(path, str) or not path.startswith('/'):
+        return jsonify({"error": "path must be a URL path starting with /"}), 400
+    return jsonify({
+        "token": request_profiler.make_token(path),
+        "path": path,
+        "expires_in": request_profiler.token_max_age,
+        "header": "X-Profile-Token"
+    })
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@login_required
+def list_profiles():
+    """API endpoint to list the saved request profiles, newest first"""
+    if not is_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    profiles = request_profiler.store.list()
+    for profile in profiles:
+        profile["files"] = {
+            kind: url_for('download_profile', profile_id=profile["id"], kind=kind)
+            for kind in PROFILE_KINDS
+        }
+    return jsonify({"profiles": profiles})
+
+@app.route('/api/admin/profiles/<profile_id>.<kind>', methods=['GET'])
+@login_required
+def download_profile(profile_id, kind):
+    """API endpoint to download a saved profile as pstats or collapsed stacks"""
+    if not is_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    path = request_profiler.store.path(profile_id, kind) if kind in PROFILE_KINDS else None
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(
+        os.path.abspath(path),
+        mimetype='text/plain' if kind == 'collapsed' else 'application/octet-stream',
+        as_attachment=True,
+        download_name=f"{profile_id}.{kind}"
+    )
+
+@app.route('/api/admin/memory', methods=['GET'])
+@login_required
+def memory_report():
+    """API endpoint to get the memory report of every worker process"""
+    if not is_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    # ?snapshot=1 compares a new tracemalloc snapshot of the worker handling this request
+    if request.args.get('snapshot') == '1':
+        memory_monitor.snapshot()
+    return jsonify({
+        "tracemalloc": app.config['MEMORY_TRACEMALLOC_FRAMES'] > 0,
+        "workers": memory_monitor.collect()
+    })
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -494,6 +1515,7 @@ def internal_server_error(e):
 @app.before_first_request
 def create_tables():
     db.create_all()
+    run_migrations(db.engine)
     
     # Create admin user if it doesn't exist
     admin = User.query.filter_by(username='admin').first()
@@ -502,6 +1524,8 @@ def create_tables():
         admin.set_password('admin')
         db.session.add(admin)
         db.session.commit()
+    
+    job_workers.start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)